@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from accounts.models import Account, UserProfile
+from accounts.models import Account, UserProfile, EmailOutbox
 
 admin.site.register(Account)
 admin.site.register(UserProfile)
+admin.site.register(EmailOutbox)
@@ -0,0 +1,47 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+
+from accounts.email_templates import renderer
+from perfumes.models import Offer
+
+
+class Command(BaseCommand):
+    help = ('Render an email template COUNT times with render_to_string and with the precompiled renderer and '
+            'report the time per message, to size the email batch workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default='emails/email_confirm.html')
+        parser.add_argument('--count', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        name, count = options['template'], options['count']
+        if name not in renderer.templates():
+            raise CommandError(f'Unknown email template {name}, expected one of {", ".join(renderer.templates())}')
+        offer = Offer.objects.select_related('brand', 'perfume', 'category').first()
+        contexts = [
+            {'link': f'http://localhost:8000/confirm-email/token{i}/', 'confirmation_link':
+                f'http://localhost:8000/confirm-email/token{i}/', 'token': f'token{i}', 'password': f'pw{i}',
+             'offer': offer}
+            for i in range(count)
+        ]
+
+        started = time.perf_counter()
+        for context in contexts:
+            render_to_string(name, context)
+        baseline = time.perf_counter() - started
+
+        started = time.perf_counter()
+        renderer.render_many(name, contexts)
+        precompiled = time.perf_counter() - started
+
+        self.stdout.write(json.dumps({
+            'template': name,
+            'messages': count,
+            'render_to_string_ms_per_message': round(baseline * 1000 / count, 4),
+            'precompiled_ms_per_message': round(precompiled * 1000 / count, 4),
+            'precompiled_messages_per_second': round(count / precompiled) if precompiled else None,
+            'renderer_stats': renderer.stats(),
+        }, indent=2))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import drain
+
+
+class Command(BaseCommand):
+    help = 'Send the pending emails of the outbox, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Emails per batch (default: EMAIL_OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--interval', type=float, help='Keep running and drain every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain(batch_size=options['batch_size'])
+            if sent or failed or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed.'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
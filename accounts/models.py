@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.db import models
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 
 
@@ -81,6 +82,8 @@ class UserProfile(models.Model):
     address_line = models.CharField(blank=True, max_length=100)
     profile_picture = models.ImageField(blank=True, upload_to='userprofile/',
                                         default='/userprofile/default_profile.png')
+    # thumbnails and WebP/JPEG copies of the picture, made by images.pipeline
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     city = models.CharField(blank=True, max_length=20)
     could_sell = models.BooleanField(default=False)
 
@@ -89,3 +92,33 @@ class UserProfile(models.Model):
 
     def is_complete(self):
         return all([self.address_line, self.city, self.profile_picture])
+
+
+class EmailOutbox(models.Model):
+    """
+    An email waiting to be sent. Rows are written in the transaction of the
+    change that causes the email and sent later by accounts.outbox.drain.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    recipient = models.EmailField(max_length=100)
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    dedup_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f'{self.subject} -> {self.recipient} ({self.status})'
@@ -0,0 +1,120 @@
+"""
+Transactional email outbox.
+
+Views call enqueue_email inside their transaction instead of talking to SMTP,
+so a request never waits on the mail server and an email only goes out if the
+change that caused it was committed. drain() sends what is due in batches over
+one connection to the email backend, run periodically by the
+drain_email_outbox Celery task or the drain_email_outbox management command.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from accounts.models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(recipient, subject, body, html_body='', from_email=None, dedup_key=None):
+    """
+    Queue an email. A second email with the same dedup_key is dropped, so
+    retried requests don't mail the user twice.
+    """
+    fields = {
+        'recipient': recipient,
+        'subject': subject,
+        'body': body,
+        'html_body': html_body,
+        'from_email': from_email or settings.EMAIL_HOST_USER,
+    }
+    if dedup_key is None:
+        return EmailOutbox.objects.create(**fields)
+    try:
+        # the savepoint keeps a duplicate from breaking the caller's transaction
+        with transaction.atomic():
+            return EmailOutbox.objects.create(dedup_key=dedup_key, **fields)
+    except IntegrityError:
+        return EmailOutbox.objects.get(dedup_key=dedup_key)
+
+
+def enqueue_emails(emails):
+    """
+    Queue many emails with one bulk insert. Takes dicts with the arguments of
+    enqueue_email; emails whose dedup_key is already queued are dropped.
+    """
+    rows = [EmailOutbox(**{**email, 'from_email': email.get('from_email') or settings.EMAIL_HOST_USER})
+            for email in emails]
+    return EmailOutbox.objects.bulk_create(rows, batch_size=settings.EMAIL_OUTBOX_BATCH_SIZE, ignore_conflicts=True)
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(email.subject, email.body, email.from_email, [email.recipient],
+                                     connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def _send_batch(emails, connection, max_attempts):
+    now = timezone.now()
+    sent = 0
+    for email in emails:
+        email.attempts += 1
+        try:
+            connection.send_messages([_message(email, connection)])
+        except Exception as e:
+            logger.warning('Sending email %s failed (attempt %s): %s', email.pk, email.attempts, e)
+            email.last_error = str(e)
+            if email.attempts >= max_attempts:
+                email.status = EmailOutbox.FAILED
+            else:
+                delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+                email.next_attempt_at = now + timedelta(seconds=delay)
+        else:
+            sent += 1
+            email.status = EmailOutbox.SENT
+            email.sent_at = now
+            email.last_error = ''
+            # sent bodies aren't needed anymore and may carry a temporary password
+            email.body = email.html_body = ''
+    EmailOutbox.objects.bulk_update(
+        emails, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at', 'body', 'html_body']
+    )
+    return sent
+
+
+def drain(batch_size=None, max_attempts=None):
+    """
+    Send every pending email that is due and return (sent, failed).
+
+    Batches are locked with SELECT ... FOR UPDATE SKIP LOCKED where the
+    database supports it, so several workers can drain at the same time.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+    connection = get_connection()
+    sent = failed = 0
+    last_pk = 0
+    try:
+        connection.open()
+        while True:
+            with transaction.atomic():
+                emails = list(
+                    EmailOutbox.objects.select_for_update(skip_locked=True)
+                    .filter(status=EmailOutbox.PENDING, next_attempt_at__lte=timezone.now(), pk__gt=last_pk)
+                    .order_by('pk')[:batch_size]
+                )
+                if not emails:
+                    break
+                last_pk = emails[-1].pk
+                batch_sent = _send_batch(emails, connection, max_attempts)
+            sent += batch_sent
+            failed += len(emails) - batch_sent
+    finally:
+        connection.close()
+    return sent, failed
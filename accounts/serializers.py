@@ -3,11 +3,13 @@ from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from images.serializers import ImageVariantsField
 from .models import Account, UserProfile
 
 
 class AccountSerializer(serializers.ModelSerializer):
     profile_picture = serializers.ImageField(source='userprofile.profile_picture', read_only=True)
+    profile_picture_variants = ImageVariantsField(source='userprofile.profile_picture_variants')
     address_line = serializers.CharField(source='userprofile.address_line', read_only=True)
     city = serializers.CharField(source='userprofile.city', read_only=True)
     could_sell = serializers.BooleanField(source='userprofile.could_sell', read_only=True)
@@ -15,7 +17,7 @@ class AccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = Account
         fields = ['id', 'email', 'first_name', 'last_name', 'phone_number',
-                  'profile_picture', 'address_line', 'city', 'could_sell', 'is_confirmed']
+                  'profile_picture', 'profile_picture_variants', 'address_line', 'city', 'could_sell', 'is_confirmed']
 
     def get_isAdmin(self, obj):
         return obj.is_staff
@@ -32,12 +34,34 @@ class AccountSerializerWithToken(AccountSerializer):
         return str(token.access_token)
 
 
+class SellerSummarySerializer(serializers.ModelSerializer):
+    """
+    Public view of a seller embedded in catalog responses: no contact details
+    and no token. Each seller is rendered once per response and reused for
+    every other perfume or offer of theirs.
+    """
+    profile_picture = serializers.ImageField(source='userprofile.profile_picture', read_only=True)
+    profile_picture_variants = ImageVariantsField(source='userprofile.profile_picture_variants')
+    city = serializers.CharField(source='userprofile.city', read_only=True)
+
+    class Meta:
+        model = Account
+        fields = ['id', 'first_name', 'last_name', 'profile_picture', 'profile_picture_variants', 'city']
+
+    def to_representation(self, instance):
+        rendered = self.context.setdefault('seller_summaries', {})
+        if instance.pk not in rendered:
+            rendered[instance.pk] = super().to_representation(instance)
+        return rendered[instance.pk]
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     token = serializers.SerializerMethodField(read_only=True)
+    profile_picture_variants = ImageVariantsField()
 
     class Meta:
         model = UserProfile
-        fields = ['id', 'address_line', 'profile_picture', 'city', 'token']
+        fields = ['id', 'address_line', 'profile_picture', 'profile_picture_variants', 'city', 'token']
 
     def get_token(self, obj):
         user = obj.user
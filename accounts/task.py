@@ -1,7 +1,8 @@
 from celery import shared_task
-from accounts.utils import send_confirmation_email
+from accounts.outbox import drain
 
 
 @shared_task
-def send_confirmation_email_task(user_email, confirmation_token, password=None):
-    send_confirmation_email(user_email, confirmation_token, password)
+def drain_email_outbox_task():
+    sent, failed = drain()
+    return {'sent': sent, 'failed': failed}
@@ -1,3 +1,113 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.template.loader import render_to_string
 from django.test import TestCase
+from django.utils import timezone
+
+from accounts.email_templates import EmailRenderer
+from accounts.models import Account, EmailOutbox
+from accounts.outbox import enqueue_email, drain
+from accounts.utils import queue_confirmation_emails
+
+
+class EmailOutboxTests(TestCase):
+    def register(self, email='buyer@example.com'):
+        return self.client.post('/api/users/register/', {
+            'first_name': 'Ann', 'last_name': 'Lee', 'phone_number': '123', 'email': email, 'password': 'secret',
+        })
+
+    def test_registration_queues_the_confirmation_instead_of_sending_it(self):
+        response = self.register()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(mail.outbox, [])
+        email = EmailOutbox.objects.get()
+        token = Account.objects.get(email='buyer@example.com').confirmation_token
+        self.assertEqual(email.recipient, 'buyer@example.com')
+        self.assertIn(token, email.html_body)
+
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        email.refresh_from_db()
+        self.assertEqual(email.status, EmailOutbox.SENT)
+        self.assertEqual(drain(), (0, 0))
+
+    def test_failed_registration_leaves_no_email(self):
+        with mock.patch.object(Account, 'generate_confirmation_token', side_effect=RuntimeError('boom')):
+            response = self.register()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertFalse(Account.objects.exists())
+
+    def test_dedup_key(self):
+        first = enqueue_email('a@example.com', 'Hi', 'body', dedup_key='welcome:1')
+        second = enqueue_email('a@example.com', 'Hi', 'body', dedup_key='welcome:1')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_batches_share_one_connection(self):
+        for i in range(5):
+            enqueue_email(f'{i}@example.com', 'Hi', 'body')
+
+        with mock.patch('accounts.outbox.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(drain(batch_size=2), (5, 0))
+
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        email = enqueue_email('a@example.com', 'Hi', 'body')
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')), \
+                self.assertLogs('accounts.outbox', 'WARNING'):
+            self.assertEqual(drain(max_attempts=2), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.last_error), (EmailOutbox.PENDING, 1, 'down'))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            # not due yet
+            self.assertEqual(drain(max_attempts=2), (0, 0))
+
+            EmailOutbox.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+            self.assertEqual(drain(max_attempts=2), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (EmailOutbox.FAILED, 2))
+        self.assertEqual(drain(), (0, 0))
+
+    def test_management_command(self):
+        enqueue_email('a@example.com', 'Hi', 'body')
+        stdout = StringIO()
+
+        call_command('drain_email_outbox', stdout=stdout)
+
+        self.assertIn('Sent 1 emails', stdout.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class EmailRendererTests(TestCase):
+    def test_renders_like_render_to_string(self):
+        renderer = EmailRenderer()
+        contexts = [{'confirmation_link': f'http://example.com/{i}/', 'password': '<pw>' if i else None}
+                    for i in range(3)]
+
+        rendered = renderer.render_many('emails/email_confirm.html', contexts)
+
+        self.assertEqual(rendered, [render_to_string('emails/email_confirm.html', context) for context in contexts])
+        self.assertIn('&lt;pw&gt;', rendered[1])
+        self.assertNotIn('temporary password', rendered[0])
+        self.assertEqual(renderer.stats()['emails/email_confirm.html']['renders'], 3)
+
+    def test_bulk_confirmation_emails(self):
+        queue_confirmation_emails([('a@example.com', 'token-a', None), ('b@example.com', 'token-b', 'pw')])
+        queue_confirmation_emails([('a@example.com', 'token-a', None)])
 
-# Create your tests here.
+        self.assertEqual(drain(), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['a@example.com', 'b@example.com'])
@@ -1,31 +1,55 @@
-from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from accounts.email_templates import renderer
+from accounts.outbox import enqueue_email, enqueue_emails
 
+CONFIRMATION_EMAILS = {
+    # email_type: (link, subject, template)
+    'confirm': ('http://localhost:8000/confirm-email/{token}/', 'Confirm Your Email', 'emails/email_confirm.html'),
+    'reset': ('http://localhost:8000/api/users/reset-password-confirm/{token}/', 'Reset Your Password',
+              'emails/password_reset.html'),
+}
 
-def send_confirmation_email(user_email, token, email_type='confirm'):
+
+def queue_confirmation_email(user_email, token, email_type='confirm', password=None):
     """
-    Send an email for account confirmation or password reset.
+    Queue an email for account confirmation or password reset in the outbox.
     :param user_email: Email address of the recipient
     :param token: Confirmation or reset token
     :param email_type: Type of email ('confirm' for account confirmation, 'reset' for password reset)
+    :param password: Temporary password to include, for accounts created at guest checkout
+    """
+    [email] = _confirmation_emails([(user_email, token, password)], email_type)
+    return enqueue_email(**email)
+
+
+def queue_confirmation_emails(recipients, email_type='confirm'):
+    """
+    Queue confirmation or password reset emails for many users at once.
+    :param recipients: (email, token, password) tuples, password may be None
+    :param email_type: Type of email, as for queue_confirmation_email
     """
-    if email_type == 'confirm':
-        link = f"http://localhost:8000/confirm-email/{token}/"
-        subject = 'Confirm Your Email'
-        html_template = 'emails/email_confirm.html'
-    elif email_type == 'reset':
-        link = f"http://localhost:8000/api/users/reset-password-confirm/{token}/"
-        subject = 'Reset Your Password'
-        html_template = 'emails/password_reset.html'
-
-    html_content = render_to_string(html_template, {'link': link})
-
-    send_mail(
-        subject=subject,
-        message=f'Please follow this link: {link}',  # Fallback text for email clients that don't support HTML
-        html_message=html_content,
-        from_email=settings.EMAIL_HOST_USER,
-        recipient_list=[user_email],
-        fail_silently=False,
-    )
+    return enqueue_emails(_confirmation_emails(recipients, email_type))
+
+
+def _confirmation_emails(recipients, email_type):
+    if email_type not in CONFIRMATION_EMAILS:
+        raise ValueError(f'Unknown email type: {email_type}')
+    link, subject, template = CONFIRMATION_EMAILS[email_type]
+    recipients = [(user_email, token, password, link.format(token=token))
+                  for user_email, token, password in recipients]
+
+    html_contents = renderer.render_many(template, [
+        {'link': link, 'confirmation_link': link, 'token': token, 'password': password}
+        for _, token, password, link in recipients
+    ])
+
+    return [
+        {
+            'recipient': user_email,
+            'subject': subject,
+            # Fallback text for email clients that don't support HTML
+            'body': f'Please follow this link: {link}',
+            'html_body': html_content,
+            'dedup_key': f'{email_type}:{token}',
+        }
+        for (user_email, token, _, link), html_content in zip(recipients, html_contents)
+    ]
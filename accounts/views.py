@@ -2,6 +2,7 @@ from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.hashers import make_password, check_password
+from django.db import transaction
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import AuthenticationFailed
@@ -13,7 +14,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 
 from .models import Account, UserProfile
 from .serializers import AccountSerializer, AccountSerializerWithToken, UserProfileSerializer
-from .utils import send_confirmation_email
+from .utils import queue_confirmation_email
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -49,16 +50,16 @@ def registerUser(request):
         return Response({'detail': 'Account with this email already exists'}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        user = Account.objects.create_user(
-            first_name=data['first_name'],
-            last_name=data['last_name'],
-            phone_number=data['phone_number'],
-            email=data['email'],
-            password=data['password']
-        )
-        user.generate_confirmation_token()
-        send_confirmation_email(user.email, user.confirmation_token)
-        # send_confirmation_email_task.delay(user.email, user.confirmation_token)
+        with transaction.atomic():
+            user = Account.objects.create_user(
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+                phone_number=data['phone_number'],
+                email=data['email'],
+                password=data['password']
+            )
+            user.generate_confirmation_token()
+            queue_confirmation_email(user.email, user.confirmation_token)
 
         serializer = AccountSerializerWithToken(user, many=False)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,12 @@
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from .models import Post
+from .serializers import PostSerializer
+
+
+@require_GET
+async def blog_list(request):
+    posts = [post async for post in Post.objects.all().aiterator()]
+    serializer = PostSerializer(posts, many=True)
+    return JsonResponse(serializer.data, safe=False)
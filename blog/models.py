@@ -6,6 +6,8 @@ class Post(models.Model):
     published_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     image = models.ImageField(upload_to='blog_images/', null=True, blank=True)
+    # thumbnails and WebP/JPEG copies of the image, made by images.pipeline
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     tag = models.CharField(max_length=155, blank=True, null=True)
 
     def __str__(self):
@@ -1,7 +1,11 @@
 from rest_framework import serializers
+
+from images.serializers import ImageVariantsField
 from .models import Post
 
 class PostSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Post
         fields = '__all__'
\ No newline at end of file
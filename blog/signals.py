@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from blog.models import Post
+from djangoPerfumes.cache import invalidate
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_blog_cache(sender, using, **kwargs):
+    invalidate('post', using=using)
@@ -1,3 +1,13 @@
 from django.test import TestCase
 
-# Create your tests here.
+from .models import Post
+
+
+class BlogListTests(TestCase):
+    def test_async_list_renders_what_the_sync_one_does(self):
+        Post.objects.create(title='Summer scents', content='Citrus and neroli.', tag='guides')
+        Post.objects.create(title='Oud', content='Smoke and resin.')
+        response = self.client.get('/api/blog/async/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(response.json(), self.client.get('/api/blog/').json())
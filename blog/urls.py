@@ -1,7 +1,9 @@
 from django.urls import path
+from . import async_views
 from .views import blog_list
 
 urlpatterns = [
     path('', blog_list, name='blog-list'),
+    path('async/', async_views.blog_list, name='blog-list-async'),
 
 ]
\ No newline at end of file
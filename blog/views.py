@@ -4,7 +4,10 @@ from .serializers import PostSerializer
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from djangoPerfumes.cache import cache_response
 
+
+@cache_response('post')
 @api_view(['GET'])
 def blog_list(request):
     if request.method == 'GET':
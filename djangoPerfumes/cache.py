@@ -0,0 +1,118 @@
+"""
+Versioned response cache for the read-only catalog endpoints.
+
+A cached response is keyed by the view, its normalized query string, the Accept
+header and the current version of every model group the view depends on.
+Saving or deleting a model of a group bumps that group's version (see the
+signals of the owning app), so stale entries are never read again and simply
+expire. With a read replica, a group stays marked as changed for
+REPLICA_PIN_SECONDS after a bump and responses read from the replica aren't
+stored meanwhile, they may not show the change yet.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction, connections, DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+
+from djangoPerfumes import routers
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _version_key(group):
+    return f'catalog-version:{group}'
+
+
+def _changed_key(group):
+    return f'catalog-changed:{group}'
+
+
+def get_versions(groups):
+    cache = get_cache()
+    keys = [_version_key(group) for group in groups]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock rather than 1, so a version that was evicted
+            # can't come back as a number older entries were stored under.
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(*groups):
+    cache = get_cache()
+    for group in groups:
+        key = _version_key(group)
+        cache.add(key, time.time_ns(), timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted between add() and incr()
+            cache.add(key, time.time_ns(), timeout=None)
+    if settings.REPLICA_DATABASE:
+        cache.set_many({_changed_key(group): True for group in groups}, settings.REPLICA_PIN_SECONDS)
+
+
+def replica_may_be_behind(groups):
+    return routers.reads_from_replica() and bool(get_cache().get_many([_changed_key(group) for group in groups]))
+
+
+def invalidate(*groups, using=DEFAULT_DB_ALIAS):
+    """
+    Bump the groups now, so the running transaction stops reading old entries,
+    and again once it commits, so a response cached from the pre-commit data
+    in between is dropped too.
+    """
+    bump_version(*groups)
+    if connections[using].in_atomic_block:
+        transaction.on_commit(lambda: bump_version(*groups), using=using)
+
+
+def _response_key(request, view_name, groups):
+    query = sorted((key, value) for key, values in request.GET.lists() for value in values if value)
+    fingerprint = hashlib.md5(
+        repr((request.path, query, request.META.get('HTTP_ACCEPT', ''))).encode()
+    ).hexdigest()
+    versions = '.'.join(str(version) for version in get_versions(groups))
+    return f'catalog-response:{view_name}:{fingerprint}:{versions}'
+
+
+def cache_response(*groups):
+    """
+    Cache the successful GET responses of a view until one of ``groups``
+    changes. Other methods always reach the view.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            cache = get_cache()
+            key = _response_key(request, view.__name__, groups)
+            cached = cache.get(key)
+            if cached is not None:
+                content, status, headers = cached
+                response = HttpResponse(content, status=status)
+                for header, value in headers:
+                    response[header] = value
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not replica_may_be_behind(groups):
+                if hasattr(response, 'render'):
+                    response.render()
+                cache.set(key, (response.content, response.status_code, list(response.items())),
+                          settings.CATALOG_CACHE_TIMEOUT)
+            return response
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,207 @@
+"""
+Per-request SQL and timing instrumentation.
+
+RequestStatsMiddleware counts the queries of every request with
+connection.execute_wrapper, measures their total time, how many repeated an
+earlier statement and how long rendering the response took. Rendering is timed
+by the renderers of djangoPerfumes.renderers wherever it happens (the view,
+cache_response or DRF after the view returned). serializer.data runs in the
+view, so serialization shows up as ``app``, the time spent outside the database
+and the renderer. The numbers go out in a Server-Timing header and into
+rolling per-route windows that the admin-only request_stats view reports on.
+
+ReplicaPinMiddleware keeps a client on the primary database right after it
+wrote, see djangoPerfumes.routers.
+"""
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from djangoPerfumes import routers
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.duplicates = 0
+        self.render_duration = 0.0
+        self._seen = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            # the same statement with other params is how an N+1 shows up
+            if sql in self._seen:
+                self.duplicates += 1
+            else:
+                self._seen.add(sql)
+
+
+class RouteStats:
+    """
+    The last REQUEST_STATS_WINDOW requests of every route, kept per process.
+    """
+
+    def __init__(self, window):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, route, duration, queries, db_duration, duplicates):
+        with self._lock:
+            self._requests[route].append((duration, queries, db_duration, duplicates))
+
+    def summary(self):
+        with self._lock:
+            snapshot = {route: list(requests) for route, requests in self._requests.items()}
+        return {route: self._summarize(requests) for route, requests in sorted(snapshot.items())}
+
+    @staticmethod
+    def _summarize(requests):
+        durations = sorted(request[0] for request in requests)
+        return {
+            'requests': len(requests),
+            'p50_ms': round(_percentile(durations, 50) * 1000, 2),
+            'p95_ms': round(_percentile(durations, 95) * 1000, 2),
+            'max_ms': round(durations[-1] * 1000, 2),
+            'avg_queries': round(sum(request[1] for request in requests) / len(requests), 2),
+            'max_queries': max(request[1] for request in requests),
+            'avg_db_ms': round(sum(request[2] for request in requests) / len(requests) * 1000, 2),
+            'max_duplicate_queries': max(request[3] for request in requests),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._requests.clear()
+
+
+def _percentile(ordered, percent):
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+route_stats = RouteStats(settings.REQUEST_STATS_WINDOW)
+
+# the QueryCounter of the running request
+_current_counter = ContextVar('request_stats_counter', default=None)
+
+
+@contextmanager
+def timed_render():
+    counter = _current_counter.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if counter is not None:
+            counter.render_duration += time.perf_counter() - started
+
+
+def _wrap_connections(counter):
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(counter))
+    return stack
+
+
+class RequestStatsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        token = _current_counter.set(counter)
+        try:
+            with _wrap_connections(counter):
+                response = self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        return self.record(request, response, counter, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        # the sync parts of the request run in copies of this context, which share the counter
+        token = _current_counter.set(counter)
+        # Connections are thread-local and the async ORM runs its queries in the
+        # request's thread-sensitive worker, so wrap the connections there.
+        stack = await sync_to_async(_wrap_connections)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current_counter.reset(token)
+        return self.record(request, response, counter, time.perf_counter() - started)
+
+    def record(self, request, response, counter, duration):
+        match = getattr(request, 'resolver_match', None)
+        route = f'{request.method} /{match.route}' if match else f'{request.method} <unresolved>'
+        route_stats.record(route, duration, counter.count, counter.duration, counter.duplicates)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={counter.duration * 1000:.2f};desc="{counter.count} queries"',
+            f'dup;desc="{counter.duplicates} duplicated queries"',
+            f'app;dur={max(duration - counter.duration - counter.render_duration, 0) * 1000:.2f}',
+            f'render;dur={counter.render_duration * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ])
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Reads the request from the primary database when the client wrote within
+    the last REPLICA_PIN_SECONDS, and starts that window again when the
+    request writes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers.begin_request(pinned=settings.REPLICA_PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(token)
+        return self.pin(response, wrote)
+
+    async def __acall__(self, request):
+        # the sync parts of the request run in copies of this context, which share the state object
+        token = routers.begin_request(pinned=settings.REPLICA_PIN_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = routers.end_request(token)
+        return self.pin(response, wrote)
+
+    @staticmethod
+    def pin(response, wrote):
+        if wrote:
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
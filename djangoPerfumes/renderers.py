@@ -0,0 +1,13 @@
+from rest_framework.renderers import JSONRenderer
+
+from djangoPerfumes.middleware import timed_render
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that reports its time to RequestStatsMiddleware.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed_render():
+            return super().render(data, accepted_media_type, renderer_context)
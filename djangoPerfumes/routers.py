@@ -0,0 +1,80 @@
+"""
+Read-replica routing for the catalog.
+
+During a request, reads of CATALOG_MODELS go to the REPLICA_DATABASE alias
+when one is configured. Every write, every read of another model and every
+read inside a transaction go to default, and so does everything outside a
+request (commands, celery tasks), which mostly read what they are about to
+write.
+
+A replica lags behind the primary. So once a request writes, the rest of it
+reads from default, and ReplicaPinMiddleware sets a cookie that keeps the
+client's requests on default for REPLICA_PIN_SECONDS. A seller sees the offer
+they just saved even if it hasn't reached the replica yet. For the same
+reason djangoPerfumes.cache doesn't store responses read from the replica
+while the catalog data they show may still be on its way there.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+CATALOG_MODELS = {
+    'perfumes.perfume', 'perfumes.brand', 'perfumes.category', 'perfumes.gender', 'perfumes.offer',
+    'perfumes.review', 'perfumes.reviewreply', 'blog.post',
+}
+
+
+class RequestState:
+    def __init__(self, pinned):
+        # read everything from default, the client wrote a moment ago
+        self.pinned = pinned
+        self.wrote = False
+
+
+# the RequestState of the running request, None outside a request
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+def begin_request(pinned=False):
+    return _request_state.set(RequestState(pinned))
+
+
+def end_request(token):
+    """
+    Forget the request's state and return whether it wrote.
+    """
+    state = _request_state.get()
+    _request_state.reset(token)
+    return state.wrote
+
+
+def reads_from_replica():
+    """
+    Whether catalog reads of the running request go to the replica.
+    """
+    state = _request_state.get()
+    return bool(settings.REPLICA_DATABASE) and state is not None and not state.pinned
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (reads_from_replica() and model._meta.label_lower in CATALOG_MODELS
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return settings.REPLICA_DATABASE
+        # explicitly, or Django would read related rows from the database the instance came from
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its tables by replication
+        return db != settings.REPLICA_DATABASE
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'orders',
     'accounts',
     'blog',
+    'images',
     'corsheaders'
 ]
 AUTH_USER_MODEL = 'accounts.Account'
@@ -52,6 +53,8 @@ AUTH_USER_MODEL = 'accounts.Account'
 CORS_ALLOW_ALL_ORIGINS = True
 
 MIDDLEWARE = [
+    'djangoPerfumes.middleware.RequestStatsMiddleware',
+    'djangoPerfumes.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,7 +88,12 @@ WSGI_APPLICATION = 'djangoPerfumes.wsgi.application'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # the JSON renderer is timed for RequestStatsMiddleware
+    'DEFAULT_RENDERER_CLASSES': (
+        'djangoPerfumes.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -125,6 +133,43 @@ DATABASES = {
     }
 }
 
+# Catalog reads of requests go to this alias when it is set, see
+# djangoPerfumes.routers. DATABASE_REPLICA_NAME is a copy of the database kept
+# current by replication (e.g. Litestream or LiteFS for SQLite).
+REPLICA_DATABASE = None
+if os.environ.get('DATABASE_REPLICA_NAME'):
+    REPLICA_DATABASE = 'replica'
+    DATABASES[REPLICA_DATABASE] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['DATABASE_REPLICA_NAME'],
+        # tests read the replica from the test database
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['djangoPerfumes.routers.ReplicaRouter']
+
+# A client that wrote reads from default for this long, longer than the replica lags
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_COOKIE = 'pin_primary'
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Point CATALOG_CACHE_ALIAS at a shared backend (e.g. RedisCache) when running
+# more than one process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'perfume-marketplace',
+    }
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Number of recent requests per route kept by RequestStatsMiddleware
+REQUEST_STATS_WINDOW = 500
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -162,6 +207,18 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# uploads are stored once per distinct content, see images.storage
+STORAGES = {
+    'default': {
+        'BACKEND': 'images.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+# seconds an unreferenced blob is kept before collect_stored_blobs_task deletes it
+STORED_BLOB_GRACE_PERIOD = 60 * 60
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
@@ -171,7 +228,57 @@ EMAIL_HOST_PASSWORD = 'crskkupkxujsyahp'
 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_IMPORTS = ('accounts.task',)
+CELERY_BEAT_SCHEDULE = {
+    'drain-email-outbox': {
+        'task': 'accounts.task.drain_email_outbox_task',
+        'schedule': 10.0,
+    },
+    'release-expired-stock-reservations': {
+        'task': 'orders.tasks.release_expired_reservations_task',
+        'schedule': 60.0,
+    },
+    'collect-stored-blobs': {
+        'task': 'images.tasks.collect_stored_blobs_task',
+        'schedule': 60.0 * 60,
+    },
+}
+
+# accounts.outbox: emails per batch, sends before giving up and the first retry
+# delay in seconds, doubled on every further attempt
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60
+
+# images.pipeline: name: (width, height, crop) of the copies made of every uploaded image, in every format
+IMAGE_VARIANTS = {
+    'thumb': (200, 200, True),
+    'small': (400, 400, False),
+    'medium': (800, 800, False),
+    'large': (1600, 1600, False),
+}
+IMAGE_VARIANT_FORMATS = ('webp', 'jpeg')
+IMAGE_VARIANT_QUALITY = 80
+# make the variants in the request instead of queueing a task, for tests and running without a worker
+IMAGE_VARIANTS_EAGER = False
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REMEMBER_ME_DAYS = 30
+
+# seconds a stock reservation (orders.stock) holds its stock before it expires
+STOCK_RESERVATION_TTL = 15 * 60
+
+CATALOG_PAGE_SIZE = 24
+CATALOG_MAX_PAGE_SIZE = 100
+
+REVIEW_PAGE_SIZE = 10
+# replies listed with each review, the rest are paged from the review's replies endpoint
+REVIEW_REPLIES_PREVIEW = 3
+REVIEW_REPLIES_PAGE_SIZE = 20
+
+ORDER_PAGE_SIZE = 20
+
+# perfumes.transfer: rows fetched per query by exports and written per transaction by imports
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+CATALOG_IMPORT_BATCH_SIZE = 1000
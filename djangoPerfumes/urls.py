@@ -7,6 +7,7 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
 from accounts.views import confirm_email
+from djangoPerfumes.views import request_stats
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -27,6 +28,7 @@ urlpatterns = [
     path('api/perfumes/', include('perfumes.urls')),
     path('api/orders/', include('orders.urls')),
     path('api/blog/', include('blog.urls')),
+    path('api/stats/requests/', request_stats, name='request-stats'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('confirm-email/<str:token>/', confirm_email, name='confirm-email'),
 
@@ -0,0 +1,19 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from djangoPerfumes.middleware import route_stats
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def request_stats(request):
+    """
+    Rolling latency and query statistics per route, as collected by
+    RequestStatsMiddleware in this process. DELETE resets them.
+    """
+    if request.method == 'DELETE':
+        route_stats.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(route_stats.summary())
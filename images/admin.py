@@ -0,0 +1,5 @@
+from django.contrib import admin
+
+from images.models import StoredBlob
+
+admin.site.register(StoredBlob)
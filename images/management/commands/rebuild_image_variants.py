@@ -0,0 +1,23 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from images.pipeline import IMAGE_FIELDS, needs_variants, update_variants, variants_field
+
+
+class Command(BaseCommand):
+    help = 'Make the missing thumbnails and WebP/JPEG copies of every uploaded image, in this process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Remake the variants of every image')
+
+    def handle(self, *args, **options):
+        made = 0
+        for model_label, field_names in IMAGE_FIELDS.items():
+            model = apps.get_model(model_label)
+            for field_name in field_names:
+                rows = model._default_manager.only('pk', field_name, variants_field(field_name)).order_by('pk')
+                for instance in rows.iterator(chunk_size=500):
+                    if options['force'] or needs_variants(instance, field_name):
+                        if update_variants(model_label, instance.pk, field_name) is not None:
+                            made += 1
+        self.stdout.write(self.style.SUCCESS(f'Updated the variants of {made} images.'))
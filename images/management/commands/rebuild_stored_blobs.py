@@ -0,0 +1,49 @@
+from collections import Counter
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from images.models import BLOB_DIRECTORY, StoredBlob, is_blob
+from images.pipeline import IMAGE_FIELDS, referenced_names, variants_field
+
+
+class Command(BaseCommand):
+    help = ('Move uploads saved under their upload names into content-addressed blobs and recount the references '
+            'to every blob. Run rebuild_image_variants afterwards for the moved images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-legacy', action='store_true',
+                            help='Delete the files the moved uploads were saved as')
+
+    def handle(self, *args, **options):
+        moved = {}
+        for model_label, field_names in IMAGE_FIELDS.items():
+            model = apps.get_model(model_label)
+            for field_name in field_names:
+                default = model._meta.get_field(field_name).default
+                rows = model._default_manager.exclude(**{f'{field_name}__startswith': f'{BLOB_DIRECTORY}/'}).exclude(
+                    **{field_name: default}).exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                for pk, name in rows.values_list('pk', field_name).iterator(chunk_size=500):
+                    if name not in moved:
+                        if not default_storage.exists(name):
+                            self.stderr.write(f'{model_label} {pk}: {name} is missing')
+                            continue
+                        with default_storage.open(name) as file:
+                            moved[name] = default_storage.save(name, file)
+                    # only if it wasn't replaced meanwhile
+                    model._default_manager.filter(pk=pk, **{field_name: name}).update(**{field_name: moved[name]})
+
+        counts = Counter()
+        for model_label, field_names in IMAGE_FIELDS.items():
+            fields = [name for field_name in field_names for name in (field_name, variants_field(field_name))]
+            for values in apps.get_model(model_label)._default_manager.values(*fields).iterator(chunk_size=500):
+                counts.update(name for name in referenced_names(model_label, values) if is_blob(name))
+        StoredBlob.objects.recount(counts)
+
+        if options['delete_legacy']:
+            for name in moved:
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {len(moved)} uploads into blobs, {len(counts)} blobs are referenced.'
+        ))
@@ -0,0 +1,94 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.functions import Greatest, Now
+from django.utils import timezone
+
+# where ContentAddressedStorage keeps the blobs, by the sha256 of their content
+BLOB_DIRECTORY = 'blobs'
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIRECTORY}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_DIRECTORY}/')
+
+
+class StoredBlobQuerySet(models.QuerySet):
+    def saved(self, name, size):
+        """
+        Record a blob written by the storage. Writing an existing blob again
+        keeps it from being collected for another grace period.
+        """
+        if not self.filter(name=name).update(updated_at=Now()):
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(name=name, size=size)
+            except IntegrityError:
+                # recorded by a concurrent upload of the same content
+                pass
+
+    def retain(self, names):
+        """
+        Count one more reference to each blob in ``names``, other names are
+        ignored.
+        """
+        for name, count in Counter(filter(is_blob, names)).items():
+            if not self.filter(name=name).update(refcount=F('refcount') + count, updated_at=Now()):
+                self.get_or_create(name=name, defaults={'refcount': count})
+
+    def release(self, names):
+        for name, count in Counter(filter(is_blob, names)).items():
+            self.filter(name=name).update(refcount=Greatest(F('refcount') - count, 0), updated_at=Now())
+
+    def recount(self, counts):
+        """
+        Set the reference counts to ``counts`` ({name: references}), counted
+        from the rows themselves; blobs missing from it are unreferenced.
+        """
+        with transaction.atomic(using=self.db):
+            self.exclude(refcount=0).update(refcount=0, updated_at=Now())
+            for name, count in counts.items():
+                if is_blob(name) and not self.filter(name=name).update(refcount=count, updated_at=Now()):
+                    self.create(name=name, refcount=count)
+
+    def collect(self, storage, grace_period=None):
+        """
+        Delete the blobs that nothing referred to for the grace period from
+        ``storage`` and return how many were deleted.
+        """
+        grace_period = settings.STORED_BLOB_GRACE_PERIOD if grace_period is None else grace_period
+        cutoff = timezone.now() - timedelta(seconds=grace_period)
+        collected = 0
+        for blob in self.filter(refcount=0, updated_at__lt=cutoff).iterator():
+            # conditional, a blob retained or uploaded again meanwhile is kept
+            if self.filter(pk=blob.pk, refcount=0, updated_at__lt=cutoff).delete()[0]:
+                storage.delete(blob.name)
+                collected += 1
+        return collected
+
+
+class StoredBlob(models.Model):
+    """
+    A file of ContentAddressedStorage and how many image fields and image
+    variants refer to it. Kept up to date by images.signals and
+    images.pipeline; unreferenced blobs are deleted by collect().
+    """
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = StoredBlobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['refcount', 'updated_at'])]
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
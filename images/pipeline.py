@@ -0,0 +1,195 @@
+"""
+Derivatives of uploaded images.
+
+Catalog grids are served thumbnails and resized WebP and JPEG copies of the
+uploads instead of the originals, which are often multi-megabyte phone
+photos. The copies are made by a Celery task once the upload is saved (see
+images.signals) and recorded on the row, in the ``<field>_variants`` JSON
+field next to each image field:
+
+    {"source": "perfume_images/x.jpg",
+     "variants": {"thumb": {"width": 200, "height": 200, "crop": true,
+                            "webp": {"name": ..., "url": ..., "size": 6120}, "jpeg": {...}},
+                  "small": {...}, ...}}
+
+The copies are encoded from the pixels alone, so the EXIF data (GPS
+position, camera) and any other metadata of the upload are dropped.
+"""
+import io
+import logging
+import posixpath
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from djangoPerfumes.cache import invalidate
+from images.models import StoredBlob
+
+logger = logging.getLogger(__name__)
+
+# model: its image fields, each with a <field>_variants JSON field
+IMAGE_FIELDS = {
+    'perfumes.Perfume': ('image',),
+    'perfumes.Offer': ('image1', 'image2'),
+    'accounts.UserProfile': ('profile_picture',),
+    'blog.Post': ('image',),
+}
+
+# model: the cache groups of the responses its images are rendered in, see djangoPerfumes.cache
+CACHE_GROUPS = {
+    'perfumes.Perfume': ('perfume', 'offer'),
+    'perfumes.Offer': ('offer',),
+    'accounts.UserProfile': ('seller',),
+    'blog.Post': ('post',),
+}
+
+# format: the Pillow encoder
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def variants_field(field_name):
+    return f'{field_name}_variants'
+
+
+def is_upload(instance, field_name):
+    """
+    Whether the field holds an uploaded image, rather than nothing or the
+    field's default, which is shared by every row and gets no variants.
+    """
+    file = getattr(instance, field_name)
+    return bool(file) and file.name != instance._meta.get_field(field_name).default
+
+
+def needs_variants(instance, field_name):
+    """
+    Whether the image in ``field_name`` changed since its variants were made.
+    """
+    recorded = getattr(instance, variants_field(field_name)) or {}
+    if not is_upload(instance, field_name):
+        return bool(recorded)
+    return getattr(instance, field_name).name != recorded.get('source')
+
+
+def variant_names(record):
+    return [saved['name'] for variant in (record or {}).get('variants', {}).values()
+            for saved in variant.values() if isinstance(saved, dict)]
+
+
+def referenced_names(model_label, values):
+    """
+    The stored files a row of the model refers to, its images and their
+    variants, from ``values``, the row itself or a dict of its field values.
+    """
+    get = values.get if isinstance(values, dict) else lambda field_name: getattr(values, field_name)
+    names = []
+    for field_name in IMAGE_FIELDS[model_label]:
+        name = getattr(get(field_name), 'name', get(field_name))
+        if name:
+            names.append(name)
+        names += variant_names(get(variants_field(field_name)))
+    return names
+
+
+def _flatten(image):
+    # JPEG has no alpha channel, transparent images are put on white
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _encode(image, image_format):
+    if image_format == 'jpeg':
+        image = _flatten(image)
+    buffer = io.BytesIO()
+    image.save(buffer, FORMATS[image_format], quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def make_variants(file, storage):
+    """
+    Save every IMAGE_VARIANTS size of the image in ``file`` in every
+    IMAGE_VARIANT_FORMATS to ``storage`` and return the record described at
+    the top of the module.
+    """
+    largest = (max(width for width, _, _ in settings.IMAGE_VARIANTS.values()),
+               max(height for _, height, _ in settings.IMAGE_VARIANTS.values()))
+    directory = posixpath.join('variants', posixpath.splitext(file.name)[0])
+    file.open('rb')
+    try:
+        with Image.open(file) as upload:
+            # JPEGs are decoded straight at the smallest scale still covering the largest variant
+            upload.draft('RGB', largest)
+            image = ImageOps.exif_transpose(upload)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+    finally:
+        file.close()
+
+    variants = {}
+    by_size = {}
+    for name, (box_width, box_height, crop) in settings.IMAGE_VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, (box_width, box_height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((box_width, box_height), Image.LANCZOS)
+            if resized.size in by_size:
+                # a small upload isn't scaled up, the larger sizes are all the same copy
+                variants[name] = by_size[resized.size]
+                continue
+        variant = {'width': resized.width, 'height': resized.height, 'crop': crop}
+        for image_format in settings.IMAGE_VARIANT_FORMATS:
+            content = _encode(resized, image_format)
+            path = storage.save(posixpath.join(directory, f'{name}.{image_format}'), ContentFile(content))
+            variant[image_format] = {'name': path, 'url': storage.url(path), 'size': len(content)}
+        variants[name] = variant
+        if not crop:
+            by_size[resized.size] = variant
+    return {'source': file.name, 'variants': variants}
+
+
+def update_variants(model_label, pk, field_name, source=None):
+    """
+    Make the variants of a row's image and record them, or clear them when
+    the image was removed. Returns the record, or None when the row is gone
+    or its image was replaced by something other than ``source`` meanwhile.
+    """
+    model = apps.get_model(model_label)
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None:
+        return None
+    file = getattr(instance, field_name)
+    if source is not None and file.name != source:
+        # replaced again after this was queued, the newer upload has its own task
+        return None
+
+    record = {}
+    if is_upload(instance, field_name):
+        try:
+            record = make_variants(file, file.storage)
+        except (OSError, Image.DecompressionBombError) as e:
+            logger.warning('Could not make the variants of %s: %s', file.name, e)
+            # recorded, so the same upload isn't tried again on every save
+            record = {'source': file.name, 'error': str(e), 'variants': {}}
+
+    changes = {variants_field(field_name): record}
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        changes['updated_at'] = Now()
+    with transaction.atomic():
+        # only if the image is still the one the variants were made of
+        previous = list(model._default_manager.select_for_update().filter(pk=pk, **{field_name: file.name})
+                        .values_list(variants_field(field_name), flat=True))
+        if not previous:
+            # the copies just saved are unreferenced and get collected
+            return None
+        model._default_manager.filter(pk=pk).update(**changes)
+        StoredBlob.objects.retain(variant_names(record))
+        StoredBlob.objects.release(variant_names(previous[0]))
+        invalidate(*CACHE_GROUPS[model_label])
+    return record
@@ -0,0 +1,37 @@
+from rest_framework import serializers
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    The variants of an image (see images.pipeline) by size, with a
+    ``srcset`` per format made of the sizes that keep the image's proportions:
+
+        {"thumb": {"width": 200, "height": 200, "webp": url, "jpeg": url}, ...,
+         "srcset": {"webp": "url 400w, url 800w, ...", "jpeg": "..."}}
+
+    Empty until the variants are made, clients show the original meanwhile.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        rendered = {}
+        srcset = {}
+        for name, variant in (value or {}).get('variants', {}).items():
+            urls = {
+                image_format: request.build_absolute_uri(saved['url']) if request else saved['url']
+                for image_format, saved in variant.items() if isinstance(saved, dict)
+            }
+            rendered[name] = {'width': variant['width'], 'height': variant['height'], **urls}
+            if not variant['crop']:
+                for image_format, url in urls.items():
+                    entry = f'{url} {variant["width"]}w'
+                    # sizes a small upload wasn't scaled up to share one copy
+                    if entry not in srcset.setdefault(image_format, []):
+                        srcset[image_format].append(entry)
+        if srcset:
+            rendered['srcset'] = {image_format: ', '.join(entries) for image_format, entries in srcset.items()}
+        return rendered
@@ -0,0 +1,57 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from images.models import StoredBlob
+from images.pipeline import IMAGE_FIELDS, needs_variants, referenced_names, variants_field
+from images.tasks import make_image_variants_task
+
+
+def remember_image_names(sender, instance, using, **kwargs):
+    # the files the row referred to before, to move the blob references of replaced images
+    instance._previous_image_names = []
+    if instance.pk and not instance._state.adding:
+        fields = [name for field_name in IMAGE_FIELDS[sender._meta.label]
+                  for name in (field_name, variants_field(field_name))]
+        values = sender._default_manager.using(using).filter(pk=instance.pk).values(*fields).first()
+        if values:
+            instance._previous_image_names = referenced_names(sender._meta.label, values)
+
+
+def count_image_references(sender, instance, **kwargs):
+    current = Counter(referenced_names(sender._meta.label, instance))
+    previous = Counter(getattr(instance, '_previous_image_names', []))
+    StoredBlob.objects.retain((current - previous).elements())
+    StoredBlob.objects.release((previous - current).elements())
+
+
+def release_image_references(sender, instance, **kwargs):
+    StoredBlob.objects.release(referenced_names(sender._meta.label, instance))
+
+
+def queue_image_variants(sender, instance, raw, using, update_fields=None, **kwargs):
+    """
+    Queue the variants of every image of the row that changed, once the
+    upload is committed. With IMAGE_VARIANTS_EAGER they are made right away.
+    """
+    if raw:
+        return
+    for field_name in IMAGE_FIELDS[sender._meta.label]:
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        if not needs_variants(instance, field_name):
+            continue
+        args = (sender._meta.label, instance.pk, field_name, getattr(instance, field_name).name)
+        if settings.IMAGE_VARIANTS_EAGER:
+            make_image_variants_task.apply(args=args)
+        else:
+            transaction.on_commit(lambda args=args: make_image_variants_task.delay(*args), using=using)
+
+
+for model_label in IMAGE_FIELDS:
+    pre_save.connect(remember_image_names, sender=model_label)
+    post_save.connect(count_image_references, sender=model_label)
+    post_save.connect(queue_image_variants, sender=model_label)
+    post_delete.connect(release_image_references, sender=model_label)
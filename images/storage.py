@@ -0,0 +1,59 @@
+"""
+Content-addressed media storage.
+
+Sellers upload the same bottle photo for many offers. This storage names
+every upload after the sha256 of its content, computed while the upload is
+streamed to disk, so identical uploads end up as one file:
+
+    blobs/3f/a2/3fa2...e9.jpg
+
+A blob is never changed once written, which also lets the media server cache
+it forever. How many rows refer to a blob is counted by StoredBlob; blobs no
+row refers to any more are deleted by collect_stored_blobs_task.
+"""
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+from images.models import BLOB_DIRECTORY, StoredBlob, blob_name
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # replaced by the name of the content in _save, which may well exist already
+        return name
+
+    def _save(self, name, content):
+        directory = self.path(BLOB_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        temporary_path = os.path.join(directory, f'.upload-{uuid.uuid4().hex}')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            # The current umask value is masked out by os.open, as in FileSystemStorage
+            with os.fdopen(os.open(temporary_path, self.OS_OPEN_FLAGS, 0o666), 'wb') as file:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            name = blob_name(digest.hexdigest(), posixpath.splitext(name)[1].lower())
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.remove(temporary_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary_path, self.file_permissions_mode)
+                # atomic, a concurrent upload of the same content writes the same bytes
+                os.replace(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        StoredBlob.objects.saved(name, size)
+        return name
@@ -0,0 +1,15 @@
+from celery import shared_task
+from django.core.files.storage import default_storage
+
+from images.models import StoredBlob
+from images.pipeline import update_variants
+
+
+@shared_task
+def make_image_variants_task(model_label, pk, field_name, source):
+    return update_variants(model_label, pk, field_name, source)
+
+
+@shared_task
+def collect_stored_blobs_task():
+    return StoredBlob.objects.collect(default_storage)
@@ -0,0 +1,167 @@
+import io
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from accounts.models import Account
+from images.models import StoredBlob
+from perfumes.models import Brand, Category, Gender, Perfume, Offer
+
+
+def photo(name='photo.jpg', size=(3000, 2000), image_format='JPEG', mode='RGB', color='red'):
+    image = Image.new(mode, size, color)
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'  # camera make
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANTS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+
+    def perfume(self, **kwargs):
+        return Perfume.objects.create(user=self.user, name='Perfume', category=Category.objects.create(name='Fresh'),
+                                      gender=Gender.objects.create(name='Unisex'),
+                                      brand=Brand.objects.create(name='Brand'), **kwargs)
+
+    def test_upload_gets_resized_copies_without_metadata(self):
+        perfume = self.perfume(image=photo())
+        perfume.refresh_from_db()
+
+        variants = perfume.image_variants['variants']
+        self.assertEqual(perfume.image_variants['source'], perfume.image.name)
+        self.assertEqual((variants['thumb']['width'], variants['thumb']['height']), (200, 200))
+        self.assertEqual((variants['large']['width'], variants['large']['height']), (1600, 1067))
+        with perfume.image.storage.open(variants['small']['jpeg']['name']) as saved, Image.open(saved) as image:
+            self.assertEqual(image.size, (400, 267))
+            self.assertFalse(image.getexif())
+        with perfume.image.storage.open(variants['small']['webp']['name']) as saved, Image.open(saved) as image:
+            self.assertEqual(image.format, 'WEBP')
+
+        response = self.client.get(f'/api/perfumes/{perfume.pk}/')
+        rendered = response.data['image_variants']
+        self.assertTrue(rendered['thumb']['webp'].endswith('.webp'))
+        self.assertEqual(rendered['srcset']['webp'].count('w, '), 2)
+        self.assertNotIn('thumb', rendered['srcset']['jpeg'])
+
+    def test_replaced_and_removed_images(self):
+        perfume = self.perfume(image=photo(size=(300, 300)))
+        perfume.refresh_from_db()
+        # not scaled up: the sizes above the upload share one copy
+        variants = perfume.image_variants['variants']
+        self.assertEqual(variants['medium'], variants['small'])
+        self.assertEqual(variants['large']['width'], 300)
+
+        perfume.image = photo('transparent.png', size=(500, 500), image_format='PNG', mode='RGBA')
+        perfume.save()
+        perfume.refresh_from_db()
+        self.assertEqual(perfume.image_variants['source'], perfume.image.name)
+        self.assertEqual(perfume.image_variants['variants']['small']['width'], 400)
+
+        perfume.image = None
+        perfume.save()
+        perfume.refresh_from_db()
+        self.assertEqual(perfume.image_variants, {})
+
+    def test_default_images_get_no_variants(self):
+        perfume = self.perfume()
+        perfume.refresh_from_db()
+
+        self.assertEqual(perfume.image_variants, {})
+        self.assertEqual(self.user.userprofile.profile_picture_variants, {})
+
+    def test_rebuild_command_makes_the_missing_variants(self):
+        with override_settings(IMAGE_VARIANTS_EAGER=False):
+            # queued for after the commit, which never comes in a TestCase
+            perfume = self.perfume(image=photo(size=(800, 600)))
+        perfume.refresh_from_db()
+        self.assertEqual(perfume.image_variants, {})
+
+        call_command('rebuild_image_variants', stdout=io.StringIO())
+
+        perfume.refresh_from_db()
+        self.assertEqual(perfume.image_variants['variants']['small']['width'], 400)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANTS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.seller = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        brand = Brand.objects.create(name='Brand')
+        self.perfume = Perfume.objects.create(user=self.seller, name='Perfume', brand=brand,
+                                              category=Category.objects.create(name='Fresh'),
+                                              gender=Gender.objects.create(name='Unisex'))
+
+    def offer(self, **images):
+        return Offer.objects.create(seller=self.seller, brand=self.perfume.brand, perfume=self.perfume,
+                                    description='Offer', price_per_ml=10, **images)
+
+    def blob(self, name):
+        return StoredBlob.objects.get(name=name)
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.offer(image1=photo('bottle.jpg'))
+        second = self.offer(image1=photo('IMG_0001.JPG'), image2=photo('other.jpg', size=(400, 400), color='blue'))
+
+        self.assertEqual(first.image1.name, second.image1.name)
+        self.assertTrue(first.image1.name.startswith('blobs/'))
+        self.assertTrue(first.image1.name.endswith('.jpg'))
+        self.assertEqual(self.blob(first.image1.name).refcount, 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        # the variants of the same photo are the same blobs too
+        thumb = first.image1_variants['variants']['thumb']['webp']['name']
+        self.assertEqual(second.image1_variants['variants']['thumb']['webp']['name'], thumb)
+        self.assertEqual(self.blob(thumb).refcount, 2)
+        uploads = [path for path in Path(self.media_root, 'blobs').rglob('*') if path.is_file()]
+        self.assertFalse([path for path in uploads if path.name.startswith('.upload-')])
+
+        second.delete()
+        self.assertEqual(self.blob(first.image1.name).refcount, 1)
+        self.assertEqual(self.blob(thumb).refcount, 1)
+        self.assertEqual(self.blob(second.image2.name).refcount, 0)
+
+    def test_unreferenced_blobs_are_collected_after_the_grace_period(self):
+        offer = self.offer(image1=photo())
+        name = offer.image1.name
+        offer.image1 = photo('other.jpg', size=(400, 400), color='blue')
+        offer.save()
+
+        self.assertEqual(self.blob(name).refcount, 0)
+        self.assertEqual(StoredBlob.objects.collect(default_storage), 0)
+        self.assertEqual(StoredBlob.objects.collect(default_storage, grace_period=-1), 1 + 4 * 2)
+        self.assertFalse(default_storage.exists(name))
+        self.assertTrue(default_storage.exists(offer.image1.name))
+
+    def test_rebuild_moves_legacy_uploads_into_blobs(self):
+        legacy = [FileSystemStorage().save(f'offer_images/{name}', photo(name)) for name in ['a.jpg', 'b.jpg']]
+        offers = [self.offer() for _ in legacy]
+        for offer, name in zip(offers, legacy):
+            Offer.objects.filter(pk=offer.pk).update(image1=name)
+        StoredBlob.objects.update(refcount=5)
+
+        call_command('rebuild_stored_blobs', delete_legacy=True, stdout=io.StringIO())
+
+        names = {offer.image1.name for offer in Offer.objects.all()}
+        self.assertEqual(len(names), 1)
+        [name] = names
+        self.assertEqual(self.blob(name).refcount, 2)
+        self.assertFalse(StoredBlob.objects.exclude(name=name).exclude(refcount=0).exists())
+        self.assertFalse(any(FileSystemStorage().exists(name) for name in legacy))
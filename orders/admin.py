@@ -1,6 +1,21 @@
 from django.contrib import admin
 
-from orders.models import OrderItem, Order
+from orders.models import OrderItem, Order, StockReservation
 
-admin.site.register(OrderItem)
-admin.site.register(Order)
+
+@admin.register(OrderItem)
+class OrderItemAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'user', 'quantity', 'unit_price', 'line_total', 'created_at']
+    readonly_fields = ['unit_price', 'line_total']
+    list_select_related = ['offer__perfume', 'user']
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'total', 'created_at']
+    readonly_fields = ['total']
+    list_select_related = ['user']
+    date_hierarchy = 'created_at'
+
+
+admin.site.register(StockReservation)
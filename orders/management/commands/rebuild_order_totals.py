@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from orders.models import OrderItem, Order
+
+
+class Command(BaseCommand):
+    help = ('Store the offer price on order items that don\'t have one yet and recompute the total of every order. '
+            'Items that already have a price keep it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            items = OrderItem.objects.using(options['database']).filter(unit_price__isnull=True).snapshot_prices()
+            orders = Order.objects.using(options['database']).refresh_totals()
+        self.stdout.write(self.style.SUCCESS(f'Priced {items} order items and refreshed {orders} order totals.'))
@@ -1,9 +1,26 @@
+import uuid
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import F, Sum, Prefetch, ExpressionWrapper, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 from accounts.models import Account
 from perfumes.models import Offer
 
 
+class OrderItemQuerySet(models.QuerySet):
+    def snapshot_prices(self):
+        """
+        Store the current offer price and line total on these items in a
+        single UPDATE, for items saved before prices were kept on the item.
+        """
+        price = Subquery(Offer.objects.filter(pk=OuterRef('offer')).values('price_per_ml'))
+        return self.update(unit_price=price, line_total=ExpressionWrapper(
+            F('quantity') * price, output_field=models.DecimalField(max_digits=14, decimal_places=2)
+        ))
+
+
 class OrderItem(models.Model):
     user = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True)
     offer = models.ForeignKey(Offer, on_delete=models.CASCADE)
@@ -21,21 +38,101 @@ class OrderItem(models.Model):
     delivery_method = models.CharField(max_length=100)
     delivery_branch = models.CharField(max_length=100, blank=True, null=True)
 
+    # the offer's price when the item was ordered, sellers may change it later
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, editable=False)
+    line_total = models.DecimalField(max_digits=14, decimal_places=2, null=True, editable=False)
+    # the quantity was taken off the offer's stock, so deleting the item puts it back
+    stock_taken = models.BooleanField(default=False, editable=False)
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_at'])]
+
     def __str__(self):
         return self.offer.perfume.name
 
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.set_price(self.offer)
+        # the quantity may have been edited since, the unit price stays the one ordered at
+        self.line_total = self.quantity * self.unit_price
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'line_total'}
+        super().save(*args, **kwargs)
+
+    def set_price(self, offer):
+        self.unit_price = offer.price_per_ml
+        self.line_total = self.quantity * offer.price_per_ml
+
     def order_item_price(self):
-        price = int(self.quantity) * int(self.offer.price_per_ml)
-        return str(price)
+        # items saved before prices were kept on the item cost what the offer does now
+        line_total = self.quantity * self.offer.price_per_ml if self.line_total is None else self.line_total
+        return str(line_total)
+
+
+class OrderQuerySet(models.QuerySet):
+    def for_history(self):
+        """
+        Everything OrderSerializer renders in a fixed number of queries.
+        """
+        items = OrderItem.objects.select_related('offer__perfume').order_by('pk')
+        return self.select_related('user__userprofile').prefetch_related(Prefetch('items', queryset=items))
+
+    def refresh_totals(self):
+        """
+        Recompute the stored total of these orders from their items in a
+        single UPDATE.
+        """
+        items = Order.items.through.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return self.update(total=Coalesce(Subquery(items.annotate(total=Sum('orderitem__line_total')).values('total')),
+                                          Decimal(0)))
 
 
 class Order(models.Model):
     user = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True)
     items = models.ManyToManyField(OrderItem, related_name='orders')
     created_at = models.DateTimeField(auto_now_add=True)
+    # sum of the items' line_total, kept up to date by orders.signals
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # OrderCursorPagination over a customer's order history
+        indexes = [models.Index(fields=['user', 'created_at'])]
 
     def __str__(self):
         if self.user:
             return f"Order for {self.user.full_name()} on {self.created_at}"
         else:
             return f"Order on {self.created_at}"
+
+
+class StockReservation(models.Model):
+    """
+    Stock taken off offers for a buyer who hasn't checked out yet. Held stock
+    goes back to the offers when the reservation is released or expires (see
+    orders.stock).
+    """
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [(HELD, 'Held'), (COMMITTED, 'Committed'), (RELEASED, 'Released')]
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True)
+    # {offer id: quantity}
+    lines = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'expires_at'])]
+
+    def __str__(self):
+        return f"Reservation {self.token} ({self.status})"
+
+    def quantities(self):
+        return {int(offer_id): quantity for offer_id, quantity in self.lines.items()}
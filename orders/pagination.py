@@ -0,0 +1,13 @@
+from django.conf import settings
+
+from perfumes.pagination import KeysetCursorPagination
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    """
+    Keyset pagination for a customer's order history, newest first.
+    """
+    page_size = settings.ORDER_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
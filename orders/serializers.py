@@ -1,21 +1,27 @@
 import random
 import string
+from decimal import Decimal
 
+from django.contrib.auth.hashers import make_password
 from django.db import transaction
+from django.utils.crypto import get_random_string
 from rest_framework import serializers
 
-from accounts.models import Account, UserProfile
+from accounts.models import Account
 from accounts.serializers import AccountSerializer
-from accounts.task import send_confirmation_email_task
-from accounts.utils import send_confirmation_email
+from accounts.utils import queue_confirmation_email
 from orders.models import OrderItem, Order
+from orders.stock import take_stock, reserve, commit_reservation
+from perfumes.models import Offer
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    perfume_name = serializers.CharField(source='offer.perfume.name', read_only=True)
+
     class Meta:
         model = OrderItem
-        fields = ['id', 'user', 'offer', 'quantity', 'created_at', 'city', 'district', 'delivery_method',
-                  'delivery_branch', 'order_item_price']
+        fields = ['id', 'user', 'offer', 'perfume_name', 'quantity', 'created_at', 'city', 'district',
+                  'delivery_method', 'delivery_branch', 'order_item_price', 'unit_price', 'line_total']
 
         extra_kwargs = {
             'user': {'required': False, 'allow_null': True}
@@ -28,7 +34,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'items', 'created_at']
+        fields = ['id', 'user', 'items', 'total', 'created_at']
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
@@ -54,24 +60,140 @@ class NonRegisteredUserOrderItemSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         with transaction.atomic():
-            password = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-            user, user_created = Account.objects.get_or_create(
-                email=validated_data['non_registered_email'],
-                defaults={
-                    'first_name': validated_data['non_registered_first_name'],
-                    'last_name': validated_data['non_registered_last_name'],
-                    'phone_number': validated_data['non_registered_phone_number'],
-                }
-            )
-
-            if user_created:
-                user.set_password(password)
-                user.generate_confirmation_token()
-                user.save()
-                UserProfile.objects.get_or_create(user=user)  # Use get_or_create to avoid duplicates
-                send_confirmation_email_task.delay(user.email, user.confirmation_token, password)
-                send_confirmation_email(user.email, user.confirmation_token, password)
-                # Logic to send password to user's email
-
+            user = get_or_create_guest_account(validated_data)
             order_item = OrderItem.objects.create(user=user, **validated_data)
             return order_item
+
+
+def get_or_create_guest_account(guest_data):
+    """
+    The account behind a guest checkout, created on the first order of an
+    email with a generated password that is emailed along with the
+    confirmation link.
+    """
+    password = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+    # password and token go into the INSERT, the profile is created by accounts.signals
+    user, user_created = Account.objects.get_or_create(
+        email=guest_data['non_registered_email'],
+        defaults={
+            'first_name': guest_data['non_registered_first_name'],
+            'last_name': guest_data['non_registered_last_name'],
+            'phone_number': guest_data['non_registered_phone_number'],
+            'password': make_password(password),
+            'confirmation_token': get_random_string(64),
+        }
+    )
+
+    if user_created:
+        queue_confirmation_email(user.email, user.confirmation_token, password=password)
+    return user
+
+
+class CheckoutLineSerializer(serializers.Serializer):
+    offer = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class CartSerializer(serializers.Serializer):
+    lines = CheckoutLineSerializer(many=True, allow_empty=False)
+
+    def validate_lines(self, lines):
+        # the same offer twice in a cart is one line
+        quantities = {}
+        for line in lines:
+            quantities[line['offer']] = quantities.get(line['offer'], 0) + line['quantity']
+        offers = Offer.objects.in_bulk(quantities)
+        missing = [offer_id for offer_id in quantities if offer_id not in offers]
+        if missing:
+            raise serializers.ValidationError(f'Unknown offers: {", ".join(map(str, missing))}')
+        return [{'offer': offers[offer_id], 'quantity': quantity} for offer_id, quantity in quantities.items()]
+
+    def request_user(self):
+        user = self.context['request'].user
+        return user if user.is_authenticated else None
+
+
+class StockReservationSerializer(CartSerializer):
+    """
+    Holds the stock of a cart until checkout, see orders.stock.
+    """
+    token = serializers.UUIDField(read_only=True)
+    expires_at = serializers.DateTimeField(read_only=True)
+
+    def create(self, validated_data):
+        return reserve({line['offer'].pk: line['quantity'] for line in validated_data['lines']},
+                       user=self.request_user())
+
+    def to_representation(self, instance):
+        return {
+            'token': str(instance.token),
+            'expires_at': serializers.DateTimeField().to_representation(instance.expires_at),
+            'lines': [{'offer': offer_id, 'quantity': quantity}
+                      for offer_id, quantity in instance.quantities().items()],
+        }
+
+
+class CheckoutSerializer(CartSerializer):
+    """
+    A whole cart: one OrderItem per line, all in a new Order. The stock comes
+    from the reservation when one is given, otherwise it's taken from the
+    lines. Guests send the non_registered_* fields like on the single item
+    endpoint.
+    """
+    lines = CheckoutLineSerializer(many=True, allow_empty=False, required=False)
+    reservation = serializers.UUIDField(required=False)
+    city = serializers.CharField(max_length=100)
+    district = serializers.CharField(max_length=100)
+    delivery_method = serializers.CharField(max_length=100)
+    delivery_branch = serializers.CharField(max_length=100, required=False, allow_null=True, allow_blank=True)
+    non_registered_first_name = serializers.CharField(max_length=100, required=False)
+    non_registered_last_name = serializers.CharField(max_length=100, required=False)
+    non_registered_email = serializers.EmailField(required=False)
+    non_registered_phone_number = serializers.CharField(max_length=15, required=False)
+
+    GUEST_FIELDS = ['non_registered_first_name', 'non_registered_last_name', 'non_registered_email',
+                    'non_registered_phone_number']
+
+    def validate(self, attrs):
+        if ('lines' in attrs) == ('reservation' in attrs):
+            raise serializers.ValidationError('Send either lines or a reservation.')
+        if not self.context['request'].user.is_authenticated:
+            missing = {field: 'This field is required.' for field in self.GUEST_FIELDS if not attrs.get(field)}
+            if missing:
+                raise serializers.ValidationError(missing)
+        return attrs
+
+    def create(self, validated_data):
+        """
+        Raises OutOfStock or ReservationExpired when the stock can't be had,
+        nothing is written then.
+        """
+        request = self.context['request']
+        lines = validated_data.pop('lines', None)
+        reservation = validated_data.pop('reservation', None)
+        with transaction.atomic():
+            if reservation:
+                quantities = commit_reservation(reservation, user=self.request_user())
+                offers = Offer.objects.in_bulk(quantities)
+                # an offer deleted since the reservation has nothing left to order
+                lines = [{'offer': offers[offer_id], 'quantity': quantity}
+                         for offer_id, quantity in quantities.items() if offer_id in offers]
+            else:
+                take_stock({line['offer'].pk: line['quantity'] for line in lines})
+            if request.user.is_authenticated:
+                user = request.user
+                for field in self.GUEST_FIELDS:
+                    validated_data.pop(field, None)
+            else:
+                user = get_or_create_guest_account(validated_data)
+            items = [OrderItem(user=user, offer=line['offer'], quantity=line['quantity'], stock_taken=True,
+                               **validated_data)
+                     for line in lines]
+            for item in items:
+                item.set_price(item.offer)
+            order = Order.objects.create(user=user, total=sum((item.line_total for item in items), Decimal(0)))
+            OrderItem.objects.bulk_create(items)
+            Order.items.through.objects.bulk_create([
+                Order.items.through(order=order, orderitem=item) for item in items
+            ])
+        return order
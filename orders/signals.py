@@ -0,0 +1,37 @@
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_save
+from django.dispatch import receiver
+
+from orders.models import Order, OrderItem
+
+
+@receiver(m2m_changed, sender=Order.items.through)
+def refresh_order_total(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # item.orders.clear() doesn't say which orders it was in
+        instance._order_ids = list(instance.orders.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        orders = Order.objects.filter(pk=instance.pk)
+    else:
+        orders = Order.objects.filter(pk__in=pk_set or getattr(instance, '_order_ids', []))
+    orders.refresh_totals()
+
+
+# deleting an item removes its M2M rows without m2m_changed
+@receiver(pre_delete, sender=OrderItem)
+def remember_item_orders(sender, instance, **kwargs):
+    instance._order_ids = list(instance.orders.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=OrderItem)
+def refresh_item_order_totals(sender, instance, **kwargs):
+    if getattr(instance, '_order_ids', None):
+        Order.objects.filter(pk__in=instance._order_ids).refresh_totals()
+
+
+@receiver(post_save, sender=OrderItem)
+def refresh_edited_item_order_totals(sender, instance, created, **kwargs):
+    # a new item isn't in an order yet, m2m_changed totals it when it is added
+    if not created:
+        Order.objects.filter(items=instance).refresh_totals()
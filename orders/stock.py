@@ -0,0 +1,142 @@
+"""
+Stock reservation for offers.
+
+Stock is taken with one conditional UPDATE per offer,
+
+    UPDATE perfumes_offer SET quantity = quantity - n WHERE id = ... AND quantity >= n
+
+so two buyers can never both get the last bottle: the database decides, no
+row is read and written back, and only the offer rows being bought are
+locked. A multi-line order is all-or-nothing, when one line can't be served
+the savepoint around the order rolls back the lines already taken.
+
+An offer that sells out, or comes back in stock, refreshes its perfume's
+active_offer_count.
+
+Stock can also be held by a StockReservation for STOCK_RESERVATION_TTL
+seconds while the buyer checks out; release_expired puts the stock of
+abandoned reservations back.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from djangoPerfumes.cache import invalidate
+from orders.models import StockReservation
+from perfumes.models import Offer, Perfume
+
+
+class OutOfStock(Exception):
+    def __init__(self, offer_ids):
+        self.offer_ids = offer_ids
+        super().__init__(f'Not enough stock for offers {", ".join(map(str, offer_ids))}')
+
+
+class ReservationExpired(Exception):
+    pass
+
+
+def take_stock(quantities):
+    """
+    Take {offer id: quantity} off the offers, all lines or none of them.
+    Raises OutOfStock naming the first offer that couldn't be served.
+    """
+    with transaction.atomic():
+        # a fixed order, so concurrent orders lock their offers in the same order and can't deadlock
+        for offer_id, quantity in sorted(quantities.items()):
+            taken = Offer.objects.filter(pk=offer_id, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity, updated_at=Now()
+            )
+            if not taken:
+                raise OutOfStock([offer_id])
+        refresh_active_offers(Q(pk__in=quantities, quantity=0))
+        invalidate('offer')
+
+
+def put_back_stock(quantities):
+    with transaction.atomic():
+        for offer_id, quantity in sorted(quantities.items()):
+            Offer.objects.filter(pk=offer_id).update(quantity=F('quantity') + quantity, updated_at=Now())
+        # back in stock: all there is now is what was just put back
+        back = Q(pk__in=[])
+        for offer_id, quantity in quantities.items():
+            back |= Q(pk=offer_id, quantity=quantity)
+        refresh_active_offers(back)
+        invalidate('offer')
+
+
+def refresh_active_offers(crossed):
+    """
+    Refresh the active offer count of the perfumes of the offers matching
+    ``crossed``, the ones that just sold out or came back in stock. Stock
+    changes that leave an offer in stock don't change the count.
+    """
+    perfume_ids = set(Offer.objects.filter(crossed).values_list('perfume_id', flat=True))
+    if perfume_ids:
+        Perfume.objects.filter(pk__in=perfume_ids).refresh_offer_summary()
+        invalidate('perfume')
+
+
+def reserve(quantities, user=None, ttl=None):
+    ttl = settings.STOCK_RESERVATION_TTL if ttl is None else ttl
+    with transaction.atomic():
+        take_stock(quantities)
+        return StockReservation.objects.create(
+            user=user,
+            lines={str(offer_id): quantity for offer_id, quantity in quantities.items()},
+            expires_at=timezone.now() + timedelta(seconds=ttl),
+        )
+
+
+def commit_reservation(token, user=None):
+    """
+    Turn a held reservation into a purchase and return its quantities. The
+    stock was already taken, so this only has to win against release_expired.
+    """
+    reservations = StockReservation.objects.filter(token=token, user=user)
+    with transaction.atomic():
+        # conditional, like take_stock: of a concurrent commit and release only one matches
+        if not reservations.filter(status=StockReservation.HELD, expires_at__gt=timezone.now()).update(
+                status=StockReservation.COMMITTED):
+            raise ReservationExpired(f'Reservation {token} is no longer held')
+        return reservations.get().quantities()
+
+
+def release_reservation(token, user=None):
+    with transaction.atomic():
+        reservation = StockReservation.objects.filter(token=token, user=user, status=StockReservation.HELD).first()
+        if reservation is None or not StockReservation.objects.filter(
+                pk=reservation.pk, status=StockReservation.HELD).update(status=StockReservation.RELEASED):
+            return False
+        put_back_stock(reservation.quantities())
+        return True
+
+
+def release_expired(batch_size=500):
+    """
+    Release every held reservation past its expiry and return how many were
+    released.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(status=StockReservation.HELD, expires_at__lte=timezone.now())
+                .order_by('pk')[:batch_size]
+            )
+            if not expired:
+                return released
+            quantities = Counter()
+            for reservation in expired:
+                # without SKIP LOCKED (SQLite) another worker may have released it meanwhile
+                if StockReservation.objects.filter(pk=reservation.pk, status=StockReservation.HELD).update(
+                        status=StockReservation.RELEASED):
+                    quantities.update(reservation.quantities())
+                    released += 1
+            put_back_stock(quantities)
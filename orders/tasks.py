@@ -0,0 +1,7 @@
+from celery import shared_task
+from orders.stock import release_expired
+
+
+@shared_task
+def release_expired_reservations_task():
+    return release_expired()
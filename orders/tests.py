@@ -1,3 +1,304 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Account
+from orders.models import Order, OrderItem, StockReservation
+from orders.stock import OutOfStock, take_stock, put_back_stock, reserve, release_expired
+from perfumes.models import Brand, Category, Gender, Perfume, Offer
+
+
+def create_offers(count, quantity):
+    seller = Account.objects.create_user('Seller', 'One', f'seller{time.monotonic_ns()}@example.com', 'pw')
+    brand, _ = Brand.objects.get_or_create(name='Brand')
+    category, _ = Category.objects.get_or_create(name='Fresh')
+    gender, _ = Gender.objects.get_or_create(name='Unisex')
+    perfume = Perfume.objects.create(user=seller, name='Perfume', category=category, gender=gender, brand=brand)
+    return [
+        Offer.objects.create(seller=seller, brand=brand, perfume=perfume, description='Offer', quantity=quantity,
+                             price_per_ml=10)
+        for _ in range(count)
+    ]
+
+
+def stock(offers):
+    return dict(Offer.objects.filter(pk__in=[offer.pk for offer in offers]).values_list('pk', 'quantity'))
+
+
+class StockTests(TestCase):
+    def setUp(self):
+        self.offers = create_offers(2, quantity=3)
+        self.buyer = Account.objects.create_user('Buyer', 'One', 'buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def checkout(self, **data):
+        return self.client.post('/api/orders/checkout/', {
+            'city': 'Kyiv', 'district': 'Center', 'delivery_method': 'post', **data,
+        }, format='json')
+
+    def test_multi_line_orders_are_all_or_nothing(self):
+        first, second = self.offers
+
+        with self.assertRaises(OutOfStock):
+            take_stock({first.pk: 2, second.pk: 4})
+        self.assertEqual(stock(self.offers), {first.pk: 3, second.pk: 3})
+
+        take_stock({first.pk: 2, second.pk: 3})
+        self.assertEqual(stock(self.offers), {first.pk: 1, second.pk: 0})
+
+    def test_checkout_takes_the_stock(self):
+        first, second = self.offers
+
+        response = self.checkout(lines=[{'offer': first.pk, 'quantity': 2}, {'offer': second.pk, 'quantity': 1}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(stock(self.offers), {first.pk: 1, second.pk: 2})
+
+        response = self.checkout(lines=[{'offer': first.pk, 'quantity': 1}, {'offer': second.pk, 'quantity': 3}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offers'], [second.pk])
+        self.assertEqual(stock(self.offers), {first.pk: 1, second.pk: 2})
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_checkout_from_a_reservation(self):
+        first, second = self.offers
+
+        response = self.client.post('/api/orders/reservations/', {
+            'lines': [{'offer': first.pk, 'quantity': 3}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(stock(self.offers)[first.pk], 0)
+
+        response = self.checkout(reservation=response.data['token'])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['quantity'] for item in response.data['items']], [3])
+        self.assertEqual(stock(self.offers)[first.pk], 0)
+
+    def test_single_items_and_checkouts_each_make_an_order(self):
+        first, second = self.offers
+        for _ in range(2):
+            self.assertEqual(self.checkout(lines=[{'offer': first.pk, 'quantity': 1}]).status_code, 201)
+
+        response = self.client.post('/api/orders/item/create/', {
+            'offer': second.pk, 'quantity': 2, 'city': 'Kyiv', 'district': 'Center', 'delivery_method': 'post',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['quantity'] for item in response.data['items']], [2])
+        self.assertEqual(Order.objects.filter(user=self.buyer).count(), 3)
+        self.assertEqual(stock(self.offers), {first.pk: 1, second.pk: 1})
+
+    def test_deleting_an_ordered_item_puts_its_stock_back(self):
+        first, second = self.offers
+        response = self.checkout(lines=[{'offer': first.pk, 'quantity': 2}, {'offer': second.pk, 'quantity': 1}])
+        self.assertEqual(stock(self.offers), {first.pk: 1, second.pk: 2})
+
+        item = response.data['items'][0]
+        self.assertEqual(self.client.delete(f'/api/orders/item/{item["id"]}/delete/').status_code, 204)
+        self.assertEqual(stock(self.offers), {first.pk: 3, second.pk: 2})
+
+    def test_only_the_owner_deletes_an_item_and_only_taken_stock_comes_back(self):
+        first, _ = self.offers
+        response = self.checkout(lines=[{'offer': first.pk, 'quantity': 2}])
+        url = f'/api/orders/item/{response.data["items"][0]["id"]}/delete/'
+        other = APIClient()
+        self.assertEqual(other.delete(url).status_code, 403)
+        other.force_authenticate(Account.objects.create_user('Other', 'One', 'other@example.com', 'pw'))
+        self.assertEqual(other.delete(url).status_code, 403)
+        self.assertEqual(stock(self.offers)[first.pk], 1)
+
+        # ordered before stock was kept, nothing was taken for it
+        legacy = OrderItem.objects.create(user=self.buyer, offer=first, quantity=2, city='Kyiv', district='Center',
+                                          delivery_method='post')
+        self.assertEqual(self.client.delete(f'/api/orders/item/{legacy.pk}/delete/').status_code, 204)
+        self.assertEqual(stock(self.offers)[first.pk], 1)
+
+    def test_sold_out_offers_are_not_active(self):
+        first, second = self.offers
+        perfume = first.perfume
+
+        def active():
+            perfume.refresh_from_db()
+            return perfume.active_offer_count
+
+        self.assertEqual(active(), 2)
+        take_stock({first.pk: 1})
+        self.assertEqual(active(), 2)
+        take_stock({first.pk: 2})
+        self.assertEqual(active(), 1)
+        put_back_stock({first.pk: 1})
+        self.assertEqual(active(), 2)
+
+    def test_released_and_expired_reservations_return_the_stock(self):
+        first, second = self.offers
+        released = reserve({first.pk: 1})
+        expired = reserve({first.pk: 1, second.pk: 2}, ttl=60)
+        kept = reserve({second.pk: 1})
+        self.assertEqual(stock(self.offers), {first.pk: 1, second.pk: 0})
+
+        response = self.client.delete(f'/api/orders/reservations/{released.token}/')
+        self.assertEqual(response.status_code, 404)  # someone else's reservation
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.delete(f'/api/orders/reservations/{released.token}/').status_code, 204)
+        self.assertEqual(stock(self.offers), {first.pk: 2, second.pk: 0})
+
+        StockReservation.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired(), 1)
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(stock(self.offers), {first.pk: 3, second.pk: 2})
+
+        response = self.checkout(reservation=str(expired.token), non_registered_first_name='G',
+                                 non_registered_last_name='H', non_registered_email='guest@example.com',
+                                 non_registered_phone_number='1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(StockReservation.objects.get(pk=kept.pk).status, StockReservation.HELD)
+
+
+class OrderTotalsTests(TestCase):
+    def test_checkout_keeps_the_prices_it_was_ordered_at(self):
+        first, second = create_offers(2, quantity=10)
+        Offer.objects.filter(pk=second.pk).update(price_per_ml='12.50')
+        buyer = Account.objects.create_user('Buyer', 'One', 'buyer@example.com', 'pw')
+        client = APIClient()
+        client.force_authenticate(buyer)
+
+        response = client.post('/api/orders/checkout/', {
+            'lines': [{'offer': first.pk, 'quantity': 2}, {'offer': second.pk, 'quantity': 3}],
+            'city': 'Kyiv', 'district': 'Center', 'delivery_method': 'post',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total'], '57.50')
+        Offer.objects.update(price_per_ml=99)
+
+        response = client.get('/api/orders/')
+        [order] = response.data['results']
+        self.assertEqual(order['total'], '57.50')
+        self.assertEqual([(item['unit_price'], item['line_total']) for item in order['items']],
+                         [('10.00', '20.00'), ('12.50', '37.50')])
+
+        client.delete(f'/api/orders/item/{order["items"][0]["id"]}/delete/')
+        self.assertEqual(str(Order.objects.get().total), '37.50')
+
+    def test_editing_a_quantity_updates_the_totals(self):
+        [offer] = create_offers(1, quantity=10)
+        buyer = Account.objects.create_user('Buyer', 'One', 'buyer@example.com', 'pw')
+        item = OrderItem.objects.create(user=buyer, offer=offer, quantity=2, city='Kyiv', district='Center',
+                                        delivery_method='post')
+        order = Order.objects.create(user=buyer)
+        order.items.add(item)
+        Offer.objects.filter(pk=offer.pk).update(price_per_ml=99)
+
+        item.quantity = 3
+        item.save()
+        item.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual((str(item.line_total), str(order.total)), ('30.00', '30.00'))
+        item.quantity = 1
+        item.save(update_fields=['quantity'])
+        item.refresh_from_db()
+        self.assertEqual(str(item.line_total), '10.00')
+
+        # saved before prices were kept on the item
+        OrderItem.objects.filter(pk=item.pk).update(unit_price=None, line_total=None)
+        self.assertEqual(OrderItem.objects.get(pk=item.pk).order_item_price(), '99.00')
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.offers = create_offers(2, quantity=100)
+        self.buyer = Account.objects.create_user('Buyer', 'One', 'buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def order(self, count):
+        for _ in range(count):
+            response = self.client.post('/api/orders/checkout/', {
+                'lines': [{'offer': offer.pk, 'quantity': 1} for offer in self.offers],
+                'city': 'Kyiv', 'district': 'Center', 'delivery_method': 'post',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def history_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/orders/', {'page_size': 10})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_history_queries_dont_grow_with_the_orders(self):
+        self.order(2)
+        queries = self.history_queries()
+        self.order(6)
+        self.assertEqual(self.history_queries(), queries)
+
+    def test_history_pages_newest_first(self):
+        self.order(3)
+        Order.objects.create(user=Account.objects.create_user('Other', 'One', 'other@example.com', 'pw'))
+        response = self.client.get('/api/orders/', {'page_size': 2})
+        ids = [order['id'] for order in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [order['id'] for order in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, list(Order.objects.filter(user=self.buyer).order_by('-created_at', '-id')
+                                   .values_list('id', flat=True)))
+        self.assertEqual(response.data['results'][0]['total'], '20.00')
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    """
+    Buyers in threads with their own database connections race for the same
+    offers; whatever the interleaving, no offer may be oversold.
+    """
+    THREADS = 8
+    ATTEMPTS = 40
+
+    def test_concurrent_orders_never_oversell(self):
+        offers = create_offers(5, quantity=20)
+        initial = stock(offers)
+        taken = Counter()
+        errors = []
+        lock = threading.Lock()
+
+        def buyer(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.ATTEMPTS):
+                    cart = {offer.pk: rng.randint(1, 3) for offer in rng.sample(offers, rng.randint(1, 3))}
+                    while True:
+                        try:
+                            take_stock(cart)
+                        except OutOfStock:
+                            break
+                        except OperationalError as e:
+                            # SQLite allows one writer at a time and reports a busy database, try again
+                            if 'locked' not in str(e):
+                                raise
+                            time.sleep(0.001)
+                        else:
+                            with lock:
+                                taken.update(cart)
+                            break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(seed,)) for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        final = stock(offers)
+        for offer_id, quantity in initial.items():
+            self.assertGreaterEqual(final[offer_id], 0)
+            self.assertEqual(quantity - final[offer_id], taken[offer_id])
+        # 8 buyers asking for ~10 bottles per cart 40 times each sell the offers out
+        self.assertTrue(any(quantity == 0 for quantity in final.values()))
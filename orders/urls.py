@@ -1,10 +1,13 @@
 from django.urls import path
 
-from orders.views import OrderItemAPIView, UserOrderAPIView
+from orders.views import OrderItemAPIView, UserOrderAPIView, CheckoutAPIView, StockReservationAPIView
 
 urlpatterns = [
     path('item/create/', OrderItemAPIView.as_view(), name='orderitem-create'),
     path('item/<int:pk>/delete/', OrderItemAPIView.as_view(), name='orderitem-delete'),
+    path('checkout/', CheckoutAPIView.as_view(), name='checkout'),
+    path('reservations/', StockReservationAPIView.as_view(), name='stock-reservation-create'),
+    path('reservations/<uuid:token>/', StockReservationAPIView.as_view(), name='stock-reservation-release'),
     path('', UserOrderAPIView.as_view(), name='user-order-list'),
 
 ]
@@ -1,11 +1,15 @@
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from orders.models import OrderItem, Order
-from orders.serializers import OrderItemSerializer, OrderSerializer, NonRegisteredUserOrderItemSerializer
+from orders.pagination import OrderCursorPagination
+from orders.serializers import OrderItemSerializer, OrderSerializer, NonRegisteredUserOrderItemSerializer, \
+    CheckoutSerializer, StockReservationSerializer
+from orders.stock import OutOfStock, ReservationExpired, take_stock, put_back_stock, release_reservation
 
 
 class OrderItemAPIView(APIView):
@@ -20,13 +24,19 @@ class OrderItemAPIView(APIView):
             serializer = NonRegisteredUserOrderItemSerializer(data=request.data)
 
         if serializer.is_valid():
-            with transaction.atomic():
-                order_item = serializer.save()
-                # Create or get the order for the user
-                order, created = Order.objects.get_or_create(user=order_item.user)
-                order.items.add(order_item)
-                order_serializer = OrderSerializer(order)
-                return Response(order_serializer.data, status=status.HTTP_201_CREATED)
+            # a registered user's item is theirs, whatever the body says
+            owner = {'user': request.user} if request.user.is_authenticated else {}
+            try:
+                with transaction.atomic():
+                    order_item = serializer.save(stock_taken=True, **owner)
+                    take_stock({order_item.offer_id: order_item.quantity})
+                    # an order of its own, like every checkout
+                    order = Order.objects.create(user=order_item.user)
+                    order.items.add(order_item)
+                    order_serializer = OrderSerializer(Order.objects.for_history().get(pk=order.pk))
+                    return Response(order_serializer.data, status=status.HTTP_201_CREATED)
+            except OutOfStock as e:
+                return Response({'detail': str(e), 'offers': e.offer_ids}, status=status.HTTP_409_CONFLICT)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -36,10 +46,51 @@ class OrderItemAPIView(APIView):
         except OrderItem.DoesNotExist:
             return Response({'detail': 'Order item not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        if request.user.is_authenticated and request.user != order_item.user:
+        if not request.user.is_authenticated or request.user != order_item.user:
             return Response({'detail': 'Permission denied.'}, status=status.HTTP_403_FORBIDDEN)
 
-        order_item.delete()
+        with transaction.atomic():
+            # of two concurrent deletes only one removes the row and puts the stock back
+            deleted = OrderItem.objects.filter(pk=order_item.pk).delete()[1].get(OrderItem._meta.label)
+            if deleted and order_item.stock_taken:
+                put_back_stock({order_item.offer_id: order_item.quantity})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CheckoutAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request, format=None):
+        serializer = CheckoutSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order = serializer.save()
+        except OutOfStock as e:
+            return Response({'detail': str(e), 'offers': e.offer_ids}, status=status.HTTP_409_CONFLICT)
+        except ReservationExpired as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        prefetch_related_objects([order], 'user__userprofile', 'items__offer__perfume')
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
+
+class StockReservationAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request, format=None):
+        serializer = StockReservationSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            serializer.save()
+        except OutOfStock as e:
+            return Response({'detail': str(e), 'offers': e.offer_ids}, status=status.HTTP_409_CONFLICT)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, token, format=None):
+        user = request.user if request.user.is_authenticated else None
+        if not release_reservation(token, user=user):
+            return Response({'detail': 'Reservation not found.'}, status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -48,6 +99,8 @@ class UserOrderAPIView(APIView):
 
     def get(self, request, format=None):
         user = self.request.user
-        orders = Order.objects.filter(user=user).order_by('-created_at')
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = Order.objects.for_history().filter(user=user)
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(orders, request)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
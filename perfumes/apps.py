@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PerfumesConfig(AppConfig):
     name = 'perfumes'
+
+    def ready(self):
+        import perfumes.signals
@@ -0,0 +1,79 @@
+"""
+Async versions of the read-heavy catalog endpoints, for serving under an ASGI
+server such as uvicorn.
+
+They filter, order and page exactly like the sync views, whose querysets and
+paginators they reuse, but fetch the rows with the async ORM. Every relation
+the serializers touch is selected or prefetched up front, so serializing never
+hits the database from the event loop.
+"""
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from perfumes.models import Perfume
+from perfumes.pagination import CatalogCursorPagination, ReviewCursorPagination
+from perfumes.serializers import PerfumeListSerializer, PerfumeSerializer, OfferSerializer, ReviewSerializer
+from perfumes.views import listed_perfumes, listed_offers, listed_reviews
+
+CHUNK_SIZE = 100
+
+
+async def _page(request, queryset, paginator):
+    """
+    The page of ``queryset`` the paginator would cut for the sync view.
+    Raises NotFound for a malformed cursor, as the sync views do.
+    """
+    rows = paginator.seek(queryset, request)
+    return paginator.take([row async for row in rows.aiterator(CHUNK_SIZE)])
+
+
+def _paginated_response(paginator, data):
+    return JsonResponse({'next': paginator.get_next_link(), 'previous': paginator.get_previous_link(),
+                         'results': data})
+
+
+@require_GET
+async def perfume_list(request):
+    request = Request(request)
+    paginator = CatalogCursorPagination()
+    perfumes = listed_perfumes(request.query_params, paginator)
+    try:
+        page = await _page(request, perfumes, paginator)
+    except NotFound as e:
+        return JsonResponse({'detail': str(e.detail)}, status=404)
+    serializer = PerfumeListSerializer(page, many=True, context={'query_params': request.query_params})
+    return _paginated_response(paginator, serializer.data)
+
+
+@require_GET
+async def perfume_detail(request, pk):
+    fields = PerfumeSerializer.rendered_fields(request.GET)
+    try:
+        perfume = await Perfume.objects.for_catalog(fields).aget(pk=pk)
+    except Perfume.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return JsonResponse(PerfumeSerializer(perfume, context={'query_params': request.GET}).data)
+
+
+@require_GET
+async def perfume_offers(request, perfume_id):
+    if not await Perfume.objects.filter(pk=perfume_id).aexists():
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    offers = [offer async for offer in listed_offers(request.GET, perfume_id).aiterator(CHUNK_SIZE)]
+    serializer = OfferSerializer(offers, many=True, context={'query_params': request.GET})
+    return JsonResponse(serializer.data, safe=False)
+
+
+@require_GET
+async def perfume_reviews(request, perfume_id):
+    request = Request(request)
+    paginator = ReviewCursorPagination()
+    reviews = listed_reviews(request.query_params, perfume_id, paginator)
+    try:
+        page = await _page(request, reviews, paginator)
+    except NotFound as e:
+        return JsonResponse({'detail': str(e.detail)}, status=404)
+    serializer = ReviewSerializer(page, many=True, context={'request': request, 'query_params': request.query_params})
+    return _paginated_response(paginator, serializer.data)
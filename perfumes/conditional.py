@@ -0,0 +1,70 @@
+"""
+ETag / Last-Modified validators for the perfume and offer detail endpoints,
+used with django.views.decorators.http.condition.
+
+Both come from one query over the update timestamps of the object and of the
+rows nested in its representation, so a revalidation never loads or
+serializes the object. Deleting a nested row, and editing a brand, category,
+account or profile whose names or picture are embedded, touches the perfume's
+updated_at (see perfumes.signals), so those move the timestamp forward as well.
+"""
+import hashlib
+
+from django.db.models import Max, OuterRef, Subquery
+
+from perfumes.models import Perfume, Offer, Review, ReviewReply
+
+
+def _latest(queryset, group_by, field):
+    return Subquery(queryset.order_by().values(group_by).annotate(latest=Max(field)).values('latest'))
+
+
+def _nested_timestamps(perfume):
+    return {
+        'offers_updated_at': _latest(Offer.objects.filter(perfume=perfume), 'perfume', 'updated_at'),
+        'reviews_updated_at': _latest(Review.objects.filter(perfume=perfume), 'perfume', 'updated_at'),
+        'replies_created_at': _latest(ReviewReply.objects.filter(review__perfume=perfume), 'review__perfume',
+                                      'created_at'),
+    }
+
+
+def _last_modified(request, queryset):
+    # etag and last_modified are asked for separately, query once per request
+    if not hasattr(request, '_catalog_last_modified'):
+        timestamps = queryset.first()
+        request._catalog_last_modified = max(filter(None, timestamps.values())) if timestamps else None
+    return request._catalog_last_modified
+
+
+def _etag(request, last_modified, *identity):
+    if last_modified is None:
+        return None
+    # the representation also depends on ?fields=/?expand= and the renderer
+    query = sorted((key, value) for key, values in request.GET.lists() for value in values if value)
+    return hashlib.md5(
+        repr((identity, last_modified.isoformat(), query, request.META.get('HTTP_ACCEPT', ''))).encode()
+    ).hexdigest()
+
+
+def perfume_last_modified(request, pk):
+    return _last_modified(
+        request,
+        Perfume.objects.filter(pk=pk).values('updated_at').annotate(**_nested_timestamps(OuterRef('pk')))
+    )
+
+
+def perfume_etag(request, pk):
+    return _etag(request, perfume_last_modified(request, pk), 'perfume', pk)
+
+
+def offer_last_modified(request, offer_id):
+    return _last_modified(
+        request,
+        Offer.objects.filter(pk=offer_id).values('updated_at', 'perfume__updated_at').annotate(
+            **_nested_timestamps(OuterRef('perfume'))
+        )
+    )
+
+
+def offer_etag(request, offer_id):
+    return _etag(request, offer_last_modified(request, offer_id), 'offer', offer_id)
@@ -0,0 +1,60 @@
+"""
+Filter sidebar helpers shared by filteredProductsView and perfume_facets.
+
+Counts are disjunctive: the counts of one facet apply the selections of every
+other facet but not its own, so picking a brand still shows how many perfumes
+each of the other brands would add.
+"""
+from django.db.models import Count
+
+from perfumes.models import Perfume, Category, Brand, Gender
+
+FACETS = {
+    'categories': ('category', Category),
+    'brands': ('brand', Brand),
+    'genders': ('gender', Gender),
+}
+
+
+def _ids(values):
+    # like rating_options, a malformed value is ignored
+    return [int(value) for value in values if value.strip().isdigit()]
+
+
+def selected_filters(query_params):
+    return {
+        'category': _ids(query_params.get('selectedCategories', '').split(',')),
+        'brand': _ids(query_params.get('selectedBrands', '').split(',')),
+        'gender': _ids([query_params.get('selectedGender', '')]),
+    }
+
+
+def filter_perfumes(perfumes, selected, exclude=None):
+    for field, values in selected.items():
+        if values and field != exclude:
+            perfumes = perfumes.filter(**{f'{field}_id__in': values})
+    return perfumes
+
+
+def count_facets(selected):
+    """
+    One grouped COUNT per facet plus the (small) lookup tables for the names.
+    """
+    facets = {'total': filter_perfumes(Perfume.objects.all(), selected).count()}
+    for key, (field, model) in FACETS.items():
+        counts = dict(
+            filter_perfumes(Perfume.objects.all(), selected, exclude=field)
+            .order_by()
+            .values_list(f'{field}_id')
+            .annotate(count=Count('id'))
+        )
+        facets[key] = [
+            {
+                'id': value.id,
+                'name': value.name,
+                'count': counts.get(value.id, 0),
+                'selected': value.id in selected[field],
+            }
+            for value in model.objects.order_by('name')
+        ]
+    return facets
@@ -0,0 +1,170 @@
+import json
+import logging
+import re
+import statistics
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import get_resolver, URLResolver
+from django.urls.resolvers import RoutePattern
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.models import Account
+from djangoPerfumes.cache import get_cache
+from orders.models import Order
+from perfumes.models import Perfume, Offer, Review
+
+# URL prefixes that aren't part of the API
+SKIPPED_PREFIXES = ('admin/',)
+URL_PARAMETER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+def iter_routes(resolver, prefix=''):
+    """
+    Yield (route, name) for every path() pattern; regex patterns such as the
+    media route in DEBUG can't be filled in and are left out.
+    """
+    for pattern in resolver.url_patterns:
+        if not isinstance(pattern.pattern, RoutePattern):
+            continue
+        route = str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from iter_routes(pattern, prefix + route)
+        else:
+            yield prefix + route, pattern.name
+
+
+class Command(BaseCommand):
+    help = ('GET every URL in djangoPerfumes.urls through the test client and record SQL query count, wall time '
+            'and response size as JSON. Run it against a database filled by seed_catalog; with --baseline it fails '
+            'when an endpoint got slower or chattier than a previous run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per URL, the median time is reported')
+        parser.add_argument('--user', help='Email of the account to authenticate as (default: any confirmed one)')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the response cache between requests instead of clearing it')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--baseline', help='JSON report of a previous run to compare against')
+        parser.add_argument('--time-tolerance', type=float, default=0.5,
+                            help='Allowed relative slowdown against the baseline before failing')
+
+    def handle(self, *args, **options):
+        # 4xx responses (GET on POST-only routes, ...) are expected here
+        request_logger = logging.getLogger('django.request')
+        log_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            # already running inside the test runner
+            own_environment = False
+        try:
+            report = self.run_benchmark(options)
+        finally:
+            if own_environment:
+                teardown_test_environment()
+            request_logger.setLevel(log_level)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                regressions = self.compare(json.load(file), report, options['time_tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+
+    def run_benchmark(self, options):
+        user = self.get_user(options['user'])
+        client = Client()
+        if user:
+            client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        parameters = self.url_parameters(user)
+
+        results = []
+        for route, name in iter_routes(get_resolver()):
+            if route.startswith(SKIPPED_PREFIXES):
+                continue
+            missing = [parameter for parameter in URL_PARAMETER.findall(route) if parameter not in parameters]
+            if missing:
+                self.stderr.write(f'Skipping {route}: no sample value for {", ".join(missing)}')
+                continue
+            url = '/' + URL_PARAMETER.sub(lambda match: str(parameters[match.group(1)]), route)
+            results.append(self.measure(client, url, route, name, options))
+
+        return {
+            'generated_at': timezone.now().isoformat(),
+            'dataset': {
+                'accounts': Account.objects.count(),
+                'perfumes': Perfume.objects.count(),
+                'offers': Offer.objects.count(),
+                'reviews': Review.objects.count(),
+                'orders': Order.objects.count(),
+            },
+            'results': results,
+        }
+
+    def measure(self, client, url, route, name, options):
+        timings = []
+        for _ in range(options['repeat']):
+            if not options['warm_cache']:
+                get_cache().clear()
+            # every alias, catalog reads may go to the replica
+            with ExitStack() as stack:
+                queries = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+                started = time.perf_counter()
+                response = client.get(url)
+                content = b''.join(response) if response.streaming else response.content
+                timings.append((time.perf_counter() - started) * 1000)
+        return {
+            'route': route,
+            'name': name,
+            'url': url,
+            'status': response.status_code,
+            'queries': sum(len(captured) for captured in queries),
+            'time_ms': round(statistics.median(timings), 2),
+            'bytes': len(content),
+        }
+
+    def get_user(self, email):
+        if email:
+            return Account.objects.get(email=email)
+        return Account.objects.filter(is_confirmed=True).order_by('pk').first()
+
+    def url_parameters(self, user):
+        offer = Offer.objects.order_by('pk').first()
+        review = Review.objects.order_by('pk').first()
+        return {
+            'token': 'benchmark',
+            'email': user.email if user else 'nobody@example.com',
+            'pk': offer.perfume_id if offer else 0,
+            'perfume_id': offer.perfume_id if offer else 0,
+            'offer_id': offer.pk if offer else 0,
+            'review_id': review.pk if review else 0,
+            'kind': 'perfumes',
+            'file_format': 'ndjson',
+        }
+
+    def compare(self, baseline, report, tolerance):
+        previous = {result['route']: result for result in baseline['results']}
+        regressions = []
+        for result in report['results']:
+            before = previous.get(result['route'])
+            if before is None:
+                continue
+            if result['queries'] > before['queries']:
+                regressions.append(f'{result["route"]}: {before["queries"]} -> {result["queries"]} queries')
+            if result['time_ms'] > before['time_ms'] * (1 + tolerance):
+                regressions.append(f'{result["route"]}: {before["time_ms"]} -> {result["time_ms"]} ms')
+        return regressions
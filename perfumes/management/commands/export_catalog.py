@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from perfumes.transfer import EXPORTS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Write every perfume or offer as NDJSON or CSV, streamed from the database in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', dest='file_format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--output', help='File to write, standard output by default')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['kind'], options['file_format'], options['chunk_size'], options['database'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,42 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from accounts.models import Account
+from perfumes.transfer import FORMATS, IMPORTERS, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Import perfumes or offers from a CSV or NDJSON feed in batches, see perfumes.transfer for how rows '
+            'are matched to the existing catalog')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', choices=list(FORMATS),
+                            help='Format of the feed, by default from the file extension')
+        parser.add_argument('--user', help='Email of the account rows without a user or seller are assigned to')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        file_format = options['file_format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Unknown feed format, use --format with one of {", ".join(FORMATS)}.')
+        user = None
+        if options['user']:
+            user = Account.objects.using(options['database']).filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f'No account with the email {options["user"]}.')
+
+        importer = IMPORTERS[options['kind']](user=user, batch_size=options['batch_size'], using=options['database'])
+        with open(options['path'], encoding='utf-8-sig', newline='') as feed:
+            report = importer.run(read_rows(feed, file_format))
+
+        for error in report.errors:
+            self.stderr.write(f'line {error["line"]}: {"; ".join(error["errors"])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {report.created} and updated {report.updated} {options["kind"]}, '
+            f'{report.unchanged} were unchanged, skipped {report.error_count} invalid rows.'
+        ))
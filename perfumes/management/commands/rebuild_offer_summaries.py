@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from perfumes.models import Perfume
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored offer price range and offer count of every perfume'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            updated = Perfume.objects.using(options['database']).refresh_offer_summary()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed the offer summary of {updated} perfumes.'))
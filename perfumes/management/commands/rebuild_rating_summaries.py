@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from perfumes.models import Perfume, Offer
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating count, sum, histogram and average of every perfume and offer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            perfumes = Perfume.objects.using(options['database']).refresh_rating_summary()
+            offers = Offer.objects.using(options['database']).refresh_rating_summary()
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed the rating summary of {perfumes} perfumes and {offers} offers.'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from perfumes import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the perfume catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_supported(using):
+            self.stderr.write('Full-text search is only available on SQLite databases.')
+            return
+        search.create_index(using)
+        search.rebuild_index(using)
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
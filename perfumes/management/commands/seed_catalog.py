@@ -0,0 +1,152 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Account, UserProfile
+from blog.models import Post
+from djangoPerfumes.cache import bump_version
+from orders.models import Order, OrderItem
+from perfumes import search
+from perfumes.models import Brand, Category, Gender, Perfume, Offer, Review, ReviewReply
+
+NOTES = ['bergamot', 'vanilla', 'amber', 'musk', 'oud', 'rose', 'jasmine', 'cedar', 'vetiver', 'patchouli',
+         'lavender', 'iris', 'leather', 'tonka', 'sandalwood', 'neroli', 'pepper', 'citrus']
+WORDS = ['noir', 'blanc', 'intense', 'eau', 'sauvage', 'bleu', 'rouge', 'velvet', 'night', 'garden', 'mist',
+         'gold', 'silk', 'wood', 'storm', 'bloom', 'essence', 'absolu']
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a synthetic catalog for benchmarking (see benchmark_api). '
+            'Meant for a scratch database: it only adds rows, nothing is cleaned up.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=50)
+        parser.add_argument('--perfumes', type=int, default=200)
+        parser.add_argument('--offers-per-perfume', type=int, default=3)
+        parser.add_argument('--reviews-per-perfume', type=int, default=5)
+        parser.add_argument('--replies-per-review', type=int, default=1)
+        parser.add_argument('--orders', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            tag = f'{options["seed"]}-{Account.objects.count()}'
+            accounts = self.seed_accounts(options['accounts'], tag, batch_size)
+            perfumes = self.seed_perfumes(rng, accounts, options['perfumes'], tag, batch_size)
+            offers = self.seed_offers(rng, accounts, perfumes, options['offers_per_perfume'], batch_size)
+            reviews = self.seed_reviews(rng, accounts, perfumes, options['reviews_per_perfume'], batch_size)
+            replies = self.seed_replies(rng, accounts, reviews, options['replies_per_review'], batch_size)
+            orders = self.seed_orders(rng, accounts, offers, options['orders'], batch_size)
+            posts = self.seed_posts(rng, options['posts'], batch_size)
+
+            # bulk_create skips the signals that maintain these
+            Perfume.objects.filter(pk__in=[perfume.pk for perfume in perfumes]).refresh_offer_summary()
+            Perfume.objects.filter(pk__in=[perfume.pk for perfume in perfumes]).refresh_rating_summary()
+            search.rebuild_index()
+        bump_version('perfume', 'offer', 'review', 'brand', 'category', 'gender', 'seller', 'post')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(accounts)} accounts, {len(perfumes)} perfumes, {len(offers)} offers, '
+            f'{len(reviews)} reviews, {len(replies)} replies, {orders} orders and {len(posts)} posts.'
+        ))
+
+    def seed_accounts(self, count, tag, batch_size):
+        password = make_password('benchmark')
+        accounts = Account.objects.bulk_create([
+            Account(first_name=f'Seller{i}', last_name='Bench', email=f'bench-{tag}-{i}@example.com',
+                    password=password, is_confirmed=True)
+            for i in range(count)
+        ], batch_size=batch_size)
+        UserProfile.objects.bulk_create([
+            UserProfile(user=account, address_line='Bench street 1', city='Kyiv', could_sell=True)
+            for account in accounts
+        ], batch_size=batch_size)
+        return accounts
+
+    def seed_perfumes(self, rng, accounts, count, tag, batch_size):
+        brands = self.lookup_rows(Brand, [f'Brand {i}' for i in range(max(1, count // 20))])
+        categories = self.lookup_rows(Category, ['Fresh', 'Woody', 'Oriental', 'Floral', 'Citrus', 'Gourmand'])
+        genders = self.lookup_rows(Gender, ['Male', 'Female', 'Unisex'])
+        return Perfume.objects.bulk_create([
+            Perfume(
+                user=rng.choice(accounts),
+                name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {tag}-{i}',
+                description=' '.join(rng.choices(WORDS + NOTES, k=30)),
+                category=rng.choice(categories),
+                gender=rng.choice(genders),
+                brand=rng.choice(brands),
+                type='EDP',
+                first_note=rng.choice(NOTES),
+                heart_note=rng.choice(NOTES),
+                last_note=rng.choice(NOTES),
+            )
+            for i in range(count)
+        ], batch_size=batch_size)
+
+    def lookup_rows(self, model, names):
+        model.objects.bulk_create([model(name=name) for name in names], ignore_conflicts=True)
+        return list(model.objects.filter(name__in=names))
+
+    def seed_offers(self, rng, accounts, perfumes, per_perfume, batch_size):
+        return Offer.objects.bulk_create([
+            Offer(
+                seller=rng.choice(accounts),
+                brand_id=perfume.brand_id,
+                category_id=perfume.category_id,
+                perfume=perfume,
+                description='Seeded offer',
+                quantity=rng.randint(0, 100),
+                price_per_ml=Decimal(rng.randint(500, 20000)) / 100,
+            )
+            for perfume in perfumes
+            for _ in range(per_perfume)
+        ], batch_size=batch_size)
+
+    def seed_reviews(self, rng, accounts, perfumes, per_perfume, batch_size):
+        return Review.objects.bulk_create([
+            Review(perfume=perfume, user=rng.choice(accounts), rating=rng.randint(1, 5),
+                   comment=' '.join(rng.choices(WORDS, k=12)), name='Bench')
+            for perfume in perfumes
+            for _ in range(per_perfume)
+        ], batch_size=batch_size)
+
+    def seed_replies(self, rng, accounts, reviews, per_review, batch_size):
+        return ReviewReply.objects.bulk_create([
+            ReviewReply(review=review, user=rng.choice(accounts), comment=' '.join(rng.choices(WORDS, k=8)))
+            for review in reviews
+            for _ in range(per_review)
+        ], batch_size=batch_size)
+
+    def seed_orders(self, rng, accounts, offers, count, batch_size):
+        if not offers or not accounts:
+            return 0
+        orders = Order.objects.bulk_create([Order(user=rng.choice(accounts)) for _ in range(count)],
+                                           batch_size=batch_size)
+        lines = [
+            (order, OrderItem(user=order.user, offer=rng.choice(offers), quantity=rng.randint(1, 3), city='Kyiv',
+                              district='Center', delivery_method='post', delivery_branch='1'))
+            for order in orders
+            for _ in range(rng.randint(1, 4))
+        ]
+        for _, item in lines:
+            item.set_price(item.offer)
+        OrderItem.objects.bulk_create([item for _, item in lines], batch_size=batch_size)
+        Order.items.through.objects.bulk_create([
+            Order.items.through(order=order, orderitem=item) for order, item in lines
+        ], batch_size=batch_size)
+        Order.objects.filter(pk__in=[order.pk for order in orders]).refresh_totals()
+        return len(orders)
+
+    def seed_posts(self, rng, count, batch_size):
+        return Post.objects.bulk_create([
+            Post(title=f'{rng.choice(WORDS).title()} notes {i}', content=' '.join(rng.choices(WORDS + NOTES, k=200)),
+                 tag=rng.choice(NOTES))
+            for i in range(count)
+        ], batch_size=batch_size)
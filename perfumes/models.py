@@ -1,5 +1,6 @@
 from django.db import models
-from django.db.models import Min, Max
+from django.db.models import Min, Max, Count, Sum, Avg, F, Q, OuterRef, Subquery, Prefetch
+from django.db.models.functions import Coalesce, Cast, NullIf
 
 from accounts.models import Account
 
@@ -25,7 +26,111 @@ class Brand(models.Model):
         return self.name
 
 
-class Perfume(models.Model):
+RATINGS = range(1, 6)
+
+
+class RatingSummary(models.Model):
+    """
+    Review count, sum and histogram of the 1-5 ratings of a perfume or offer,
+    plus their average for sorting and filtering. Kept current by
+    perfumes.signals as reviews come and go, see rating_changes.
+    """
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+
+    # the Review foreign key that points at this model
+    review_field = None
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def rating_changes(rating, sign):
+        """
+        UPDATE values that add (sign=1) or remove (sign=-1) one rating. They
+        only reference the row itself, so concurrent reviews can't lose
+        each other's update.
+        """
+        count = F('rating_count') + sign
+        total = F('rating_sum') + sign * rating
+        return {
+            'rating_count': count,
+            'rating_sum': total,
+            f'rating_{rating}': F(f'rating_{rating}') + sign,
+            'rating_average': Coalesce(Cast(total, models.FloatField()) / NullIf(count, 0), 0.0,
+                                       output_field=models.FloatField()),
+        }
+
+    def rating_histogram(self):
+        return {str(rating): getattr(self, f'rating_{rating}') for rating in RATINGS}
+
+
+class RatingSummaryQuerySet(models.QuerySet):
+    def refresh_rating_summary(self):
+        """
+        Recompute the stored rating summary of these rows from their reviews
+        in a single UPDATE.
+        """
+        reviews = Review.objects.filter(**{self.model.review_field: OuterRef('pk'), 'rating__in': RATINGS})
+        reviews = reviews.order_by().values(self.model.review_field)
+
+        def aggregate(expression):
+            return Coalesce(Subquery(reviews.annotate(value=expression).values('value')), 0)
+
+        return self.update(
+            rating_count=aggregate(Count('pk')),
+            rating_sum=aggregate(Sum('rating')),
+            rating_average=Coalesce(Subquery(reviews.annotate(value=Avg('rating')).values('value')), 0.0,
+                                    output_field=models.FloatField()),
+            **{f'rating_{rating}': aggregate(Count('pk', filter=Q(rating=rating))) for rating in RATINGS},
+        )
+
+
+class PerfumeQuerySet(RatingSummaryQuerySet):
+    def refresh_offer_summary(self):
+        """
+        Recompute the stored offer price range and count of these perfumes in
+        a single UPDATE. Only offers with stock left count as active.
+        """
+        offers = Offer.objects.filter(perfume=OuterRef('pk')).order_by().values('perfume')
+        in_stock = offers.annotate(count=Count('pk', filter=Q(quantity__gt=0))).values('count')
+        return self.update(
+            min_price_per_ml=Subquery(offers.annotate(price=Min('price_per_ml')).values('price')),
+            max_price_per_ml=Subquery(offers.annotate(price=Max('price_per_ml')).values('price')),
+            active_offer_count=Coalesce(Subquery(in_stock), 0),
+        )
+
+    def for_catalog(self, fields=None):
+        """
+        Load everything PerfumeSerializer renders in a fixed number of queries.
+        ``fields`` limits the related rows to the ones that are rendered.
+        """
+        related = {'brand': 'brand', 'category': 'category', 'user': 'user__userprofile'}
+        queryset = self.select_related(
+            *[relation for field, relation in related.items() if fields is None or field in fields]
+        )
+        if fields is None or 'reviews' in fields:
+            queryset = queryset.prefetch_related(Prefetch('reviews', queryset=Review.objects.for_catalog()))
+        return queryset
+
+
+def format_price_range(min_price, max_price):
+    if min_price is not None and (min_price == max_price or max_price is None):
+        return f"₴{min_price}"
+    elif max_price is not None and min_price is None:
+        return f"₴{max_price}"
+    elif min_price and max_price:
+        return f"Від ₴{min_price} до ₴{max_price}"
+    return "Пропозицій немає"
+
+
+class Perfume(RatingSummary):
     user = models.ForeignKey(Account, on_delete=models.DO_NOTHING)
     name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
@@ -39,27 +144,47 @@ class Perfume(models.Model):
     last_note = models.CharField(max_length=255, blank=True, null=True)
     image = models.ImageField(upload_to='perfume_images/', blank=True, null=True,
                               default='/perfume_images/perfume_default')
+    # thumbnails and WebP/JPEG copies of the image, made by images.pipeline
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Summary of the perfume's offers, kept up to date by perfumes.signals
+    min_price_per_ml = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    max_price_per_ml = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    active_offer_count = models.PositiveIntegerField(default=0, editable=False)
+
+    review_field = 'perfume'
+
+    objects = PerfumeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the filters of perfume_list and filteredProductsView
+            models.Index(fields=['category', 'brand', 'gender']),
+            # CatalogCursorPagination: newest first, or best rated first
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['rating_average', 'rating_count']),
+        ]
+
     def __str__(self):
         return self.name
 
     def get_price_range(self):
-        offers = Offer.objects.filter(perfume=self)
-        min_price = offers.aggregate(Min('price_per_ml'))['price_per_ml__min']
-        max_price = offers.aggregate(Max('price_per_ml'))['price_per_ml__max']
+        return format_price_range(self.min_price_per_ml, self.max_price_per_ml)
+
 
-        if min_price is not None and (min_price == max_price or max_price is None):
-            return f"₴{min_price}"
-        elif max_price is not None and min_price is None:
-            return f"₴{max_price}"
-        elif min_price and max_price:
-            return f"Від ₴{min_price} до ₴{max_price}"
-        return "Пропозицій немає"
+class OfferQuerySet(RatingSummaryQuerySet):
+    def for_catalog(self, fields=None):
+        """
+        Load everything OfferSerializer renders, including the nested perfume.
+        """
+        if fields is None or 'perfume_data' in fields:
+            return self.prefetch_related(Prefetch('perfume', queryset=Perfume.objects.for_catalog()))
+        return self
 
 
-class Offer(models.Model):
+class Offer(RatingSummary):
     seller = models.ForeignKey(Account, on_delete=models.CASCADE)
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, blank=True, null=True)
@@ -67,6 +192,9 @@ class Offer(models.Model):
 
     image1 = models.ImageField(upload_to='offer_images/', blank=True, null=True)
     image2 = models.ImageField(upload_to='offer_images/', blank=True, null=True)
+    # thumbnails and WebP/JPEG copies of the images, made by images.pipeline
+    image1_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image2_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     description = models.TextField()
     quantity = models.PositiveIntegerField(default=0)
@@ -75,10 +203,48 @@ class Offer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    review_field = 'offer'
+
+    objects = OfferQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the offers of a perfume and their price range, see refresh_offer_summary
+            models.Index(fields=['perfume', 'price_per_ml']),
+            models.Index(fields=['seller', 'created_at']),
+        ]
+
     def __str__(self):
         return f"{self.perfume.name} - {self.seller.full_name()}"
 
 
+class ReviewQuerySet(models.QuerySet):
+    def for_catalog(self, fields=None, replies=None):
+        """
+        With ``replies`` only the first that many replies of each review are
+        prefetched, in one windowed query (ROW_NUMBER() OVER (PARTITION BY
+        review_id)), into ``replies_preview``. ``replies_count`` holds how
+        many there are in all whenever it or ``more_replies`` is rendered.
+        """
+        queryset = self
+        if fields is None or 'user' in fields:
+            queryset = queryset.select_related('user__userprofile')
+        if fields is None or not fields.isdisjoint({'replies_count', 'more_replies'}):
+            counts = ReviewReply.objects.filter(review=OuterRef('pk')).order_by().values('review')
+            queryset = queryset.annotate(
+                replies_count=Coalesce(Subquery(counts.annotate(count=Count('pk')).values('count')), 0)
+            )
+        if fields is None or not fields.isdisjoint({'replies', 'more_replies'}):
+            thread = ReviewReply.objects.select_related('user__userprofile').order_by('created_at', 'id')
+            if replies is None:
+                queryset = queryset.prefetch_related(Prefetch('replies', queryset=thread))
+            else:
+                queryset = queryset.prefetch_related(
+                    Prefetch('replies', queryset=thread[:replies], to_attr='replies_preview')
+                )
+        return queryset
+
+
 class Review(models.Model):
     perfume = models.ForeignKey(Perfume, on_delete=models.CASCADE, blank=True, null=True, related_name='reviews')
     offer = models.ForeignKey(Offer, on_delete=models.CASCADE, blank=True, null=True)
@@ -87,10 +253,26 @@ class Review(models.Model):
     comment = models.TextField(null=True, blank=True)
     name = models.CharField(max_length=200, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ReviewQuerySet.as_manager()
+
+    class Meta:
+        # ReviewCursorPagination over the reviews of a perfume or an offer
+        indexes = [models.Index(fields=['perfume', 'created_at']), models.Index(fields=['offer', 'created_at'])]
 
     def __str__(self):
         return str(self.rating)
 
+    def listed_replies(self):
+        """
+        The replies to show with the review, only the first few when
+        prefetched by ``for_catalog(replies=...)``.
+        """
+        if hasattr(self, 'replies_preview'):
+            return self.replies_preview
+        return self.replies.all()
+
 
 class ReviewReply(models.Model):
     review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='replies')
@@ -98,5 +280,41 @@ class ReviewReply(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # ReplyCursorPagination and the reply previews of ReviewQuerySet.for_catalog
+        indexes = [models.Index(fields=['review', 'created_at'])]
+
     def __str__(self):
         return f"Reply by {self.user} on {self.review}"
+
+
+class SearchDocumentField(models.TextField):
+    """
+    The hidden column of an FTS5 table that carries the table's own name.
+    Supports ``__match`` for full-text queries against every indexed column.
+    """
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class PerfumeSearchEntry(models.Model):
+    """
+    Row of the FTS5 index mirroring a perfume. The table is created and kept in
+    sync by perfumes.search; this model only exists so it can be joined.
+    """
+    perfume = models.OneToOneField(Perfume, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                   related_name='search_entry')
+    document = SearchDocumentField(db_column='perfumes_perfume_search')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'perfumes_perfume_search'
@@ -0,0 +1,153 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.urls import reverse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor, _reverse_ordering
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on every column of ``ordering``.
+
+    DRF's CursorPagination compares only the first column and steps over rows
+    sharing it with OFFSET, which reads all of them again on every page. Here
+    the cursor holds the whole position and a page is the rows past it,
+    ``WHERE (a, b, id) < (...)``. The ordering must end in a unique column
+    and its columns must not be NULL, then no two rows share a position and
+    the cursor never needs an offset.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.seek(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.take(list(queryset))
+
+    def seek(self, queryset, request, view=None):
+        """
+        The rows of the requested page and the first row after it, not yet
+        fetched, so async views can read them with ``aiterator``.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse_ = self.cursor is not None and self.cursor.reverse
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse_ else self.ordering))
+        if self.cursor is not None and self.cursor.position is not None:
+            queryset = queryset.filter(self.past(json.loads(self.cursor.position), reverse_))
+        return queryset[:self.page_size + 1]
+
+    def take(self, results):
+        """
+        Keep the page out of the rows ``seek`` fetched and note where the
+        pages before and after it start.
+        """
+        reverse_ = self.cursor is not None and self.cursor.reverse
+        current_position = self.cursor.position if self.cursor is not None else None
+        self.page = list(results[:self.page_size])
+        more = len(results) > len(self.page)
+        if reverse_:
+            self.page.reverse()
+        self.has_next = current_position is not None if reverse_ else more
+        self.has_previous = more if reverse_ else current_position is not None
+        # the pages either side start past the rows at the edges of this one
+        self.next_position = self.previous_position = current_position
+        if self.page:
+            self.next_position = self._get_position_from_instance(self.page[-1], self.ordering)
+            self.previous_position = self._get_position_from_instance(self.page[0], self.ordering)
+        self.display_page_controls = self.has_previous or self.has_next
+        return self.page
+
+    def past(self, position, reverse_=False):
+        """
+        The rows after ``position`` in the ordering, or before it when
+        ``reverse_``: the row comparison written out column by column, plus a
+        range on the first column alone so the database can seek its index.
+        """
+        columns = [(order.lstrip('-'), order.startswith('-') != reverse_) for order in self.ordering]
+        equal, after = {}, Q()
+        for (column, descending), value in zip(columns, position):
+            after |= Q(**equal, **{f'{column}__{"lt" if descending else "gt"}': value})
+            equal[column] = value
+        column, descending = columns[0]
+        return Q(**{f'{column}__{"lte" if descending else "gte"}': position[0]}) & after
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is not None and cursor.position is not None:
+            try:
+                position = json.loads(cursor.position)
+            except ValueError:
+                position = None
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [instance[order.lstrip('-')] if isinstance(instance, dict) else getattr(instance, order.lstrip('-'))
+                  for order in ordering]
+        return json.dumps([value if isinstance(value, (int, float)) else str(value) for value in values])
+
+
+class CatalogCursorPagination(KeysetCursorPagination):
+    """
+    Keyset pagination for the perfume catalog.
+
+    Each page seeks past the (created_at, id) position encoded in the opaque
+    cursor instead of using OFFSET, so deep pages cost the same as the first
+    one.
+    """
+    page_size = settings.CATALOG_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CATALOG_MAX_PAGE_SIZE
+    ordering = ('-created_at', '-id')
+    search_ordering = ('search_rank', 'id')
+    rating_ordering = ('-rating_average', '-rating_count', '-id')
+
+
+class ReviewCursorPagination(KeysetCursorPagination):
+    """
+    Reviews of a perfume or offer, newest first, or best rated first with
+    ``?ordering=top``.
+    """
+    page_size = settings.REVIEW_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CATALOG_MAX_PAGE_SIZE
+    ordering = ('-created_at', '-id')
+    # top_rating is the rating with NULL as 0, keyset columns can't be NULL
+    top_ordering = ('-top_rating', '-created_at', '-id')
+
+
+class ReplyCursorPagination(KeysetCursorPagination):
+    """
+    The replies of a review, oldest first, continuing after the preview a
+    review is listed with (see ``continuation_link``).
+    """
+    page_size = settings.REVIEW_REPLIES_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CATALOG_MAX_PAGE_SIZE
+    ordering = ('created_at', 'id')
+
+    def continuation_link(self, request, review, shown):
+        """
+        Link to the replies of ``review`` following the ``shown`` ones, which
+        must be its first replies in this ordering.
+        """
+        self.base_url = request.build_absolute_uri(reverse('review-replies', args=[review.pk]))
+        position = self._get_position_from_instance(shown[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
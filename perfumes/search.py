@@ -0,0 +1,126 @@
+"""
+Full-text search over the perfume catalog.
+
+Every perfume is mirrored into an SQLite FTS5 table using the trigram tokenizer,
+so partial words ("sauv", "vanil") still match the way the old substring search
+did. The table is kept in sync from perfumes.signals and queried through the
+unmanaged PerfumeSearchEntry model, which lets the ranking stay inside SQL.
+"""
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import F, Q, Value, FloatField
+
+from perfumes.models import Perfume, PerfumeSearchEntry
+
+SEARCH_TABLE = PerfumeSearchEntry._meta.db_table
+SEARCH_COLUMNS = ['name', 'brand', 'first_note', 'heart_note', 'last_note', 'description']
+# bm25 weight of each column in SEARCH_COLUMNS, a hit in the name counts the most
+SEARCH_WEIGHTS = [10.0, 6.0, 3.0, 3.0, 3.0, 1.0]
+# the trigram tokenizer can't match anything shorter than this
+MIN_TERM_LENGTH = 3
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_index(using=DEFAULT_DB_ALIAS):
+    """
+    Create the FTS5 table if it is missing and return whether it was. The new
+    table is empty, filling it is left to rebuild_index.
+    """
+    if not is_supported(using):
+        return False
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [SEARCH_TABLE])
+        if cursor.fetchone():
+            return False
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5({', '.join(SEARCH_COLUMNS)}, tokenize='trigram')"
+        )
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', %s)",
+            [f"bm25({', '.join(str(weight) for weight in SEARCH_WEIGHTS)})"]
+        )
+    return True
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS, chunk_size=2000):
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    perfumes = Perfume.objects.using(using).select_related('brand').order_by('pk')
+    batch = []
+    for perfume in perfumes.iterator(chunk_size=chunk_size):
+        batch.append(perfume)
+        if len(batch) >= chunk_size:
+            index_perfumes(batch, using)
+            batch = []
+    if batch:
+        index_perfumes(batch, using)
+
+
+def index_perfumes(perfumes, using=DEFAULT_DB_ALIAS):
+    """
+    Insert or refresh the index rows of the given perfumes.
+    """
+    if not is_supported(using):
+        return
+    rows = [
+        [perfume.pk, perfume.name, perfume.brand.name, perfume.first_note or '', perfume.heart_note or '',
+         perfume.last_note or '', perfume.description or '']
+        for perfume in perfumes
+    ]
+    if not rows:
+        return
+    remove_perfumes([row[0] for row in rows], using)
+    placeholders = ', '.join(['%s'] * (len(SEARCH_COLUMNS) + 1))
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, {', '.join(SEARCH_COLUMNS)}) VALUES ({placeholders})",
+            rows
+        )
+
+
+def remove_perfumes(perfume_ids, using=DEFAULT_DB_ALIAS):
+    perfume_ids = list(perfume_ids)
+    if not perfume_ids or not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(perfume_ids))})",
+            perfume_ids
+        )
+
+
+def search_terms(query):
+    return [term for term in query.lower().split() if len(term) >= MIN_TERM_LENGTH]
+
+
+def build_match_expression(terms):
+    """
+    Quote every term so FTS5 operators typed by the user are taken literally.
+    """
+    return ' OR '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def search_perfumes(queryset, query):
+    """
+    Restrict a Perfume queryset to the matches of ``query`` and annotate each
+    row with ``search_rank`` (lower is more relevant).
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.filter(name__icontains=query.strip()).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    if not is_supported(queryset.db):
+        lookups = Q()
+        for term in terms:
+            lookups |= (Q(name__icontains=term) | Q(brand__name__icontains=term) |
+                        Q(description__icontains=term) | Q(first_note__icontains=term) |
+                        Q(heart_note__icontains=term) | Q(last_note__icontains=term))
+        return queryset.filter(lookups).annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.filter(
+        search_entry__document__match=build_match_expression(terms)
+    ).annotate(search_rank=F('search_entry__rank'))
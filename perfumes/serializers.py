@@ -1,8 +1,69 @@
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 
-from accounts.serializers import AccountSerializer, AccountSerializerWithToken
+from accounts.serializers import AccountSerializer, SellerSummarySerializer
+from images.serializers import ImageVariantsField
 from perfumes.models import Perfume, Review, Brand, Category, Offer, ReviewReply
+from perfumes.pagination import ReplyCursorPagination
+
+
+class DynamicFieldsMixin:
+    """
+    Lets the client shape the response: ``?fields=id,name`` keeps only the
+    listed fields and ``?expand=reviews`` adds back the fields named in
+    ``Meta.expandable_fields``, which are left out by default.
+
+    The query params are read from the ``query_params`` (or ``request``) entry
+    of the context, so only the top-level serializer of a response is shaped.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        query_params = self.context.get('query_params')
+        if query_params is None and 'request' in self.context:
+            query_params = self.context['request'].query_params
+        if query_params is None:
+            return
+        requested = self._split(query_params.get('fields'))
+        expanded = self._split(query_params.get('expand'))
+        for field_name in list(self.fields):
+            if requested and field_name not in requested:
+                self.fields.pop(field_name)
+            elif field_name in getattr(self.Meta, 'expandable_fields', []) and field_name not in expanded:
+                self.fields.pop(field_name)
+
+    @staticmethod
+    def _split(value):
+        return set(filter(None, (value or '').split(',')))
+
+    @classmethod
+    def rendered_fields(cls, query_params):
+        """
+        Names of the fields a response will contain, used by the views to skip
+        loading relations that aren't rendered.
+        """
+        return set(cls(context={'query_params': query_params}).fields)
+
+
+class RatingSummarySerializer(serializers.Serializer):
+    """
+    The stored rating summary of a perfume or offer, rendered from the
+    object itself (``source='*'``).
+    """
+    count = serializers.IntegerField(source='rating_count')
+    average = serializers.SerializerMethodField()
+    histogram = serializers.SerializerMethodField()
+
+    # the columns this replaces in the model serializers
+    COLUMNS = ['rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+               'rating_average']
+
+    def get_average(self, obj):
+        return round(obj.rating_average, 2)
+
+    def get_histogram(self, obj):
+        return obj.rating_histogram()
 
 
 class ReviewReplySerializer(serializers.ModelSerializer):
@@ -18,17 +79,38 @@ class ReviewReplySerializer(serializers.ModelSerializer):
         return ReviewReply.objects.create(user=user, **validated_data)
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = AccountSerializer(read_only=True)
-    replies = ReviewReplySerializer(many=True, read_only=True)
+    replies = ReviewReplySerializer(source='listed_replies', many=True, read_only=True)
+    replies_count = SerializerMethodField()
+    more_replies = SerializerMethodField()
 
     class Meta:
         model = Review
         fields = '__all__'
 
+    def get_replies_count(self, obj):
+        # annotated by Review.objects.for_catalog
+        count = getattr(obj, 'replies_count', None)
+        return len(obj.listed_replies()) if count is None else count
+
+    def get_more_replies(self, obj):
+        """
+        Link to the replies after the ones listed, when there are more.
+        """
+        request = self.context.get('request')
+        if request is None:
+            return None
+        shown = obj.listed_replies()
+        if not shown or self.get_replies_count(obj) <= len(shown):
+            return None
+        return ReplyCursorPagination().continuation_link(request, obj, list(shown))
+
     def create(self, validated_data):
         user = self.context['request'].user
-        return Review.objects.create(user=user, **validated_data)
+        # the rating summaries are updated by a post_save signal, keep them in the same transaction
+        with transaction.atomic():
+            return Review.objects.create(user=user, **validated_data)
 
 
 class BrandSerializer(serializers.ModelSerializer):
@@ -43,30 +125,49 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class PerfumeSerializer(serializers.ModelSerializer):
-    user = AccountSerializerWithToken(read_only=True)
+class PerfumeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    user = SellerSummarySerializer(read_only=True)
     brand = BrandSerializer()
     category = CategorySerializer()
     reviews = ReviewSerializer(many=True, read_only=True)
     price = SerializerMethodField()
+    rating = RatingSummarySerializer(source='*', read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Perfume
-        fields = '__all__'
+        exclude = RatingSummarySerializer.COLUMNS
 
     def get_price(self, obj):
         return obj.get_price_range()
 
 
-class OfferSerializer(serializers.ModelSerializer):
+class PerfumeListSerializer(PerfumeSerializer):
+    """
+    Slim representation for catalog grids; the seller, the review thread and
+    the long text fields are only included when asked for with ``?expand=``.
+    """
+
+    class Meta:
+        model = Perfume
+        fields = ['id', 'name', 'image', 'image_variants', 'brand', 'category', 'gender', 'price', 'min_price_per_ml',
+                  'max_price_per_ml', 'active_offer_count', 'rating', 'created_at', 'user', 'reviews', 'description',
+                  'type', 'first_note', 'heart_note', 'last_note']
+        expandable_fields = ['user', 'reviews', 'description', 'type', 'first_note', 'heart_note', 'last_note']
+
+
+class OfferSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     brand = serializers.PrimaryKeyRelatedField(queryset=Brand.objects.all())
     perfume = serializers.PrimaryKeyRelatedField(queryset=Perfume.objects.all())
     perfume_data = PerfumeSerializer(source='perfume', read_only=True)
+    rating = RatingSummarySerializer(source='*', read_only=True)
+    image1_variants = ImageVariantsField()
+    image2_variants = ImageVariantsField()
 
     class Meta:
         model = Offer
-        fields = ['id', 'image1', 'image2', 'description', 'quantity', 'price_per_ml', 'seller', 'perfume', 'brand',
-                  'category', 'perfume_data']
+        fields = ['id', 'image1', 'image1_variants', 'image2', 'image2_variants', 'description', 'quantity',
+                  'price_per_ml', 'seller', 'perfume', 'brand', 'category', 'rating', 'perfume_data']
         read_only_fields = ['seller', 'category']
 
     def create(self, validated_data):
@@ -76,5 +177,6 @@ class OfferSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['category'] = instance.category.id if instance.category else None
+        if 'category' in representation:
+            representation['category'] = instance.category_id
         return representation
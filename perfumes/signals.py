@@ -0,0 +1,190 @@
+from django.db import router
+from django.db.models import Q
+from django.db.models.functions import Now
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from accounts.models import Account, UserProfile
+from djangoPerfumes.cache import invalidate
+from perfumes import search
+from perfumes.models import Perfume, Brand, Offer, Review, ReviewReply, Category, Gender, RATINGS
+
+# Cache groups bumped by the catalog models, see djangoPerfumes.cache
+CACHE_GROUPS = {
+    Perfume: 'perfume',
+    Offer: 'offer',
+    Review: 'review',
+    ReviewReply: 'review',
+    Brand: 'brand',
+    Category: 'category',
+    Gender: 'gender',
+}
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    # not on a database that gets its tables some other way, like the read replica
+    if sender.name == 'perfumes' and router.allow_migrate_model(using, Perfume):
+        if search.create_index(using):
+            search.rebuild_index(using)
+
+
+@receiver(post_save, sender=Perfume)
+def index_perfume(sender, instance, using, **kwargs):
+    search.index_perfumes([instance], using)
+
+
+@receiver(post_delete, sender=Perfume)
+def unindex_perfume(sender, instance, using, **kwargs):
+    search.remove_perfumes([instance.pk], using)
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand_perfumes(sender, instance, created, using, **kwargs):
+    if not created:
+        search.index_perfumes(instance.perfume_set.using(using).select_related('brand'), using)
+
+
+@receiver(pre_save, sender=Offer)
+def remember_offer_perfume(sender, instance, using, **kwargs):
+    # an offer moved to another perfume has to refresh the summary of both
+    instance._previous_perfume_id = None
+    if instance.pk:
+        instance._previous_perfume_id = Offer.objects.using(using).filter(pk=instance.pk).values_list(
+            'perfume_id', flat=True).first()
+
+
+@receiver(post_save, sender=Offer)
+def refresh_offer_summary_on_save(sender, instance, using, **kwargs):
+    previous_perfume_id = getattr(instance, '_previous_perfume_id', None)
+    perfume_ids = {instance.perfume_id, previous_perfume_id} - {None}
+    Perfume.objects.using(using).filter(pk__in=perfume_ids).refresh_offer_summary()
+    if previous_perfume_id and previous_perfume_id != instance.perfume_id:
+        Perfume.objects.using(using).filter(pk=previous_perfume_id).update(updated_at=Now())
+
+
+@receiver(post_delete, sender=Offer)
+def refresh_offer_summary_on_delete(sender, instance, using, **kwargs):
+    Perfume.objects.using(using).filter(pk=instance.perfume_id).refresh_offer_summary()
+
+
+def apply_rating(review, using, sign):
+    if review['rating'] not in RATINGS:
+        return
+    for model, pk in ((Perfume, review['perfume_id']), (Offer, review['offer_id'])):
+        if pk:
+            # updated_at too, the summary is part of the row's representation
+            model.objects.using(using).filter(pk=pk).update(updated_at=Now(),
+                                                            **model.rating_changes(review['rating'], sign))
+
+
+def rated(review):
+    return {'rating': review.rating, 'perfume_id': review.perfume_id, 'offer_id': review.offer_id}
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, using, **kwargs):
+    # an edited review takes its old rating out of the summaries
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Review.objects.using(using).filter(pk=instance.pk).values(
+            'rating', 'perfume_id', 'offer_id').first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, using, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous == rated(instance):
+        return
+    if previous:
+        apply_rating(previous, using, -1)
+    apply_rating(rated(instance), using, 1)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, using, **kwargs):
+    apply_rating(rated(instance), using, -1)
+
+
+# A removed offer, review or reply leaves no timestamp behind, so move the
+# perfume's updated_at forward for the conditional GET validators instead.
+
+@receiver(post_delete, sender=Offer)
+@receiver(post_delete, sender=Review)
+def touch_perfume_on_delete(sender, instance, using, **kwargs):
+    Perfume.objects.using(using).filter(pk=instance.perfume_id).update(updated_at=Now())
+
+
+@receiver(post_delete, sender=Review)
+def touch_offer_on_review_delete(sender, instance, using, **kwargs):
+    if instance.offer_id:
+        Offer.objects.using(using).filter(pk=instance.offer_id).update(updated_at=Now())
+
+
+@receiver(post_delete, sender=ReviewReply)
+def touch_perfume_on_reply_delete(sender, instance, using, **kwargs):
+    Perfume.objects.using(using).filter(reviews=instance.review_id).update(updated_at=Now())
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def touch_perfumes_on_rename(sender, instance, created, using, **kwargs):
+    if not created:
+        field = 'brand' if sender is Brand else 'category'
+        Perfume.objects.using(using).filter(**{field: instance.pk}).update(updated_at=Now())
+
+
+# The account fields catalog responses embed, in the perfume's seller summary
+# and with the author of every review and reply.
+EMBEDDED_ACCOUNT_FIELDS = {
+    Account: ['email', 'first_name', 'last_name', 'phone_number', 'is_confirmed'],
+    UserProfile: ['address_line', 'city', 'could_sell', 'profile_picture', 'profile_picture_variants'],
+}
+
+
+@receiver(pre_save, sender=Account)
+@receiver(pre_save, sender=UserProfile)
+def remember_embedded_account(sender, instance, using, **kwargs):
+    # every login saves the account and its profile, only real edits touch the catalog and its cache
+    instance._embedded = None
+    if instance.pk:
+        instance._embedded = sender.objects.using(using).filter(pk=instance.pk).values(
+            *EMBEDDED_ACCOUNT_FIELDS[sender]).first()
+
+
+def embedded_account_changed(instance):
+    previous = getattr(instance, '_embedded', None)
+    return bool(previous) and not all(getattr(instance, field) == value for field, value in previous.items())
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=UserProfile)
+def invalidate_seller_cache(sender, instance, using, **kwargs):
+    if embedded_account_changed(instance):
+        invalidate('seller', using=using)
+
+
+@receiver(post_delete, sender=Account)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_seller_cache_on_delete(sender, using, **kwargs):
+    invalidate('seller', using=using)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=UserProfile)
+def touch_perfumes_on_account_edit(sender, instance, using, **kwargs):
+    if not embedded_account_changed(instance):
+        return
+    account_id = instance.pk if sender is Account else instance.user_id
+    Perfume.objects.using(using).filter(
+        Q(user=account_id) | Q(reviews__user=account_id) | Q(reviews__replies__user=account_id)
+    ).update(updated_at=Now())
+
+
+def invalidate_catalog_cache(sender, using, **kwargs):
+    invalidate(CACHE_GROUPS[sender], using=using)
+
+
+for model in CACHE_GROUPS:
+    post_save.connect(invalidate_catalog_cache, sender=model)
+    post_delete.connect(invalidate_catalog_cache, sender=model)
@@ -1,3 +1,811 @@
-from django.test import TestCase
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import Account
+from djangoPerfumes import routers
+from djangoPerfumes.cache import get_versions, invalidate, replica_may_be_behind
+from djangoPerfumes.middleware import ReplicaPinMiddleware, route_stats
+from orders.models import Order, OrderItem
+from perfumes import search
+from perfumes.models import Brand, Category, Gender, Perfume, Offer, Review, ReviewReply
+from perfumes.signals import create_search_index
+
+
+class BenchmarkCommandTests(TestCase):
+    def benchmark(self, **seed_options):
+        call_command('seed_catalog', accounts=5, orders=5, posts=3, stdout=StringIO(), **seed_options)
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as report:
+            call_command('benchmark_api', repeat=1, output=report.name)
+            return {result['route']: result for result in json.load(report)['results']}
+
+    def test_catalog_query_counts_do_not_grow_with_the_dataset(self):
+        small = self.benchmark(perfumes=5, seed=1)
+        large = self.benchmark(perfumes=40, seed=2)
+
+        for route in ['api/perfumes/', 'api/perfumes/<int:pk>/', 'api/perfumes/filtered-products/',
+                      'api/perfumes/offers/<int:perfume_id>/', 'api/perfumes/reviews/<int:perfume_id>/',
+                      'api/perfumes/facets/', 'api/blog/']:
+            self.assertEqual(large[route]['status'], 200, route)
+            self.assertEqual(large[route]['queries'], small[route]['queries'], route)
+
+    def test_no_endpoint_errors(self):
+        results = self.benchmark(perfumes=5)
+
+        self.assertFalse([route for route, result in results.items() if result['status'] >= 500])
+
+
+class ReviewThreadTests(TestCase):
+    def setUp(self):
+        self.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        brand = Brand.objects.create(name='Brand')
+        category = Category.objects.create(name='Fresh')
+        gender = Gender.objects.create(name='Unisex')
+        self.perfume = Perfume.objects.create(user=self.user, name='Perfume', category=category, gender=gender,
+                                              brand=brand)
+
+    def review(self, rating, replies=0):
+        review = Review.objects.create(perfume=self.perfume, user=self.user, rating=rating, comment='Nice')
+        ReviewReply.objects.bulk_create(ReviewReply(review=review, user=self.user, comment=str(i))
+                                        for i in range(replies))
+        return review
+
+    def test_reviews_are_paged_with_a_preview_of_their_replies(self):
+        for rating in [3, 5, 4]:
+            self.review(rating, replies=7)
+        url = f'/api/perfumes/reviews/{self.perfume.pk}/'
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual([review['rating'] for review in response.data['results']], [4, 5])
+        self.assertEqual(len(response.data['results'][0]['replies']), settings.REVIEW_REPLIES_PREVIEW)
+        self.assertEqual(response.data['results'][0]['replies_count'], 7)
+
+        response = self.client.get(url, {'ordering': 'top'})
+        self.assertEqual([review['rating'] for review in response.data['results']], [5, 4, 3])
+
+    def test_reply_counts_alone_take_no_query_per_review(self):
+        for replies in [0, 2, 7]:
+            self.review(5, replies=replies)
+        url = f'/api/perfumes/reviews/{self.perfume.pk}/'
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'fields': 'id,replies_count'})
+        self.assertEqual([review['replies_count'] for review in response.data['results']], [7, 2, 0])
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'fields': 'id,more_replies'})
+        self.assertEqual([bool(review['more_replies']) for review in response.data['results']], [True, False, False])
+
+    def test_more_replies_continues_after_the_preview(self):
+        review = self.review(5, replies=7)
+        # replies written in the same instant share their cursor position
+        ReviewReply.objects.update(created_at=review.created_at)
+
+        response = self.client.get(f'/api/perfumes/reviews/{self.perfume.pk}/')
+        [listed] = response.data['results']
+        comments = [reply['comment'] for reply in listed['replies']]
+        url = listed['more_replies'] + '&page_size=2'
+        while url:
+            response = self.client.get(url)
+            comments += [reply['comment'] for reply in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(sorted(comments), [str(i) for i in range(7)])
+
+        ReviewReply.objects.filter(review=review).exclude(comment__in=['0', '1']).delete()
+        response = self.client.get(f'/api/perfumes/reviews/{self.perfume.pk}/')
+        self.assertIsNone(response.data['results'][0]['more_replies'])
+
+
+class RequestStatsTests(TestCase):
+    def setUp(self):
+        route_stats.clear()
+        self.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        Perfume.objects.create(user=self.user, name='Sauvage', brand=Brand.objects.create(name='Dior'),
+                               category=Category.objects.create(name='Fresh'),
+                               gender=Gender.objects.create(name='Male'))
+
+    @staticmethod
+    def server_timing(response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing_reports_queries_and_rendering(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/perfumes/')
+        metrics = self.server_timing(response)
+        self.assertEqual(metrics['db']['desc'], f'"{len(queries)} queries"')
+        # cache_response renders the response inside the view
+        self.assertGreater(float(metrics['render']['dur']), 0)
+        self.assertEqual(set(metrics), {'db', 'dup', 'app', 'render', 'total'})
+
+        response = self.client.get('/api/perfumes/')
+        self.assertEqual(float(self.server_timing(response)['render']['dur']), 0)
+
+    def test_stats_are_for_admins(self):
+        self.client.get('/api/perfumes/')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/stats/requests/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        stats = client.get('/api/stats/requests/').data
+        self.assertEqual(stats['GET /api/perfumes/']['requests'], 1)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        self.dior, self.chanel = Brand.objects.create(name='Dior'), Brand.objects.create(name='Chanel')
+        self.fresh, self.woody = Category.objects.create(name='Fresh'), Category.objects.create(name='Woody')
+        male = Gender.objects.create(name='Male')
+        for name, brand, category in [('Sauvage', self.dior, self.fresh), ('Fahrenheit', self.dior, self.woody),
+                                      ('Bleu', self.chanel, self.woody)]:
+            Perfume.objects.create(user=user, name=name, brand=brand, category=category, gender=male)
+
+    def facets(self, **params):
+        response = self.client.get('/api/perfumes/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    @staticmethod
+    def counts(facet):
+        return {value['name']: (value['count'], value['selected']) for value in facet}
+
+    def test_a_facet_ignores_its_own_selection(self):
+        facets = self.facets(selectedBrands=str(self.dior.pk), selectedCategories=str(self.woody.pk))
+        self.assertEqual(facets['total'], 1)
+        # the other brands still count under the selected category
+        self.assertEqual(self.counts(facets['brands']), {'Chanel': (1, False), 'Dior': (1, True)})
+        self.assertEqual(self.counts(facets['categories']), {'Fresh': (1, False), 'Woody': (1, True)})
+
+        facets = self.facets(selectedBrands=f'{self.dior.pk},{self.chanel.pk}')
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(self.counts(facets['categories']), {'Fresh': (1, False), 'Woody': (2, False)})
+
+    def test_malformed_ids_are_ignored(self):
+        facets = self.facets(selectedCategories=f'abc,{self.fresh.pk}', selectedGender='x')
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(self.facets(selectedBrands='abc')['total'], 3)
+        response = self.client.get('/api/perfumes/filtered-products/', {'selectedBrands': 'abc'})
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        self.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        brand = Brand.objects.create(name='Dior')
+        self.perfume = Perfume.objects.create(user=self.user, name='Sauvage', brand=brand,
+                                              category=Category.objects.create(name='Fresh'),
+                                              gender=Gender.objects.create(name='Male'))
+        self.offer = Offer.objects.create(seller=self.user, brand=brand, perfume=self.perfume, description='Full',
+                                          quantity=5, price_per_ml='12.50')
+
+    def summary(self, row):
+        row.refresh_from_db()
+        return row.rating_count, row.rating_sum, row.rating_average, row.rating_histogram()
+
+    def test_reviews_keep_the_summary_current(self):
+        first = Review.objects.create(perfume=self.perfume, user=self.user, rating=5)
+        Review.objects.create(perfume=self.perfume, user=self.user, rating=2)
+        self.assertEqual(self.summary(self.perfume), (2, 7, 3.5, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}))
+
+        first.rating = 4
+        first.save()
+        self.assertEqual(self.summary(self.perfume), (2, 6, 3.0, {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}))
+
+        first.delete()
+        self.assertEqual(self.summary(self.perfume), (1, 2, 2.0, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0}))
+
+        review = Review.objects.create(offer=self.offer, user=self.user, rating=1)
+        self.assertEqual(self.summary(self.offer)[:3], (1, 1, 1.0))
+        review.delete()
+        self.assertEqual(self.summary(self.offer)[:3], (0, 0, 0.0))
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_offer_validators_see_its_reviews(self):
+        url = f'/api/perfumes/offer-detail/{self.offer.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        review = Review.objects.create(offer=self.offer, user=self.user, rating=1)
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['rating']['count'], response.data['rating']['average']), (1, 1.0))
+
+        review.delete()
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rating']['count'], 0)
+
+    def test_perfume_validators_see_its_reviews(self):
+        url = f'/api/perfumes/{self.perfume.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        review = Review.objects.create(perfume=self.perfume, user=self.user, rating=3)
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rating']['count'], 1)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        review.delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+    def test_rating_order_seeks_past_ties(self):
+        for index in range(5):
+            Perfume.objects.create(user=self.user, name=f'Unrated {index}', brand=self.perfume.brand,
+                                   category=self.perfume.category, gender=self.perfume.gender)
+        Review.objects.create(perfume=self.perfume, user=self.user, rating=4)
+        names, response = [], self.client.get('/api/perfumes/', {'ordering': 'rating', 'page_size': 2})
+        while True:
+            names += [perfume['name'] for perfume in response.json()['results']]
+            if not response.json()['next']:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.json()['next'])
+            self.assertFalse([query['sql'] for query in queries if 'OFFSET' in query['sql']])
+        self.assertEqual(names, ['Sauvage'] + [f'Unrated {index}' for index in reversed(range(5))])
+
+    def test_min_rating(self):
+        Review.objects.create(perfume=self.perfume, user=self.user, rating=4)
+        Perfume.objects.create(user=self.user, name='Unrated', brand=self.perfume.brand,
+                               category=self.perfume.category, gender=self.perfume.gender)
+        for min_rating, count in [('4', 1), ('4.5', 0), ('nan', 2), ('inf', 2), ('abc', 2)]:
+            response = self.client.get('/api/perfumes/', {'min_rating': min_rating})
+            self.assertEqual(len(response.json()['results']), count, min_rating)
+
+class CatalogTransferTests(TestCase):
+    def setUp(self):
+        self.admin = Account.objects.create_superuser('Ann', 'Lee', 'admin@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.feed = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        self.addCleanup(os.remove, self.feed.name)
+
+    def import_feed(self, kind, lines, **options):
+        with open(self.feed.name, 'w') as feed:
+            feed.write('\n'.join(lines) + '\n')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', kind, self.feed.name, user='admin@example.com', batch_size=2, stdout=stdout,
+                     stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_import_creates_then_updates_in_batches(self):
+        output, errors = self.import_feed('perfumes', [
+            'name,brand,category,gender,price,first_note',
+            'Sauvage,Dior,Fresh,Male,99.50,bergamot',
+            'Bleu,Chanel,Woody,Male,,citrus',
+            'Nameless,Dior,Fresh,Male,,',
+            'J\'adore,Dior,Floral,Female,abc,',
+            ',Dior,Fresh,Male,,',
+        ])
+        self.assertIn('Created 3 and updated 0 perfumes, 0 were unchanged, skipped 2 invalid rows.', output)
+        self.assertIn('line 5: price:', errors)
+        self.assertEqual(set(Brand.objects.values_list('name', flat=True)), {'Dior', 'Chanel'})
+        self.assertEqual(str(Perfume.objects.get(name='Sauvage').price), '99.50')
+        self.assertEqual(Perfume.objects.get(name='Bleu').user, self.admin)
+        self.assertEqual(self.client.get('/api/perfumes/', {'perfume_name': 'sauv'}).data['results'][0]['name'],
+                         'Sauvage')
+
+        output, _ = self.import_feed('perfumes', [
+            'name,brand,category,gender,first_note',
+            'Sauvage,Dior,Fresh,Male,pepper',
+            'Bleu,Chanel,Woody,Male,citrus',
+        ])
+        self.assertIn('Created 0 and updated 1 perfumes, 1 were unchanged', output)
+        perfume = Perfume.objects.get(name='Sauvage')
+        self.assertEqual((perfume.first_note, str(perfume.price)), ('pepper', '99.50'))
+
+    def test_ndjson_offers_refresh_the_perfume_summary(self):
+        self.import_feed('perfumes', ['name,brand,category,gender', 'Sauvage,Dior,Fresh,Male'])
+        perfume = Perfume.objects.get()
+
+        with open(self.feed.name, 'w') as feed:
+            feed.write(json.dumps({'perfume': perfume.pk, 'description': 'Full', 'quantity': 3,
+                                   'price_per_ml': 12.5}) + '\n')
+            feed.write(json.dumps({'perfume_name': 'Sauvage', 'brand': 'Dior', 'description': 'Tester',
+                                   'price_per_ml': '8'}) + '\n')
+            feed.write(json.dumps({'perfume_name': 'Missing', 'brand': 'Dior', 'description': 'x',
+                                   'price_per_ml': '8'}) + '\n')
+            feed.write('[1, 2]\n')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', 'offers', self.feed.name, format='ndjson', user='admin@example.com',
+                     stdout=stdout, stderr=stderr)
+
+        self.assertIn('Created 2 and updated 0 offers, 0 were unchanged, skipped 2 invalid rows.', stdout.getvalue())
+        perfume.refresh_from_db()
+        # the tester has no stock, so it isn't an active offer
+        self.assertEqual((str(perfume.min_price_per_ml), str(perfume.max_price_per_ml), perfume.active_offer_count),
+                         ('8.00', '12.50', 1))
+        self.assertEqual(set(Offer.objects.values_list('category_id', flat=True)), {perfume.category_id})
+
+    def test_streaming_export_round_trips_through_the_importer(self):
+        self.import_feed('perfumes', [
+            'name,brand,category,gender', 'Sauvage,Dior,Fresh,Male', 'Bleu,Chanel,Woody,Male',
+        ])
+
+        response = self.client.get('/api/perfumes/export/perfumes.ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['name'], row['brand'], row['user']) for row in rows],
+                         [('Sauvage', 'Dior', 'admin@example.com'), ('Bleu', 'Chanel', 'admin@example.com')])
+
+        response = self.client.get('/api/perfumes/export/perfumes.csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        lines[1] = lines[1].replace('Sauvage', 'Sauvage Elixir')
+        upload = SimpleUploadedFile('feed.csv', '\n'.join(lines).encode())
+        response = self.client.post('/api/perfumes/import/perfumes/', {'file': upload})
+        self.assertEqual((response.data['updated'], response.data['unchanged']), (1, 1))
+        self.assertEqual(sorted(Perfume.objects.values_list('name', flat=True)), ['Bleu', 'Sauvage Elixir'])
+        results = self.client.get('/api/perfumes/', {'perfume_name': 'elixir'}).data['results']
+        self.assertEqual([row['name'] for row in results], ['Sauvage Elixir'])
+
+        self.client.force_authenticate(Account.objects.create_user('Bob', 'Lee', 'bob@example.com', 'pw'))
+        self.assertEqual(self.client.get('/api/perfumes/export/perfumes.csv').status_code, 403)
+
+
+# tables that grow with the marketplace, a view may not read any of them in full
+LARGE_TABLES = {model._meta.db_table for model in (Perfume, Offer, Review, ReviewReply, Order, OrderItem)}
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query of the hot views and fails when
+    one SCANs one of LARGE_TABLES. Walking an index in order (SCAN ... USING
+    INDEX) is how keyset pages are read and stops at the page size, so that is
+    allowed unless the rows are sorted afterwards anyway.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        brand = Brand.objects.create(name='Dior')
+        category = Category.objects.create(name='Fresh')
+        gender = Gender.objects.create(name='Male')
+        cls.perfume = Perfume.objects.create(user=cls.user, name='Sauvage', category=category, gender=gender,
+                                             brand=brand)
+        cls.offer = Offer.objects.create(seller=cls.user, brand=brand, category=category, perfume=cls.perfume,
+                                         description='Full', quantity=5, price_per_ml='12.50')
+        cls.review = Review.objects.create(perfume=cls.perfume, user=cls.user, rating=5, comment='Nice')
+        Review.objects.create(offer=cls.offer, user=cls.user, rating=4, comment='Fast')
+        ReviewReply.objects.create(review=cls.review, user=cls.user, comment='Thanks')
+        cls.ids = {'category': category.pk, 'brand': brand.pk, 'gender': gender.pk}
+
+    def assertNoFullScans(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, url)
+        scans = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            # subqueries name their tables U0, U1...
+            tables = {alias: table for table, alias in re.findall(r'"(\w+)" (U\d+)', sql)}
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            sorted_afterwards = 'USE TEMP B-TREE FOR ORDER BY' in plan
+            for detail in plan:
+                words = detail.split()
+                if words[0] == 'SCAN' and tables.get(words[1], words[1]) in LARGE_TABLES and (
+                        'USING' not in words or sorted_afterwards):
+                    scans.append(f'{detail}: {sql}')
+        self.assertFalse(scans, f'{url} {params} reads a table in full:\n' + '\n'.join(scans))
+
+    def test_catalog(self):
+        self.assertNoFullScans('/api/perfumes/')
+        self.assertNoFullScans('/api/perfumes/', ordering='rating')
+        self.assertNoFullScans('/api/perfumes/', category_id=self.ids['category'], brand_id=self.ids['brand'],
+                               gender_id=self.ids['gender'])
+        self.assertNoFullScans('/api/perfumes/', perfume_name='sauv')
+        self.assertNoFullScans('/api/perfumes/filtered-products/', selectedCategories=self.ids['category'],
+                               selectedBrands=self.ids['brand'], selectedGender=self.ids['gender'])
+        self.assertNoFullScans('/api/perfumes/facets/', selectedCategories=self.ids['category'])
+        self.assertNoFullScans(f'/api/perfumes/{self.perfume.pk}/')
+
+    def test_deep_catalog_pages(self):
+        Perfume.objects.create(user=self.user, name='Bleu', category_id=self.ids['category'],
+                               gender_id=self.ids['gender'], brand_id=self.ids['brand'])
+        for params in [{}, {'ordering': 'rating'}]:
+            response = self.client.get('/api/perfumes/', {'page_size': 1, **params})
+            self.assertNoFullScans(response.json()['next'])
+
+    def test_offers_and_reviews(self):
+        self.assertNoFullScans(f'/api/perfumes/offers/{self.perfume.pk}/')
+        self.assertNoFullScans(f'/api/perfumes/offers/{self.perfume.pk}/', ordering='rating')
+        self.assertNoFullScans(f'/api/perfumes/offer-detail/{self.offer.pk}/')
+        self.assertNoFullScans(f'/api/perfumes/reviews/{self.perfume.pk}/')
+        self.assertNoFullScans(f'/api/perfumes/reviews/{self.perfume.pk}/', ordering='top')
+        self.assertNoFullScans(f'/api/perfumes/reviews/{self.perfume.pk}/', offerId=self.offer.pk)
+        self.assertNoFullScans(f'/api/perfumes/reviews/{self.review.pk}/replies/')
+
+    def test_seller_offers_and_order_history(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.assertNoFullScans('/api/perfumes/offers/', **{'offer-user': '1'})
+        self.assertNoFullScans('/api/orders/')
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(TransactionTestCase):
+    # reads inside a transaction go to default, so these tests can't run in one
+    def test_only_catalog_reads_of_a_request_go_to_the_replica(self):
+        self.assertEqual(Perfume.objects.all().db, 'default')
+
+        token = routers.begin_request()
+        try:
+            self.assertEqual(Perfume.objects.all().db, 'replica')
+            self.assertEqual(Account.objects.all().db, 'default')
+            with transaction.atomic():
+                self.assertEqual(Perfume.objects.all().db, 'default')
+
+            Brand.objects.create(name='Dior')
+            self.assertEqual(Perfume.objects.all().db, 'default')
+        finally:
+            self.assertTrue(routers.end_request(token))
+
+    def test_responses_read_from_a_lagging_replica_are_not_cached(self):
+        invalidate('offer')
+        token = routers.begin_request()
+        try:
+            self.assertTrue(replica_may_be_behind(['perfume', 'offer']))
+            self.assertFalse(replica_may_be_behind(['blog']))
+        finally:
+            routers.end_request(token)
+        self.assertFalse(replica_may_be_behind(['perfume', 'offer']))
+
+    def test_a_write_pins_the_client_to_default(self):
+        def view(request):
+            reads_from = Perfume.objects.all().db
+            if request.method == 'POST':
+                Brand.objects.create(name='Dior')
+            return HttpResponse(reads_from)
+
+        middleware = ReplicaPinMiddleware(view)
+        factory = RequestFactory()
+
+        response = middleware(factory.get('/'))
+        self.assertEqual(response.content, b'replica')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+        response = middleware(factory.post('/'))
+        self.assertEqual(response.cookies[settings.REPLICA_PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        factory.cookies[settings.REPLICA_PIN_COOKIE] = '1'
+        response = middleware(factory.get('/'))
+        self.assertEqual(response.content, b'default')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the replica is a copy made with the SQLite backup API')
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    A second SQLite file as the replica: a snapshot of the test database that
+    misses everything written after it was taken, like a lagging replica.
+    """
+
+    def setUp(self):
+        self.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        self.perfume = Perfume.objects.create(user=self.user, name='Sauvage', brand=Brand.objects.create(name='Dior'),
+                                              category=Category.objects.create(name='Fresh'),
+                                              gender=Gender.objects.create(name='Male'))
+
+        replica = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        replica.close()
+        self.addCleanup(os.remove, replica.name)
+        connection.ensure_connection()
+        with sqlite3.connect(replica.name) as target:
+            connection.connection.backup(target)
+        connections.settings['replica'] = {**connection.settings_dict, 'NAME': replica.name}
+        self.addCleanup(connections.settings.pop, 'replica')
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.addCleanup(lambda: connections['replica'].close())
+
+        Perfume.objects.create(user=self.user, name='Bleu', brand=self.perfume.brand, category=self.perfume.category,
+                               gender=self.perfume.gender)
+
+    def get_names(self, client, **params):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = client.get('/api/perfumes/', {'fields': 'name', **params})
+        return [perfume['name'] for perfume in response.json()['results']], len(replica_queries)
+
+    def test_reads_come_from_the_replica_until_the_client_writes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        names, replica_queries = self.get_names(client)
+        self.assertEqual(names, ['Sauvage'])
+        self.assertGreater(replica_queries, 0)
+
+        response = client.post(f'/api/perfumes/reviews/{self.perfume.pk}/', {'rating': 5, 'comment': 'Nice'},
+                               format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+        names, replica_queries = self.get_names(client)
+        self.assertEqual(names, ['Bleu', 'Sauvage'])
+        self.assertEqual(replica_queries, 0)
+
+        # another client isn't pinned, past the response cached from default
+        self.assertEqual(self.get_names(APIClient(), page_size=5), (['Sauvage'], 1))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        fresh, male = Category.objects.create(name='Fresh'), Gender.objects.create(name='Male')
+        for name, brand, note in [('Sauvage', 'Dior', 'Bergamot'), ('Bleu', 'Chanel', 'Grapefruit'),
+                                  ('Fahrenheit', 'Dior', 'Violet leaf')]:
+            brand, _ = Brand.objects.get_or_create(name=brand)
+            Perfume.objects.create(user=user, name=name, brand=brand, category=fresh, gender=male, first_note=note)
+
+    def search(self, query):
+        response = self.client.get('/api/perfumes/', {'perfume_name': query})
+        self.assertEqual(response.status_code, 200)
+        return sorted(perfume['name'] for perfume in response.json()['results'])
+
+    def test_search_matches_names_brands_and_notes(self):
+        self.assertEqual(self.search('sauv'), ['Sauvage'])
+        self.assertEqual(self.search('chanel'), ['Bleu'])
+        self.assertEqual(self.search('bergam'), ['Sauvage'])
+        self.assertEqual(self.search('xyzq'), [])
+
+    def test_short_queries_fall_back_to_the_name(self):
+        self.assertEqual(self.search('Bl'), ['Bleu'])
+        self.assertEqual(self.search('ah'), ['Fahrenheit'])
+
+    def test_operators_are_searched_literally(self):
+        self.assertEqual(self.search('sauv" OR *'), [])
+        # too short to match anything, 'OR' is dropped rather than read as an operator
+        self.assertEqual(self.search('sauv OR'), ['Sauvage'])
+
+    def test_the_command_builds_a_new_index_once(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {search.SEARCH_TABLE}')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('rebuild_search_index', stdout=StringIO())
+        rebuilds = [query for query in queries if query['sql'] == f'DELETE FROM {search.SEARCH_TABLE}']
+        self.assertEqual(len(rebuilds), 1)
+        self.assertEqual(self.search('sauv'), ['Sauvage'])
+
+    @override_settings(REPLICA_DATABASE='replica')
+    def test_migrate_leaves_the_replica_alone(self):
+        # there is no 'replica' connection here, touching it would raise
+        create_search_index(apps.get_app_config('perfumes'), using='replica')
+
+    def test_the_index_follows_renames_and_deletes(self):
+        perfume = Perfume.objects.get(name='Bleu')
+        perfume.name = 'Allure'
+        perfume.save()
+        self.assertEqual(self.search('bleu'), [])
+        self.assertEqual(self.search('allure'), ['Allure'])
+        perfume.delete()
+        self.assertEqual(self.search('allure'), [])
+
+
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        brand, fresh = Brand.objects.create(name='Dior'), Category.objects.create(name='Fresh')
+        male = Gender.objects.create(name='Male')
+        for index in range(7):
+            perfume = Perfume.objects.create(user=user, name=f'Perfume {index}', brand=brand, category=fresh,
+                                             gender=male)
+            Offer.objects.create(seller=user, brand=brand, perfume=perfume, description='Full', quantity=5,
+                                 price_per_ml='12.50')
+        # rows sharing a created_at are told apart by id
+        first = Perfume.objects.order_by('id').first()
+        Perfume.objects.filter(id__lte=first.id + 2).update(created_at=first.created_at)
+
+    def walk(self, url, link='next', **params):
+        names, response = [], self.client.get(url, {'page_size': 2, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            names += [perfume['name'] for perfume in page['results']]
+            if not page[link]:
+                return names, page
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(page[link])
+            # every page seeks past the cursor's position, none skips rows
+            self.assertFalse([query['sql'] for query in queries if 'OFFSET' in query['sql']])
+
+    def test_pages_walk_the_catalog_newest_first(self):
+        newest_first = list(Perfume.objects.order_by('-created_at', '-id').values_list('name', flat=True))
+        self.assertEqual(self.walk('/api/perfumes/')[0], newest_first)
+        self.assertEqual(self.walk('/api/perfumes/filtered-products/')[0], newest_first)
+
+    def test_deep_pages_of_tied_rows_seek(self):
+        Perfume.objects.update(created_at=Perfume.objects.earliest('id').created_at)
+        names, last_page = self.walk('/api/perfumes/')
+        self.assertEqual(names, [f'Perfume {index}' for index in reversed(range(7))])
+        # and back again from the last page
+        response = self.client.get(last_page['previous'])
+        self.assertEqual([perfume['name'] for perfume in response.json()['results']], ['Perfume 2', 'Perfume 1'])
+        # search results all rank alike for these names
+        names, _ = self.walk('/api/perfumes/', perfume_name='perfume')
+        self.assertEqual(sorted(names), sorted(f'Perfume {index}' for index in range(7)))
+
+    def test_list_queries_dont_grow_with_the_page(self):
+        for url in ['/api/perfumes/', '/api/perfumes/filtered-products/']:
+            with CaptureQueriesContext(connection) as small:
+                self.client.get(url, {'page_size': 1})
+            with CaptureQueriesContext(connection) as large:
+                self.client.get(url, {'page_size': 7})
+            self.assertTrue(small.captured_queries)
+            self.assertEqual(len(small), len(large), url)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        self.brand = Brand.objects.create(name='Dior')
+        self.perfume = Perfume.objects.create(user=self.user, name='Sauvage', brand=self.brand,
+                                              category=Category.objects.create(name='Fresh'),
+                                              gender=Gender.objects.create(name='Male'))
+        self.url = f'/api/perfumes/{self.perfume.pk}/'
+
+    def test_unchanged_details_answer_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        revalidated = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/api/perfumes/0/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+    def test_the_etag_depends_on_the_fields_asked_for(self):
+        full = self.client.get(self.url)
+        names = self.client.get(self.url, {'fields': 'id,name'})
+        self.assertNotEqual(full['ETag'], names['ETag'])
+        response = self.client.get(self.url, {'fields': 'id,name'}, HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_a_new_offer_changes_the_perfume(self):
+        response = self.client.get(self.url)
+        Offer.objects.create(seller=self.user, brand=self.brand, perfume=self.perfume, description='Full',
+                             quantity=5, price_per_ml='12.50')
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 200)
+        self.assertNotEqual(revalidated['ETag'], response['ETag'])
+
+    def test_edits_of_embedded_rows_change_the_perfume(self):
+        reviewer = Account.objects.create_user('Bob', 'Ray', 'bob@example.com', 'pw')
+        review = Review.objects.create(perfume=self.perfume, user=reviewer, rating=4, comment='Nice')
+        offer = Offer.objects.create(seller=self.user, brand=self.brand, perfume=self.perfume, description='Full',
+                                     quantity=5, price_per_ml='12.50')
+        offer_url = f'/api/perfumes/offer-detail/{offer.pk}/'
+
+        def edits(edit, url=self.url):
+            etag = self.client.get(url)['ETag']
+            edit()
+            return self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+        def rename_brand():
+            self.brand.name = 'Christian Dior'
+            self.brand.save()
+
+        def move_seller():
+            self.user.userprofile.city = 'Lviv'
+            self.user.userprofile.save()
+
+        def rename_reviewer():
+            reviewer.first_name = 'Robert'
+            reviewer.save()
+
+        def edit_review():
+            review.comment = 'Lovely'
+            review.save()
+
+        self.assertTrue(edits(rename_brand))
+        self.assertTrue(edits(rename_brand, offer_url))
+        self.assertTrue(edits(move_seller))
+        self.assertTrue(edits(rename_reviewer))
+        self.assertTrue(edits(edit_review))
+        # logging in saves the account and its profile but changes nothing shown
+        self.assertFalse(edits(lambda: self.assertTrue(self.client.login(email='bob@example.com', password='pw'))))
+
+    def test_cached_perfumes_show_profile_edits(self):
+        self.assertEqual(self.client.get(self.url).json()['user']['city'], '')
+        versions = get_versions(['seller'])
+        self.assertTrue(self.client.login(email='ann@example.com', password='pw'))
+        self.assertEqual(get_versions(['seller']), versions)
+
+        profile = Account.objects.get(pk=self.user.pk).userprofile
+        profile.city = 'Lviv'
+        profile.save()
+        self.assertEqual(self.client.get(self.url).json()['user']['city'], 'Lviv')
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        user = Account.objects.create_user('Ann', 'Lee', 'ann@example.com', 'pw')
+        brand, fresh = Brand.objects.create(name='Dior'), Category.objects.create(name='Fresh')
+        male = Gender.objects.create(name='Male')
+        for index in range(3):
+            Perfume.objects.create(user=user, name=f'Perfume {index}', brand=brand, category=fresh, gender=male)
+        self.perfume = Perfume.objects.latest('id')
+        self.offer = Offer.objects.create(seller=user, brand=brand, perfume=self.perfume, description='Full',
+                                          quantity=5, price_per_ml='12.50')
+        for rating in [5, 3, 4]:
+            Review.objects.create(perfume=self.perfume, user=user, rating=rating, comment='Lovely')
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, url)
+        return response.json()
+
+    def assertSameAsSync(self, path, **params):
+        response = self.get(f'/api/perfumes/async/{path}', **params)
+        if isinstance(response, dict) and 'results' in response:
+            # the links only differ in the path they point at
+            for link in ['next', 'previous']:
+                if response[link]:
+                    response[link] = response[link].replace('/api/perfumes/async/', '/api/perfumes/')
+        self.assertEqual(response, self.get(f'/api/perfumes/{path}', **params), f'{path} {params}')
+        return response
+
+    def test_async_views_render_what_the_sync_ones_do(self):
+        self.assertSameAsSync('')
+        self.assertSameAsSync(f'{self.perfume.pk}/')
+        self.assertSameAsSync(f'offers/{self.perfume.pk}/')
+        self.assertSameAsSync(f'reviews/{self.perfume.pk}/')
+
+    def test_async_views_take_the_sync_parameters(self):
+        self.assertEqual(self.assertSameAsSync('', perfume_name='nothing')['results'], [])
+        self.assertEqual(len(self.assertSameAsSync('', perfume_name='perf')['results']), 3)
+        self.assertSameAsSync('', perfume_name='Pe')
+        [rated] = self.assertSameAsSync('', min_rating='4')['results']
+        self.assertEqual(rated['name'], self.perfume.name)
+        self.assertEqual(self.assertSameAsSync('', ordering='rating')['results'][0]['name'], self.perfume.name)
+        self.assertSameAsSync('', ordering='rating', page_size=2)
+        self.assertSameAsSync('', fields='id,name', page_size=1)
+        self.assertSameAsSync(f'offers/{self.perfume.pk}/', ordering='rating')
+        top = self.assertSameAsSync(f'reviews/{self.perfume.pk}/', ordering='top')['results']
+        self.assertEqual([review['rating'] for review in top], [5, 4, 3])
+        self.assertSameAsSync(f'reviews/{self.perfume.pk}/', ordering='top', page_size=2)
+
+    def test_async_lists_page_with_a_cursor(self):
+        names, page = [], self.get('/api/perfumes/async/', page_size=2)
+        names += [perfume['name'] for perfume in page['results']]
+        self.assertIsNone(page['previous'])
+        page = self.client.get(page['next']).json()
+        names += [perfume['name'] for perfume in page['results']]
+        self.assertIsNone(page['next'])
+        self.assertEqual(names, ['Perfume 2', 'Perfume 1', 'Perfume 0'])
+        page = self.client.get(page['previous']).json()
+        self.assertEqual([perfume['name'] for perfume in page['results']], ['Perfume 2', 'Perfume 1'])
+
+    def test_async_views_reject_bad_requests(self):
+        for url in ['/api/perfumes/', '/api/perfumes/async/']:
+            self.assertEqual(self.client.get(url, {'cursor': 'nope'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/perfumes/async/0/').status_code, 404)
+        self.assertEqual(self.client.get('/api/perfumes/async/offers/0/').status_code, 404)
+        self.assertEqual(self.client.post('/api/perfumes/async/').status_code, 405)
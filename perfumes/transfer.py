@@ -0,0 +1,402 @@
+"""
+Bulk export and import of the catalog.
+
+Exports stream perfume and offer rows as NDJSON or CSV straight from a
+chunked ``.values().iterator()`` query, so memory stays flat however large
+the catalog is. Related rows are exported by name (brand, category, gender)
+or email (users), which is also what the importer reads.
+
+The importer reads CSV or NDJSON feeds row by row and writes them
+``batch_size`` rows at a time, each batch in its own transaction with
+``bulk_create`` / ``bulk_update``. Rows that change nothing are not written,
+and only the columns that did change are updated. Brand, category and gender names are
+resolved through in-memory maps, missing ones are created in bulk. Perfumes
+are matched by ``id`` or else by brand and name, offers by ``id``; anything
+unmatched is created. Invalid rows are reported by line and skipped.
+
+bulk_create and bulk_update send no signals, so the importer itself keeps
+the search index and the offer summaries current and bumps the cache.
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from accounts.models import Account
+from djangoPerfumes.cache import invalidate
+from perfumes import search
+from perfumes.models import Brand, Category, Gender, Perfume, Offer
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# kind: (model, {column: the value exported for it})
+EXPORTS = {
+    'perfumes': (Perfume, {
+        'id': 'id', 'name': 'name', 'brand': 'brand__name', 'category': 'category__name',
+        'gender': 'gender__name', 'user': 'user__email', 'price': 'price', 'type': 'type',
+        'first_note': 'first_note', 'heart_note': 'heart_note', 'last_note': 'last_note',
+        'description': 'description', 'created_at': 'created_at', 'updated_at': 'updated_at',
+    }),
+    'offers': (Offer, {
+        'id': 'id', 'perfume': 'perfume_id', 'perfume_name': 'perfume__name', 'brand': 'brand__name',
+        'seller': 'seller__email', 'description': 'description', 'quantity': 'quantity',
+        'price_per_ml': 'price_per_ml', 'created_at': 'created_at', 'updated_at': 'updated_at',
+    }),
+}
+
+# errors kept in an ImportReport, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class _Echo:
+    # csv.writer target that hands every formatted line back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, chunk_size=None, using=DEFAULT_DB_ALIAS):
+    model, columns = EXPORTS[kind]
+    rows = model.objects.using(using).order_by('pk').values_list(*columns.values())
+    for row in rows.iterator(chunk_size=chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE):
+        yield dict(zip(columns, row))
+
+
+def export_lines(kind, file_format, chunk_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    The rows of ``kind`` formatted as ``file_format``, one string per line.
+    """
+    rows = export_rows(kind, chunk_size, using)
+    if file_format == 'ndjson':
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+    else:
+        writer = csv.DictWriter(_Echo(), fieldnames=list(EXPORTS[kind][1]))
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+
+
+def read_rows(file, file_format):
+    """
+    (line number, row dict) of every row of a CSV or NDJSON feed, read
+    lazily from a text or binary file.
+    """
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    row = {'__error__': f'Invalid JSON: {e}'}
+                yield line_number, row if isinstance(row, dict) else {'__error__': 'Expected a JSON object.'}
+
+
+class NameMap:
+    """
+    name -> id of a lookup table (brands, categories, genders), loaded once
+    and extended with the new names a feed brings in.
+    """
+
+    def __init__(self, model, using):
+        self.model = model
+        self.using = using
+        self.ids = dict(model.objects.using(using).values_list('name', 'pk'))
+        self.created = 0
+
+    def resolve(self, names):
+        missing = {name for name in names if name and name not in self.ids}
+        if missing:
+            self.model.objects.using(self.using).bulk_create([self.model(name=name) for name in missing],
+                                                             ignore_conflicts=True)
+            created = dict(self.model.objects.using(self.using).filter(name__in=missing).values_list('name', 'pk'))
+            self.ids.update(created)
+            self.created += len(created)
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, messages):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': messages})
+
+    def as_dict(self):
+        return {'created': self.created, 'updated': self.updated, 'unchanged': self.unchanged,
+                'error_count': self.error_count,
+                'errors': self.errors}
+
+
+class Importer:
+    model = None
+    # model fields read as they are from the columns of the same name
+    fields = ()
+
+    def __init__(self, user=None, batch_size=None, using=DEFAULT_DB_ALIAS):
+        self.user = user
+        self.batch_size = batch_size or settings.CATALOG_IMPORT_BATCH_SIZE
+        self.using = using
+        self.brands = NameMap(Brand, using)
+        self.report = ImportReport()
+
+    def run(self, rows):
+        batch = []
+        for line, row in rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        self.finish()
+        return self.report
+
+    def import_batch(self, batch):
+        parsed = []
+        for line, row in batch:
+            try:
+                if '__error__' in row:
+                    raise ValidationError(row['__error__'])
+                parsed.append((line, self.parse(row)))
+            except ValidationError as e:
+                self.report.error(line, e.messages)
+        with transaction.atomic(using=self.using):
+            self.write(parsed)
+
+    def clean(self, row):
+        values = {}
+        for name in self.fields:
+            if name not in row:
+                continue
+            field = self.model._meta.get_field(name)
+            value = row[name]
+            if isinstance(value, str):
+                value = value.strip()
+            elif isinstance(value, float):
+                # 12.5, not the 12.4999... a float holds
+                value = str(value)
+            if value in ('', None) and field.null:
+                values[name] = None
+                continue
+            try:
+                values[name] = field.clean(value, None)
+            except ValidationError as e:
+                raise ValidationError([f'{name}: {message}' for message in e.messages])
+        return values
+
+    @staticmethod
+    def reference(row, column, required=True):
+        value = str(row.get(column) or '').strip()
+        if required and not value:
+            raise ValidationError(f'{column}: This field is required.')
+        return value
+
+    def row_id(self, row):
+        try:
+            return int(row['id']) if str(row.get('id') or '').strip() else None
+        except ValueError:
+            raise ValidationError('id: Enter a whole number.')
+
+    @staticmethod
+    def assign(instance, values):
+        """
+        Set ``values`` (attname: value) on ``instance`` and return the names of
+        the fields that changed.
+        """
+        changed = set()
+        for attname, value in values.items():
+            if getattr(instance, attname) != value:
+                setattr(instance, attname, value)
+                changed.add(attname[:-3] if attname.endswith('_id') else attname)
+        return changed
+
+    def accounts(self, emails):
+        emails = {email for email in emails if email}
+        return dict(Account.objects.using(self.using).filter(email__in=emails).values_list('email', 'pk'))
+
+    def save(self, new, changed, fields):
+        # no batch_size, bulk_create makes its inserts as large as the database allows
+        self.model.objects.using(self.using).bulk_create(new)
+        now = timezone.now()
+        for instance in changed:
+            instance.updated_at = now
+        if changed and fields:
+            self.model.objects.using(self.using).bulk_update(changed, [*fields, 'updated_at'],
+                                                             batch_size=self.batch_size)
+        self.report.created += len(new)
+        self.report.updated += len(changed)
+
+    def finish(self):
+        invalidate('perfume', 'offer', using=self.using)
+        if self.brands.created:
+            invalidate('brand', using=self.using)
+
+
+class PerfumeImporter(Importer):
+    model = Perfume
+    fields = ('name', 'price', 'type', 'first_note', 'heart_note', 'last_note', 'description')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.categories = NameMap(Category, self.using)
+        self.genders = NameMap(Gender, self.using)
+
+    def parse(self, row):
+        values = self.clean(row)
+        if not values.get('name'):
+            raise ValidationError('name: This field is required.')
+        return {
+            'id': self.row_id(row),
+            'values': values,
+            'brand': self.reference(row, 'brand'),
+            'category': self.reference(row, 'category'),
+            'gender': self.reference(row, 'gender'),
+            'user': self.reference(row, 'user', required=self.user is None),
+        }
+
+    def write(self, parsed):
+        self.brands.resolve(row['brand'] for _, row in parsed)
+        self.categories.resolve(row['category'] for _, row in parsed)
+        self.genders.resolve(row['gender'] for _, row in parsed)
+        users = self.accounts(row['user'] for _, row in parsed)
+        perfumes = Perfume.objects.using(self.using)
+        by_id = perfumes.in_bulk([row['id'] for _, row in parsed if row['id']])
+        by_name = {
+            (perfume.brand_id, perfume.name): perfume
+            for perfume in perfumes.filter(name__in={row['values']['name'] for _, row in parsed},
+                                           brand_id__in={self.brands[row['brand']] for _, row in parsed})
+        }
+
+        new, changed, fields, unchanged, reindex = {}, {}, set(), set(), set()
+        for line, row in parsed:
+            if row['user'] and row['user'] not in users:
+                self.report.error(line, [f'user: No account with the email {row["user"]}.'])
+                continue
+            brand_id = self.brands[row['brand']]
+            key = (brand_id, row['values']['name'])
+            perfume = by_id.get(row['id']) or by_name.get(key) or new.get(key)
+            if perfume is None:
+                perfume = new[key] = Perfume(user_id=users.get(row['user'], getattr(self.user, 'pk', None)))
+            values = {**row['values'], 'brand_id': brand_id, 'category_id': self.categories[row['category']],
+                      'gender_id': self.genders[row['gender']]}
+            if row['user']:
+                values['user_id'] = users[row['user']]
+            updated = self.assign(perfume, values)
+            if perfume.pk:
+                if updated:
+                    changed[perfume.pk] = perfume
+                    fields.update(updated)
+                    if updated.intersection(search.SEARCH_COLUMNS):
+                        reindex.add(perfume.pk)
+                elif perfume.pk not in changed:
+                    unchanged.add(perfume.pk)
+            by_name[(perfume.brand_id, perfume.name)] = perfume
+
+        self.report.unchanged += len(unchanged - changed.keys())
+        self.save(list(new.values()), list(changed.values()), fields)
+        reindex.update(perfume.pk for perfume in new.values())
+        search.index_perfumes(perfumes.filter(pk__in=reindex).select_related('brand'), self.using)
+
+    def finish(self):
+        super().finish()
+        if self.categories.created:
+            invalidate('category', using=self.using)
+        if self.genders.created:
+            invalidate('gender', using=self.using)
+
+
+class OfferImporter(Importer):
+    model = Offer
+    fields = ('description', 'quantity', 'price_per_ml')
+
+    def parse(self, row):
+        values = self.clean(row)
+        perfume = str(row.get('perfume') or '').strip()
+        try:
+            perfume = int(perfume) if perfume else None
+        except ValueError:
+            raise ValidationError('perfume: Enter a whole number.')
+        if perfume is None and not (row.get('perfume_name') and row.get('brand')):
+            raise ValidationError('perfume: Give the perfume id, or perfume_name and brand.')
+        return {
+            'id': self.row_id(row),
+            'values': values,
+            'perfume': perfume,
+            'perfume_name': self.reference(row, 'perfume_name', required=False),
+            'brand': self.reference(row, 'brand', required=False),
+            'seller': self.reference(row, 'seller', required=self.user is None),
+        }
+
+    def write(self, parsed):
+        perfumes = Perfume.objects.using(self.using).only('pk', 'name', 'brand_id', 'category_id')
+        by_id = perfumes.in_bulk([row['perfume'] for _, row in parsed if row['perfume']])
+        named = [row for _, row in parsed if not row['perfume'] and row['brand'] in self.brands.ids]
+        by_name = {
+            (perfume.brand_id, perfume.name): perfume
+            for perfume in perfumes.filter(name__in={row['perfume_name'] for row in named},
+                                           brand_id__in={self.brands[row['brand']] for row in named})
+        }
+        sellers = self.accounts(row['seller'] for _, row in parsed)
+        offers = Offer.objects.using(self.using).in_bulk([row['id'] for _, row in parsed if row['id']])
+
+        new, changed, fields, summaries, unchanged = [], {}, set(), set(), set()
+        for line, row in parsed:
+            if row['perfume']:
+                perfume = by_id.get(row['perfume'])
+            else:
+                perfume = by_name.get((self.brands.ids.get(row['brand']), row['perfume_name']))
+            if perfume is None:
+                self.report.error(line, ['perfume: No such perfume.'])
+                continue
+            if row['seller'] and row['seller'] not in sellers:
+                self.report.error(line, [f'seller: No account with the email {row["seller"]}.'])
+                continue
+            offer = offers.get(row['id'])
+            missing = [name for name in ('description', 'price_per_ml') if row['values'].get(name) is None]
+            if offer is None and missing:
+                self.report.error(line, [f'{name}: This field is required.' for name in missing])
+                continue
+            if offer is None:
+                offer = Offer(seller_id=sellers.get(row['seller'], getattr(self.user, 'pk', None)))
+                new.append(offer)
+            previous_perfume = offer.perfume_id
+            # like OfferSerializer.create, an offer is of its perfume's brand and category
+            values = {**row['values'], 'perfume_id': perfume.pk, 'brand_id': perfume.brand_id,
+                      'category_id': perfume.category_id}
+            if row['seller']:
+                values['seller_id'] = sellers[row['seller']]
+            updated = self.assign(offer, values)
+            if offer.pk:
+                if not updated:
+                    unchanged.add(offer.pk)
+                    continue
+                changed[offer.pk] = offer
+                fields.update(updated)
+                summaries.add(previous_perfume)
+            summaries.add(perfume.pk)
+
+        self.report.unchanged += len(unchanged - changed.keys())
+        self.save(new, list(changed.values()), fields)
+        Perfume.objects.using(self.using).filter(pk__in=summaries).refresh_offer_summary()
+
+
+IMPORTERS = {'perfumes': PerfumeImporter, 'offers': OfferImporter}
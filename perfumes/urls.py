@@ -1,7 +1,9 @@
 from django.urls import path
 
+from perfumes import async_views
 from perfumes.views import perfume_list, brand_list, OfferAPIView, OfferDetailAPIView, \
-    category_list, perfume_detail, review_list_create, review_replies, filteredProductsView
+    category_list, perfume_detail, review_list_create, review_replies, filteredProductsView, \
+    perfume_facets, catalog_export, catalog_import
 
 urlpatterns = [
     path('', perfume_list, name='perfume-list'),
@@ -16,5 +18,13 @@ urlpatterns = [
     path('reviews/<int:review_id>/replies/', review_replies, name='review-replies'),
 
     path('filtered-products/', filteredProductsView, name='filtered-products'),
+    path('facets/', perfume_facets, name='perfume-facets'),
+    path('export/<slug:kind>.<slug:file_format>', catalog_export, name='catalog-export'),
+    path('import/<slug:kind>/', catalog_import, name='catalog-import'),
+
+    path('async/', async_views.perfume_list, name='perfume-list-async'),
+    path('async/<int:pk>/', async_views.perfume_detail, name='perfume-detail-async'),
+    path('async/offers/<int:perfume_id>/', async_views.perfume_offers, name='offer-list-perfume-async'),
+    path('async/reviews/<int:perfume_id>/', async_views.perfume_reviews, name='review-list-async'),
 
 ]
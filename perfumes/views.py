@@ -1,97 +1,159 @@
+import math
+import os
+
 from django.conf import settings
-from django.core.mail import send_mail
-from django.db.models import Q, Func, F, Max, Min
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from accounts.email_templates import renderer as email_renderer
 from accounts.models import Account
+from accounts.outbox import enqueue_email
+from djangoPerfumes.cache import cache_response
+from perfumes.conditional import perfume_etag, perfume_last_modified, offer_etag, offer_last_modified
+from perfumes.facets import selected_filters, filter_perfumes, count_facets
 from perfumes.models import Perfume, Brand, Offer, Review, Category, ReviewReply
+from perfumes.pagination import CatalogCursorPagination, ReviewCursorPagination, ReplyCursorPagination
+from perfumes.search import search_perfumes
 from perfumes.serializers import PerfumeSerializer, BrandSerializer, OfferSerializer, ReviewSerializer, \
-    CategorySerializer, ReviewReplySerializer
+    CategorySerializer, ReviewReplySerializer, PerfumeListSerializer
+from perfumes.transfer import EXPORTS, FORMATS, IMPORTERS, export_lines, read_rows
+
+# Everything a perfume response embeds: offers feed the price summary, reviews
+# the nested thread, brand and category their names, and the seller and review
+# authors their account and profile.
+CATALOG_CACHE_GROUPS = ('perfume', 'offer', 'review', 'brand', 'category', 'seller')
 
 
+def rating_options(queryset, paginator, query_params):
+    """
+    ``?min_rating=4`` keeps rows rated 4 or better on average and
+    ``?ordering=rating`` puts the best rated first, both from the stored
+    rating summary.
+    """
+    try:
+        min_rating = float(query_params['min_rating'])
+    except (KeyError, ValueError):
+        min_rating = None
+    # nan compares false with everything and would match nothing
+    if min_rating is not None and math.isfinite(min_rating):
+        queryset = queryset.filter(rating_average__gte=min_rating)
+    if query_params.get('ordering') == 'rating':
+        paginator.ordering = paginator.rating_ordering
+    return queryset
+
+
+def listed_perfumes(query_params, paginator):
+    """
+    The perfumes perfume_list shows for ``query_params``, with ``paginator``
+    set to the ordering they are paged in. The async view lists the same.
+    """
+    category_id = query_params.get('category_id')
+    brand_id = query_params.get('brand_id')
+    gender_id = query_params.get('gender_id')
+    perfume_name = query_params.get('perfume_name', '').strip()
+    fields = PerfumeListSerializer.rendered_fields(query_params)
+    perfumes = Perfume.objects.for_catalog(fields)
+
+    if perfume_name:
+        perfumes = search_perfumes(perfumes, perfume_name)
+        paginator.ordering = paginator.search_ordering
+    if category_id:
+        perfumes = perfumes.filter(category__id=category_id)
+    if brand_id:
+        perfumes = perfumes.filter(brand__id=brand_id)
+    if gender_id:
+        perfumes = perfumes.filter(gender__id=gender_id)
+    return rating_options(perfumes, paginator, query_params)
+
+
+def listed_offers(query_params, perfume_id):
+    offers = Offer.objects.for_catalog(OfferSerializer.rendered_fields(query_params)).filter(perfume=perfume_id)
+    if query_params.get('ordering') == 'rating':
+        offers = offers.order_by('-rating_average', '-rating_count', 'pk')
+    return offers
+
+
+def listed_reviews(query_params, perfume_id, paginator):
+    """
+    The reviews review_list_create shows for ``query_params``, with
+    ``paginator`` set to the ordering they are paged in.
+    """
+    offer_id = query_params.get('offerId')
+    reviews = Review.objects.for_catalog(ReviewSerializer.rendered_fields(query_params),
+                                         replies=settings.REVIEW_REPLIES_PREVIEW)
+    if offer_id:
+        reviews = reviews.filter(offer_id=offer_id)
+    else:
+        reviews = reviews.filter(perfume=perfume_id)
+    if query_params.get('ordering') == 'top':
+        reviews = reviews.annotate(top_rating=Coalesce('rating', 0))
+        paginator.ordering = paginator.top_ordering
+    return reviews
+
+
+@cache_response(*CATALOG_CACHE_GROUPS)
 @api_view(['GET'])
 def perfume_list(request):
     if request.method == 'GET':
-        category_id = request.GET.get('category_id')
-        brand_id = request.GET.get('brand_id')
-        gender_id = request.GET.get('gender_id')
-        perfume_name = request.GET.get('perfume_name', '').strip()
-        perfumes = Perfume.objects.all()
-
-        if perfume_name:
-            processed_perfume_name = perfume_name.replace(" ", "").lower()
-            potential_splits = [perfume_name[i: j] for i in range(len(perfume_name)) for j in
-                                range(i + 1, len(perfume_name) + 1)]
-            potential_splits = set(filter(lambda x: len(x) > 3, potential_splits))
-            search_queries = [
-                Q(name__icontains=part) |
-                Q(description__icontains=part) |
-                Q(first_note__icontains=part) |
-                Q(heart_note__icontains=part) |
-                Q(last_note__icontains=part)
-                for part in potential_splits
-            ]
-
-            combined_query = Q(processed_name__contains=processed_perfume_name)
-            for query in search_queries:
-                combined_query |= query
-            perfumes = perfumes.annotate(
-                processed_name=Func(
-                    F('name'),
-                    function='LOWER',
-                    template='%(function)s(REPLACE(%(expressions)s, \' \', \'\'))'
-                )
-            ).filter(combined_query)
-        if category_id:
-            perfumes = perfumes.filter(category__id=category_id)
-        if brand_id:
-            perfumes = perfumes.filter(brand__id=brand_id)
-        if gender_id:
-            perfumes = perfumes.filter(gender__id=gender_id)
-        serializer = PerfumeSerializer(perfumes, many=True)
+        paginator = CatalogCursorPagination()
+        perfumes = listed_perfumes(request.query_params, paginator)
+        page = paginator.paginate_queryset(perfumes, request)
+        serializer = PerfumeListSerializer(page, many=True, context={'query_params': request.query_params})
 
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
     else:
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@cache_response(*CATALOG_CACHE_GROUPS)
 @api_view(['GET'])
 def filteredProductsView(request):
     if request.method == 'GET':
-        selected_categories = list(filter(None, request.query_params.get('selectedCategories', '').split(',')))
-        selected_brands = list(filter(None, request.query_params.get('selectedBrands', '').split(',')))
-        selected_gender = request.query_params.get('selectedGender')
-        perfumes = Perfume.objects.all()
-        if selected_categories:
-            perfumes = perfumes.filter(category_id__in=selected_categories)
-        if selected_brands:
-            perfumes = perfumes.filter(brand_id__in=selected_brands)
-        if selected_gender:
-            perfumes = perfumes.filter(gender_id=selected_gender)
-        serializer = PerfumeSerializer(perfumes, many=True)
-        return Response(serializer.data)
+        fields = PerfumeListSerializer.rendered_fields(request.query_params)
+        perfumes = filter_perfumes(Perfume.objects.for_catalog(fields), selected_filters(request.query_params))
+        paginator = CatalogCursorPagination()
+        perfumes = rating_options(perfumes, paginator, request.query_params)
+        page = paginator.paginate_queryset(perfumes, request)
+        serializer = PerfumeListSerializer(page, many=True, context={'query_params': request.query_params})
+        return paginator.get_paginated_response(serializer.data)
     else:
         return Response({'error': 'This method is not allowed'}, status=405)
 
 
+@cache_response('perfume', 'brand', 'category', 'gender')
+@api_view(['GET'])
+def perfume_facets(request):
+    """
+    Match counts for every category, brand and gender under the current
+    selectedCategories / selectedBrands / selectedGender filters.
+    """
+    return Response(count_facets(selected_filters(request.query_params)))
+
+
+@condition(etag_func=perfume_etag, last_modified_func=perfume_last_modified)
+@cache_response(*CATALOG_CACHE_GROUPS)
 @api_view(['GET', 'PUT', 'DELETE'])
 def perfume_detail(request, pk):
     """
     Retrieve, update or delete a perfume instance.
     """
+    fields = PerfumeSerializer.rendered_fields(request.query_params) if request.method == 'GET' else None
     try:
-        perfume = Perfume.objects.get(pk=pk)
+        perfume = Perfume.objects.for_catalog(fields).get(pk=pk)
     except Perfume.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        serializer = PerfumeSerializer(perfume)
+        serializer = PerfumeSerializer(perfume, context={'query_params': request.query_params})
         return Response(serializer.data)
 
     elif request.method == 'PUT':
@@ -106,6 +168,7 @@ def perfume_detail(request, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@cache_response('category')
 @api_view(['GET'])
 def category_list(request):
     if request.method == 'GET':
@@ -116,6 +179,7 @@ def category_list(request):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@cache_response('brand')
 @api_view(['GET'])
 def brand_list(request):
     if request.method == 'GET':
@@ -129,13 +193,14 @@ def brand_list(request):
 class OfferAPIView(APIView):
     def get(self, request, perfume_id=None):
         offer_user = request.query_params.get('offer-user')
+        fields = OfferSerializer.rendered_fields(request.query_params)
         if offer_user and str(request.user) != 'AnonymousUser':
-            offers = Offer.objects.filter(seller=request.user)
-            serializer = OfferSerializer(offers, many=True)
+            offers = Offer.objects.for_catalog(fields).filter(seller=request.user)
+            serializer = OfferSerializer(offers, many=True, context={'query_params': request.query_params})
             return Response(serializer.data)
         perfume = get_object_or_404(Perfume, pk=perfume_id)
-        offers = Offer.objects.filter(perfume=perfume)
-        serializer = OfferSerializer(offers, many=True)
+        offers = listed_offers(request.query_params, perfume.pk)
+        serializer = OfferSerializer(offers, many=True, context={'query_params': request.query_params})
         return Response(serializer.data)
 
     def post(self, request):
@@ -143,18 +208,18 @@ class OfferAPIView(APIView):
         serializer = OfferSerializer(data=request.data)
         user = Account.objects.get(email=request.data['seller'])
         if serializer.is_valid():
-            offer = serializer.save(seller=user)
-
-            subject = 'Your Offer Has Been Created'
-            html_content = render_to_string('emails/email_offer_created.html', {'offer': offer})
-            send_mail(
-                subject,
-                'An offer has been created.',
-                settings.EMAIL_HOST_USER,
-                [request.user.email],
-                html_message=html_content,
-                fail_silently=False,
-            )
+            with transaction.atomic():
+                offer = serializer.save(seller=user)
+
+                subject = 'Your Offer Has Been Created'
+                html_content = email_renderer.render('emails/email_offer_created.html', {'offer': offer})
+                enqueue_email(
+                    request.user.email,
+                    subject,
+                    'An offer has been created.',
+                    html_body=html_content,
+                    dedup_key=f'offer-created:{offer.pk}',
+                )
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -164,14 +229,16 @@ class OfferAPIView(APIView):
 class OfferDetailAPIView(APIView):
     # permission_classes = [IsAuthenticated]
 
+    @method_decorator(condition(etag_func=offer_etag, last_modified_func=offer_last_modified))
     def get(self, request, offer_id):
 
-        offer = Offer.objects.filter(pk=offer_id).first()
+        fields = OfferSerializer.rendered_fields(request.query_params)
+        offer = Offer.objects.for_catalog(fields).filter(pk=offer_id).first()
 
         if not offer:
             return Response({'detail': 'Offer not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = OfferSerializer(offer)
+        serializer = OfferSerializer(offer, context={'query_params': request.query_params})
         return Response(serializer.data)
 
     def put(self, request, offer_id):
@@ -203,13 +270,12 @@ class OfferDetailAPIView(APIView):
 @api_view(['GET', 'POST', 'DELETE'])
 def review_list_create(request, perfume_id, review_id=None):
     if request.method == 'GET':
-        offer_id = request.query_params.get('offerId')
-        if offer_id:
-            reviews = Review.objects.filter(offer_id=offer_id)
-        else:
-            reviews = Review.objects.filter(perfume=perfume_id)
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        paginator = ReviewCursorPagination()
+        reviews = listed_reviews(request.query_params, perfume_id, paginator)
+        page = paginator.paginate_queryset(reviews, request)
+        serializer = ReviewSerializer(page, many=True, context={'request': request,
+                                                                'query_params': request.query_params})
+        return paginator.get_paginated_response(serializer.data)
 
     elif request.method == 'POST':
         permission_classes([IsAuthenticated])
@@ -247,9 +313,11 @@ def review_list_create(request, perfume_id, review_id=None):
 def review_replies(request, review_id):
     review = get_object_or_404(Review, id=review_id)
     if request.method == 'GET':
-        replies = ReviewReply.objects.filter(review=review)
-        serializer = ReviewReplySerializer(replies, many=True, context={'request': request})
-        return Response(serializer.data)
+        replies = ReviewReply.objects.filter(review=review).select_related('user__userprofile')
+        paginator = ReplyCursorPagination()
+        page = paginator.paginate_queryset(replies, request)
+        serializer = ReviewReplySerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     elif request.method == 'POST':
         permission_classes([IsAuthenticated])
@@ -270,3 +338,36 @@ def review_replies(request, review_id):
         reply = get_object_or_404(ReviewReply, id=reply_id, review=review)
         reply.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def catalog_export(request, kind, file_format):
+    """
+    Stream every perfume or offer as NDJSON or CSV, see perfumes.transfer.
+    """
+    if kind not in EXPORTS or file_format not in FORMATS:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    response = StreamingHttpResponse(export_lines(kind, file_format), content_type=FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{file_format}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def catalog_import(request, kind):
+    """
+    Import the CSV or NDJSON feed uploaded as ``file``. The format comes from
+    the file name unless ``file_format`` is given; rows without a user or
+    seller are assigned to the importing admin.
+    """
+    feed = request.FILES.get('file')
+    if kind not in IMPORTERS:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    if feed is None:
+        return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+    file_format = request.data.get('file_format') or os.path.splitext(feed.name)[1].lstrip('.').lower()
+    if file_format not in FORMATS:
+        return Response({'file_format': [f'Use one of {", ".join(FORMATS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+    report = IMPORTERS[kind](user=request.user).run(read_rows(feed.file, file_format))
+    return Response(report.as_dict())